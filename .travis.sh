@@ -113,6 +113,16 @@ elif [ "${1}" == "test" ]; then
     # fi
     echo Great Success! && exit 0
 
+elif [ "${1}" == "benchmark" ]; then
+    echo Run router config benchmark
+    # wall time is not checked, shared CI machines are much slower than the machine the baseline was recorded on
+    docker run --env NO_KUBE_CONFIG=1 --rm --entrypoint '/bin/bash' \
+        --env BENCHMARK_CHECK_METRICS=peak_memory,size --env BENCHMARK_ROUTE_COUNTS=100,1000 --env BENCHMARK_ITERATIONS=1 \
+        ckan-cloud-operator \
+        -lc 'cd /cco && BENCHMARK_BASELINE_FILE="scripts/benchmark router config baseline.json" python3 "scripts/benchmark router config.py"'
+    [ "$?" != "0" ] && echo Router config benchmark regressed && exit 1
+    echo Great Success! && exit 0
+
 elif [ "${1}" == "deploy" ]; then
     docker tag ckan-cloud-operator "viderum/ckan-cloud-operator:${TAG}" &&\
     echo && echo "viderum/ckan-cloud-operator:${TAG}" && echo &&\
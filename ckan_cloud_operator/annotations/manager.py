@@ -1,3 +1,4 @@
+import contextlib
 import datetime
 
 from ckan_cloud_operator import kubectl
@@ -5,6 +6,9 @@ from ckan_cloud_operator import kubectl
 from ckan_cloud_operator.labels import manager as labels_manager
 
 
+__BATCHES = {}
+
+
 def get_global_annotations(with_timestamp=True):
     label_prefix = labels_manager.get_label_prefix()
     return {
@@ -29,17 +33,52 @@ def get_status(resource, prefix, status=None):
         return list(statuses)
 
 
+@contextlib.contextmanager
+def batch(resource):
+    """Collect all annotation changes to the resource made in the block and save them using a single patch"""
+    key = _get_batch_key(resource)
+    is_outer_batch = key not in __BATCHES
+    if is_outer_batch:
+        __BATCHES[key] = {}
+    try:
+        yield resource
+    finally:
+        if is_outer_batch:
+            annotations = __BATCHES.pop(key)
+            if annotations:
+                _patch_annotations(resource, annotations)
+
+
 def _annotate(resource, *annotations, overwrite=True):
     label_prefix = labels_manager.get_label_prefix()
-    kind = resource['kind']
-    namespace = resource['metadata']['namespace']
-    name = resource['metadata']['name']
-    cmd = f'annotate {kind} {name}'
-    for annotation in annotations:
-        cmd += f' {label_prefix}/{annotation}'
-    if overwrite:
-        cmd += ' --overwrite'
-    kubectl.check_call(cmd, namespace)
+    annotations = dict(
+        (f'{label_prefix}/{k}', v) for k, v
+        in (kubectl.parse_annotation(annotation) for annotation in annotations)
+    )
+    current_annotations = resource['metadata'].get('annotations') or {}
+    if not overwrite:
+        for k, v in annotations.items():
+            assert current_annotations.get(k, v) == v, f'annotation {k} already has a value and overwrite is false'
+    resource['metadata'].setdefault('annotations', {}).update(**annotations)
+    batch_annotations = __BATCHES.get(_get_batch_key(resource))
+    if batch_annotations is not None:
+        batch_annotations.update(**annotations)
+    else:
+        _patch_annotations(resource, annotations)
+
+
+def _patch_annotations(resource, annotations):
+    patched_resource = kubectl.patch_annotations(
+        resource['kind'], resource['metadata']['name'], annotations,
+        namespace=resource['metadata']['namespace'],
+        resource_version=resource['metadata'].get('resourceVersion')
+    )
+    if patched_resource:
+        resource['metadata']['resourceVersion'] = patched_resource['metadata']['resourceVersion']
+
+
+def _get_batch_key(resource):
+    return resource['kind'], resource['metadata']['namespace'], resource['metadata']['name']
 
 
 def _get_annotation(resource, annotation, default=None):
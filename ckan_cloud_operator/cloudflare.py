@@ -1,9 +1,32 @@
+import os
+import time
+import random
+import threading
 import subprocess
 import json
+from concurrent.futures import ThreadPoolExecutor
 
 from ckan_cloud_operator import logs
 
 
+# number of concurrent cloudflare api requests when updating multiple records
+CONCURRENCY = int(os.environ.get('CKAN_CLOUD_OPERATOR_CLOUDFLARE_CONCURRENCY', '4'))
+
+# rate limited requests are retried after RETRY_BASE_DELAY_SECONDS * 2^retries (with jitter), up to MAX_RETRIES
+MAX_RETRIES = int(os.environ.get('CKAN_CLOUD_OPERATOR_CLOUDFLARE_MAX_RETRIES', '6'))
+RETRY_BASE_DELAY_SECONDS = float(os.environ.get('CKAN_CLOUD_OPERATOR_CLOUDFLARE_RETRY_BASE_DELAY', '1'))
+
+# zone records are listed once and cached for this number of seconds
+ZONE_RECORDS_CACHE_SECONDS = float(os.environ.get('CKAN_CLOUD_OPERATOR_CLOUDFLARE_ZONE_RECORDS_CACHE', '60'))
+
+# cloudflare error codes which mean the request was rate limited
+RATE_LIMIT_ERROR_CODES = {971, 10000, 10100}
+
+_zone_ids = {}
+_zone_records = {}
+_zone_records_lock = threading.Lock()
+
+
 def get_zone_id(auth_email, auth_key, zone_name):
     data = curl(auth_email, auth_key, 'zones?name=%s' % zone_name)
     zones = [zone['id'] for zone in data['result'] if zone['name'] == zone_name]
@@ -42,6 +65,80 @@ def update_a_record(auth_email, auth_key, zone_name, record_name, target_ip):
     assert data.get('success')
 
 
+def update_records(auth_email, auth_key, zone_name, records):
+    """Create or update multiple records in a zone, records is a dict of record name -> target ip or hostname
+
+    The zone records are listed once and only records which differ from the target are written, concurrently.
+    Returns a dict with lists of created, updated and unchanged record names.
+    """
+    zone_id = _get_cached_zone_id(auth_email, auth_key, zone_name)
+    assert zone_id is not None, f'Invalid zone name: {zone_name}'
+    existing_records = get_zone_records(auth_email, auth_key, zone_id)
+    res = {'created': [], 'updated': [], 'unchanged': []}
+    changes = []
+    for record_name, target_ip in sorted(records.items()):
+        cf_record = {'type': 'A' if is_ip(target_ip) else 'CNAME',
+                     'name': record_name, 'content': target_ip, 'ttl': 120, 'proxied': False}
+        existing_record = existing_records.get(record_name)
+        if not existing_record:
+            res['created'].append(record_name)
+            changes.append((f'zones/{zone_id}/dns_records', cf_record, 'POST'))
+        elif any(existing_record.get(k) != cf_record[k] for k in ['type', 'content', 'proxied']):
+            res['updated'].append(record_name)
+            changes.append((f'zones/{zone_id}/dns_records/{existing_record["id"]}', cf_record, 'PUT'))
+        else:
+            res['unchanged'].append(record_name)
+    logs.info(f'Cloudflare zone {zone_name} records', created=len(res['created']), updated=len(res['updated']),
+              unchanged=len(res['unchanged']))
+    if changes:
+        with ThreadPoolExecutor(CONCURRENCY) as executor:
+            results = list(executor.map(lambda change: curl_with_backoff(auth_email, auth_key, *change), changes))
+        with _zone_records_lock:
+            cached_records = _zone_records.get(zone_id, (None, {}))[1]
+            for data in results:
+                assert data.get('success'), f'Failed to update cloudflare record: {data.get("errors")}'
+                cached_records[data['result']['name']] = data['result']
+    return res
+
+
+def get_zone_records(auth_email, auth_key, zone_id):
+    """Returns a dict of record name -> record of all the records in the zone, cached for ZONE_RECORDS_CACHE_SECONDS"""
+    with _zone_records_lock:
+        cached_at, records = _zone_records.get(zone_id, (None, None))
+        if cached_at and time.time() - cached_at < ZONE_RECORDS_CACHE_SECONDS:
+            return records
+    records, page = {}, 1
+    while True:
+        data = curl_with_backoff(auth_email, auth_key, f'zones/{zone_id}/dns_records?page={page}&per_page=100')
+        assert data.get('success'), f'Failed to list cloudflare records: {data.get("errors")}'
+        for record in data['result']:
+            records[record['name']] = record
+        if page >= data.get('result_info', {}).get('total_pages', 1):
+            break
+        page += 1
+    with _zone_records_lock:
+        _zone_records[zone_id] = (time.time(), records)
+    return records
+
+
+def curl_with_backoff(auth_email, auth_key, urlpart, data=None, method='GET'):
+    """curl which retries rate limited requests with exponential backoff"""
+    for retries in range(MAX_RETRIES + 1):
+        res = curl(auth_email, auth_key, urlpart, data, method)
+        error_codes = {error.get('code') for error in res.get('errors') or []}
+        if res.get('success') or not error_codes & RATE_LIMIT_ERROR_CODES or retries == MAX_RETRIES:
+            return res
+        delay = RETRY_BASE_DELAY_SECONDS * 2 ** retries * (1 + random.random())
+        logs.warning(f'Cloudflare rate limited, retrying in {delay:.1f} seconds', urlpart=urlpart, retries=retries)
+        time.sleep(delay)
+
+
+def _get_cached_zone_id(auth_email, auth_key, zone_name):
+    if not _zone_ids.get(zone_name):
+        _zone_ids[zone_name] = get_zone_id(auth_email, auth_key, zone_name)
+    return _zone_ids[zone_name]
+
+
 def curl(auth_email, auth_key, urlpart, data=None, method='GET'):
     logs.info(f'Running Cloudflare curl: {urlpart} {data} {method}')
     logs.debug(f'{auth_email} / {auth_key}')
@@ -64,3 +64,19 @@ def delete_key(key, secret_name, namespace):
 def list_configs(full, show_secrets):
     for config in manager.list_configs(full=full, show_secrets=show_secrets):
         print(yaml.dump([config], default_flow_style=False))
+
+
+@config.command()
+def cache_clear():
+    """Clear the config cache, including the on-disk cache if enabled"""
+    manager.clear_cache()
+    logs.exit_great_success()
+
+
+@config.command()
+def cache_generate_key():
+    """Generate a key for the encrypted on-disk config cache
+
+    Set it in CKAN_CLOUD_OPERATOR_CONFIG_CACHE_FILE_KEY together with the cache file path in CKAN_CLOUD_OPERATOR_CONFIG_CACHE_FILE
+    """
+    print(manager.generate_cache_file_key())
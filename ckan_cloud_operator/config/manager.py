@@ -1,6 +1,10 @@
+import atexit
 import base64
+import json
 import os
+import time
 import yaml
+from distutils.util import strtobool
 from sys import stdout
 
 from ckan_cloud_operator import kubectl
@@ -10,17 +14,34 @@ from ckan_cloud_operator.providers.cluster import manager as cluster_manager
 from ckan_cloud_operator.labels import manager as labels_manager
 
 
+# seconds to keep fetched configs in memory, 0 to keep them until the process exits
+CONFIG_CACHE_TTL_SECONDS = int(os.environ.get('CKAN_CLOUD_OPERATOR_CONFIG_CACHE_TTL', '300'))
+
+# fetch all the operator configs of a namespace in a single list call on first access to the namespace
+CONFIG_CACHE_PREFETCH = strtobool(os.environ.get('CKAN_CLOUD_OPERATOR_CONFIG_CACHE_PREFETCH', 'n'))
+
+# optional encrypted on-disk cache shared between consecutive CLI invocations
+# requires the cryptography package and a key generated using `ckan-cloud-operator config cache-generate-key`
+CONFIG_CACHE_FILE = os.environ.get('CKAN_CLOUD_OPERATOR_CONFIG_CACHE_FILE', '').strip()
+CONFIG_CACHE_FILE_KEY = os.environ.get('CKAN_CLOUD_OPERATOR_CONFIG_CACHE_FILE_KEY', '').strip()
+
+
 __CACHED_VALUES = {}
+__CACHE_EXPIRES = {}
+__PREFETCH_EXPIRES = {}
+# namespaces which are being prefetched
+__PREFETCHING = {}
+__DISK_CACHE = {}
 
 
-def get(key=None, default=None, secret_name=None, configmap_name=None, namespace=None, required=False, template=None):
+def get(key=None, default=None, secret_name=None, configmap_name=None, namespace=None, required=False, template=None,
+        ttl=None):
     cache_key = _get_cache_key(secret_name, configmap_name, namespace)
-    if cache_key not in __CACHED_VALUES:
-        __CACHED_VALUES[cache_key] = _fetch(cache_key)
+    values = _get_cached_values(cache_key, ttl=ttl)
     if key:
-        value = __CACHED_VALUES[cache_key].get(key, default)
+        value = values.get(key, default)
     else:
-        value = __CACHED_VALUES[cache_key]
+        value = values
     assert value or not required, f'config value is required for {cache_key}:{key}'
     if template:
         if key:
@@ -59,6 +80,7 @@ def set(key=None, value=None, values=None, secret_name=None, configmap_name=None
 
 
 def delete_key(key, secret_name=None, namespace=None):
+    clear_cache(_get_cache_key(secret_name, None, namespace))
     kubectl.apply({
         'apiVersion': 'v1',
         'kind': 'Secret',
@@ -78,12 +100,63 @@ def delete_key(key, secret_name=None, namespace=None):
 
 def delete(secret_name=None, configmap_name=None, namespace=None, exists_ok=False):
     cache_key = _get_cache_key(secret_name, configmap_name, namespace)
+    clear_cache(cache_key)
     _delete(cache_key, exists_ok)
 
 
 def delete_by_extra_operator_labels(extra_operator_labels):
     labels = labels_manager.get_resource_labels(extra_operator_labels)
     labels_manager.delete_by_labels(labels, kinds=['configmap', 'secret'])
+    clear_cache()
+
+
+def prefetch(namespace=None, ttl=None):
+    """Fetch all the operator configs of the given namespace into the cache using a single list call"""
+    if not namespace: namespace = cluster_manager.get_operator_namespace_name()
+    if namespace in __PREFETCHING:
+        # the label prefix is read while prefetching, it's fetched on its own
+        return
+    __PREFETCHING[namespace] = True
+    try:
+        # the label prefix is needed to list the configs, so it's fetched first
+        label_prefix = labels_manager.get_label_prefix()
+        configs = kubectl.get('configmaps,secrets', '-l', f'{label_prefix}/operator-config-namespace={namespace}',
+                              namespace=namespace, required=False)
+    finally:
+        __PREFETCHING.pop(namespace, None)
+    num_configs = 0
+    for config in (configs or {}).get('items', []):
+        name = config['metadata']['name']
+        if config['kind'] == 'Secret':
+            cache_key, values = _get_cache_key(name, None, namespace), kubectl.decode_secret(config)
+        else:
+            cache_key, values = _get_cache_key(None, name, namespace), config.get('data') or {}
+        _set_cached_values(cache_key, values, ttl=ttl)
+        num_configs += 1
+    ttl = CONFIG_CACHE_TTL_SECONDS if ttl is None else ttl
+    __PREFETCH_EXPIRES[namespace] = time.time() + ttl if ttl else None
+    logs.debug(f'prefetched {num_configs} configs', namespace=namespace)
+
+
+def clear_cache(cache_key=None):
+    """Remove the given cache key, or all keys, from the memory cache and the disk cache (if enabled)"""
+    if CONFIG_CACHE_FILE:
+        _load_disk_cache()
+    if cache_key:
+        keys = [cache_key]
+    else:
+        keys = [*__CACHED_VALUES.keys()]
+        __PREFETCH_EXPIRES.clear()
+    for key in keys:
+        __CACHED_VALUES.pop(key, None)
+        __CACHE_EXPIRES.pop(key, None)
+    if __DISK_CACHE.get('loaded'):
+        __DISK_CACHE['dirty'] = True
+
+
+def generate_cache_file_key():
+    from cryptography.fernet import Fernet
+    return Fernet.generate_key().decode()
 
 
 def list_configs(namespace=None, full=False, show_secrets=False):
@@ -182,6 +255,95 @@ def interactive_set(default_values, secret_name=None, configmap_name=None, names
     return set(values=set_values, secret_name=secret_name, configmap_name=configmap_name, namespace=namespace, extra_operator_labels=extra_operator_labels)
 
 
+def _get_cached_values(cache_key, ttl=None):
+    if CONFIG_CACHE_FILE:
+        _load_disk_cache()
+    expires = __CACHE_EXPIRES.get(cache_key)
+    if cache_key in __CACHED_VALUES and (not expires or expires > time.time()):
+        return __CACHED_VALUES[cache_key]
+    if CONFIG_CACHE_PREFETCH:
+        _, namespace, _ = _parse_cache_key(cache_key)
+        if namespace not in __PREFETCH_EXPIRES or (__PREFETCH_EXPIRES[namespace] or float('inf')) < time.time():
+            prefetch(namespace, ttl=ttl)
+            if cache_key in __CACHED_VALUES:
+                return __CACHED_VALUES[cache_key]
+    _set_cached_values(cache_key, _fetch(cache_key), ttl=ttl)
+    return __CACHED_VALUES[cache_key]
+
+
+def _set_cached_values(cache_key, values, ttl=None):
+    ttl = CONFIG_CACHE_TTL_SECONDS if ttl is None else ttl
+    __CACHED_VALUES[cache_key] = values
+    __CACHE_EXPIRES[cache_key] = time.time() + ttl if ttl else None
+    if __DISK_CACHE.get('loaded'):
+        __DISK_CACHE['dirty'] = True
+
+
+def _get_disk_cache_fernet():
+    try:
+        from cryptography.fernet import Fernet
+    except ImportError:
+        logs.warning('cryptography package is not installed, config disk cache is disabled')
+        return None
+    if not CONFIG_CACHE_FILE_KEY:
+        logs.warning('missing CKAN_CLOUD_OPERATOR_CONFIG_CACHE_FILE_KEY, config disk cache is disabled')
+        return None
+    return Fernet(CONFIG_CACHE_FILE_KEY.encode())
+
+
+def _load_disk_cache():
+    if 'loaded' in __DISK_CACHE:
+        return
+    __DISK_CACHE['loaded'] = False
+    fernet = _get_disk_cache_fernet()
+    if not fernet:
+        return
+    __DISK_CACHE.update(loaded=True, dirty=False, fernet=fernet)
+    atexit.register(_save_disk_cache)
+    if not os.path.exists(CONFIG_CACHE_FILE):
+        return
+    try:
+        with open(CONFIG_CACHE_FILE, 'rb') as f:
+            data = json.loads(fernet.decrypt(f.read()))
+    except Exception:
+        logs.warning('failed to load config disk cache, ignoring it')
+        return
+    # the cache file may be shared between clusters, entries of other clusters are ignored
+    if data.get('kubeconfig') != _get_disk_cache_kubeconfig():
+        return
+    now = time.time()
+    for cache_key, (values, expires) in data.get('values', {}).items():
+        if expires > now and cache_key not in __CACHED_VALUES:
+            __CACHED_VALUES[cache_key] = values
+            __CACHE_EXPIRES[cache_key] = expires
+
+
+def _save_disk_cache():
+    if not __DISK_CACHE.get('dirty'):
+        return
+    now = time.time()
+    # only entries with an expiry are saved, to prevent serving stale values forever
+    data = {
+        'kubeconfig': _get_disk_cache_kubeconfig(),
+        'values': {
+            cache_key: (values, __CACHE_EXPIRES[cache_key])
+            for cache_key, values in __CACHED_VALUES.items()
+            if values and __CACHE_EXPIRES.get(cache_key) and __CACHE_EXPIRES[cache_key] > now
+        }
+    }
+    tmp_file = f'{CONFIG_CACHE_FILE}.tmp'
+    with open(os.open(tmp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'wb') as f:
+        f.write(__DISK_CACHE['fernet'].encrypt(json.dumps(data).encode()))
+    os.replace(tmp_file, CONFIG_CACHE_FILE)
+    __DISK_CACHE['dirty'] = False
+
+
+def _get_disk_cache_kubeconfig():
+    # modification time is included so that switching context invalidates the cache
+    kubeconfig = os.environ.get('KUBECONFIG', os.path.expanduser('~/.kube/config'))
+    return f'{kubeconfig}:{os.path.getmtime(kubeconfig) if os.path.exists(kubeconfig) else ""}'
+
+
 def _fetch(cache_key):
     config_type, namespace, config_name = _parse_cache_key(cache_key)
     fetch_func = {
@@ -209,7 +371,8 @@ def _save(cache_key, values, extra_operator_labels, dry_run=False):
         'configmap': lambda: _save_configmap(values, config_name, namespace, extra_operator_labels, dry_run=dry_run),
     }.get(config_type)
     assert save_func, f'Invalid config type: {config_type}'
-    __CACHED_VALUES[cache_key] = res = save_func()
+    res = save_func()
+    _set_cached_values(cache_key, res)
     return res
 
 
@@ -0,0 +1,28 @@
+import click
+
+from ckan_cloud_operator import logs
+
+from . import manager
+
+
+@click.group()
+def operator():
+    """Run the operator as a long-running controller"""
+    pass
+
+
+@operator.command()
+@click.option('--workers', type=int, default=manager.WORKERS, help='number of resources to reconcile concurrently')
+@click.option('--metrics-port', type=int, default=manager.METRICS_PORT,
+              help='serve prometheus metrics on this port, 0 to disable')
+@click.option('--skip-existing', is_flag=True, help='don\'t reconcile resources which exist on startup until they change')
+def run(workers, metrics_port, skip_existing):
+    """Watch the ckan instances, routers, routes and db migrations and reconcile changes
+
+    Requires access to the Kubernetes API server (uses the kubeconfig / in-cluster config)
+    """
+    try:
+        manager.run(workers=workers, metrics_port=metrics_port, skip_existing=skip_existing)
+    except KeyboardInterrupt:
+        pass
+    logs.exit_great_success()
@@ -0,0 +1,247 @@
+"""Long-running controller which reconciles the operator custom resources
+
+Instances, routers, routes and db migrations are watched using informers (see drivers/kubectl/cache.py),
+changed resources are queued in a de-duplicating, rate-limited work queue and reconciled by the workers
+using the same update functions as the CLI commands.
+
+Changes are detected using metadata.generation, so annotation / label changes made by the reconcilers
+don't cause another reconcile. Failed reconciles are retried with exponential backoff, up to MAX_RETRIES,
+after which the resource is not reconciled until it changes again.
+
+The informers serve kubectl.get for the watched kinds, resources written by the reconcilers are read from
+the API server until the informer gets the write, so reconcilers always read their own writes.
+
+Db migrations import data, which is not idempotent, so they are reconciled only when explicitly marked for the
+controller and are not retried, see _reconcile_migration.
+"""
+import os
+import threading
+import time
+import traceback
+
+from ckan_cloud_operator import kubectl
+from ckan_cloud_operator import logs
+from ckan_cloud_operator.config import manager as config_manager
+from ckan_cloud_operator.crds import manager as crds_manager
+from ckan_cloud_operator.labels import manager as labels_manager
+from ckan_cloud_operator.controller import metrics
+from ckan_cloud_operator.controller.queue import WorkQueue, RateLimiter, ShutDown
+from ckan_cloud_operator.drivers.kubectl import cache as kubectl_cache
+from ckan_cloud_operator.providers.ckan.constants import INSTANCE_CRD_SINGULAR
+from ckan_cloud_operator.providers.ckan.db.constants import MIGRATION_CRD_SINGULAR
+from ckan_cloud_operator.providers.ckan.db import migration as migration_manager
+from ckan_cloud_operator.providers.ckan.instance import manager as instance_manager
+from ckan_cloud_operator.routers import manager as routers_manager
+
+
+# number of resources which are reconciled concurrently
+WORKERS = int(os.environ.get('CKAN_CLOUD_OPERATOR_CONTROLLER_WORKERS', '2'))
+
+# failed reconciles are retried after RETRY_BASE_DELAY_SECONDS * 2^retries, up to RETRY_MAX_DELAY_SECONDS
+MAX_RETRIES = int(os.environ.get('CKAN_CLOUD_OPERATOR_CONTROLLER_MAX_RETRIES', '10'))
+RETRY_BASE_DELAY_SECONDS = float(os.environ.get('CKAN_CLOUD_OPERATOR_CONTROLLER_RETRY_BASE_DELAY', '5'))
+RETRY_MAX_DELAY_SECONDS = float(os.environ.get('CKAN_CLOUD_OPERATOR_CONTROLLER_RETRY_MAX_DELAY', '600'))
+
+# overall limit of retries per second, shared by all resources
+RETRY_QPS = float(os.environ.get('CKAN_CLOUD_OPERATOR_CONTROLLER_RETRY_QPS', '1'))
+
+# serve the prometheus metrics on this port, 0 to disable
+METRICS_PORT = int(os.environ.get('CKAN_CLOUD_OPERATOR_CONTROLLER_METRICS_PORT', '0'))
+
+# db migrations are reconciled only if this spec attribute is true, migrations created by the cli are not marked
+MIGRATION_RECONCILE_SPEC_KEY = 'controller-reconcile'
+
+# set by the controller to in-progress / failed / done, in-progress and failed migrations are not reconciled
+MIGRATION_STATUS_ANNOTATION = 'ckan-cloud/controller-migration-status'
+
+
+class Controller(object):
+
+    def __init__(self, namespace='ckan-cloud', skip_existing=False, max_retries=MAX_RETRIES):
+        self.namespace = namespace
+        self.skip_existing = skip_existing
+        self.max_retries = max_retries
+        self.queue = WorkQueue(RateLimiter(base_delay=RETRY_BASE_DELAY_SECONDS, max_delay=RETRY_MAX_DELAY_SECONDS,
+                                           qps=RETRY_QPS, burst=10))
+        self._watches = []
+        self._reconcilers = {}
+        self._retry = {}
+        self._stores = {}
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    def add_resource(self, resource_type, kind, reconcile, retry=True):
+        """Watch the given kind and call reconcile(resource) for changed resources
+
+        With retry=False failed reconciles are not retried until the resource changes
+        """
+        self._reconcilers[resource_type] = reconcile
+        self._retry[resource_type] = retry
+        self._watches.append((resource_type, kind, lambda event_type, obj: self._handle_event(
+            resource_type, event_type, obj, lambda obj: (resource_type, obj['metadata']['name'])
+        )))
+
+    def add_dependent(self, resource_type, kind, get_key):
+        """Watch the given kind and queue the key returned by get_key(obj) for changes, e.g. routes -> router"""
+        self._watches.append((resource_type, kind, lambda event_type, obj: self._handle_event(
+            resource_type, event_type, obj, get_key, dependent=True
+        )))
+
+    def run(self, workers=WORKERS, stop_event=None):
+        """Start the informers and workers, blocks until stop_event is set"""
+        if not stop_event:
+            stop_event = threading.Event()
+        for resource_type, kind, handler in self._watches:
+            logs.info(f'starting {kind} informer')
+            self._stores[resource_type] = kubectl_cache.start(kind, namespace=self.namespace, handler=handler)
+        threads = [threading.Thread(target=self._run_worker, name=f'controller-worker-{i}', daemon=True)
+                   for i in range(workers)]
+        for thread in threads:
+            thread.start()
+        logs.info(f'controller started with {workers} workers')
+        try:
+            while not stop_event.wait(1):
+                pass
+        finally:
+            logs.info('stopping controller')
+            self.queue.shut_down()
+            for _, kind, _ in self._watches:
+                kubectl_cache.stop(kind, namespace=self.namespace)
+            for thread in threads:
+                thread.join()
+
+    def process_next(self, timeout=None):
+        """Process the next key from the queue, returns False when the queue is shut down"""
+        try:
+            key = self.queue.get(timeout=timeout)
+        except ShutDown:
+            return False
+        if key is not None:
+            try:
+                self._reconcile(key)
+            finally:
+                self.queue.done(key)
+        return True
+
+    def _run_worker(self):
+        while self.process_next():
+            pass
+
+    def _handle_event(self, resource_type, event_type, obj, get_key, dependent=False):
+        name = obj['metadata']['name']
+        generation = obj['metadata'].get('generation')
+        generation_key = (resource_type, name)
+        with self._lock:
+            if event_type == 'DELETED':
+                last_generation = self._generations.pop(generation_key, None)
+                if not dependent:
+                    self.queue.forget(generation_key)
+                    return
+            else:
+                last_generation = self._generations.get(generation_key)
+                if generation and last_generation == generation:
+                    return
+                if self.skip_existing and event_type == 'SYNC' and generation_key not in self._generations:
+                    self._generations[generation_key] = generation
+                    return
+                if dependent:
+                    self._generations[generation_key] = generation
+        key = get_key(obj)
+        if key:
+            logs.debug(f'{event_type} {resource_type} {name}, queuing {key}', last_generation=last_generation,
+                       generation=generation)
+            self.queue.add(key)
+
+    def _reconcile(self, key):
+        resource_type, name = key
+        resource = self._stores[resource_type].get(name)
+        if not resource:
+            logs.debug(f'{resource_type} {name} was deleted, skipping')
+            return
+        start_time = time.time()
+        try:
+            self._reconcilers[resource_type](resource)
+        except Exception:
+            retries = self.queue.num_requeues(key)
+            if retries < self.max_retries and self._retry[resource_type]:
+                logs.warning(f'failed to reconcile {resource_type} {name}, retrying', retries=retries)
+                logs.debug(traceback.format_exc())
+                metrics.RECONCILE_TOTAL.inc(resource=resource_type, result='retry')
+                self.queue.add_rate_limited(key)
+            else:
+                logs.error(f'failed to reconcile {resource_type} {name}, giving up until it changes', retries=retries)
+                logs.error(traceback.format_exc())
+                metrics.RECONCILE_TOTAL.inc(resource=resource_type, result='error')
+                self.queue.forget(key)
+        else:
+            with self._lock:
+                self._generations[key] = resource['metadata'].get('generation')
+            self.queue.forget(key)
+            metrics.RECONCILE_TOTAL.inc(resource=resource_type, result='success')
+            logs.info(f'reconciled {resource_type} {name}', seconds=round(time.time() - start_time, 2))
+
+
+def get_controller(skip_existing=False):
+    """Returns a controller for all the operator custom resources, crds which are not installed are skipped"""
+    controller = Controller(skip_existing=skip_existing)
+    if _is_crd_installed(INSTANCE_CRD_SINGULAR):
+        controller.add_resource('ckaninstance', crds_manager.get_resource_kind(INSTANCE_CRD_SINGULAR),
+                                _reconcile_instance)
+    controller.add_resource('router', 'CkanCloudRouter', _reconcile_router)
+    controller.add_dependent('route', 'CkanCloudRoute', _get_route_router_key)
+    if _is_crd_installed(MIGRATION_CRD_SINGULAR):
+        controller.add_resource('dbmigration', crds_manager.get_resource_kind(MIGRATION_CRD_SINGULAR),
+                                _reconcile_migration, retry=False)
+    return controller
+
+
+def run(workers=WORKERS, metrics_port=METRICS_PORT, skip_existing=False):
+    if metrics_port:
+        logs.info(f'serving metrics on port {metrics_port}')
+        metrics.serve(metrics_port)
+    get_controller(skip_existing=skip_existing).run(workers=workers)
+
+
+def _is_crd_installed(singular):
+    return bool(config_manager.get(f'installed-crd-{singular}'))
+
+
+def _reconcile_instance(instance):
+    label_prefix = labels_manager.get_label_prefix()
+    instance_id = instance['metadata']['labels'][f'{label_prefix}/crd-{INSTANCE_CRD_SINGULAR}-name']
+    instance_manager.update(instance_id)
+
+
+def _reconcile_router(router):
+    routers_manager.update(router['metadata']['name'])
+
+
+def _reconcile_migration(migration):
+    """Run migrations which are marked for the controller, once
+
+    The migration is annotated as in-progress before it starts (using its resource version, so it fails if the
+    migration was modified since), failed migrations are not reconciled until the status annotation is removed.
+    """
+    name = migration['metadata']['name']
+    if not migration['spec'].get(MIGRATION_RECONCILE_SPEC_KEY):
+        logs.debug(f'migration {name} is not marked for the controller, skipping')
+        return
+    status = migration['metadata'].get('annotations', {}).get(MIGRATION_STATUS_ANNOTATION)
+    if status in ['in-progress', 'failed']:
+        logs.info(f'migration {name} is {status}, skipping')
+        return
+    kind = crds_manager.get_resource_kind(MIGRATION_CRD_SINGULAR)
+    kubectl.patch_annotations(kind, name, {MIGRATION_STATUS_ANNOTATION: 'in-progress'},
+                              resource_version=migration['metadata'].get('resourceVersion'), max_conflict_retries=0)
+    try:
+        for event in migration_manager.update(migration):
+            logs.info(event.get('msg', ''), migration=migration['spec']['name'], step=event.get('step'))
+    except Exception:
+        kubectl.patch_annotations(kind, name, {MIGRATION_STATUS_ANNOTATION: 'failed'})
+        raise
+    kubectl.patch_annotations(kind, name, {MIGRATION_STATUS_ANNOTATION: 'done'})
+
+
+def _get_route_router_key(route):
+    router_name = route['metadata'].get('labels', {}).get('ckan-cloud/router-name')
+    return ('router', router_name) if router_name else None
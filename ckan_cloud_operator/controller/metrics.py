@@ -0,0 +1,138 @@
+"""Minimal in-process metrics, exposed in the Prometheus text format
+
+Only counters, gauges and histograms with labels are supported, which is all the controller needs,
+serve(port) exposes them on http://0.0.0.0:<port>/metrics
+"""
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+__METRICS = []
+
+
+def _register(metric):
+    __METRICS.append(metric)
+
+
+class Metric(object):
+    type = None
+
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+        self._values = {}
+        self._lock = threading.Lock()
+        _register(self)
+
+    def get(self, **labels):
+        with self._lock:
+            return self._values.get(_labels_key(labels))
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} {self.type}']
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_format_labels(labels)} {_format_value(value)}')
+        return lines
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = _labels_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[_labels_key(labels)] = value
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, description, buckets=DEFAULT_BUCKETS):
+        super().__init__(name, description)
+        self.buckets = buckets
+
+    def observe(self, value, **labels):
+        key = _labels_key(labels)
+        with self._lock:
+            counts, total, count = self._values.get(key) or ([0] * len(self.buckets), 0, 0)
+            counts = [c + 1 if value <= bucket else c for c, bucket in zip(counts, self.buckets)]
+            self._values[key] = (counts, total + value, count + 1)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} {self.type}']
+        with self._lock:
+            for labels, (counts, total, count) in sorted(self._values.items()):
+                for bucket, bucket_count in zip(self.buckets, counts):
+                    bucket_labels = (*labels, ('le', _format_value(bucket)))
+                    lines.append(f'{self.name}_bucket{_format_labels(bucket_labels)} {bucket_count}')
+                lines.append(f'{self.name}_bucket{_format_labels((*labels, ("le", "+Inf")))} {count}')
+                lines.append(f'{self.name}_sum{_format_labels(labels)} {_format_value(total)}')
+                lines.append(f'{self.name}_count{_format_labels(labels)} {count}')
+        return lines
+
+
+WORKQUEUE_DEPTH = Gauge('ckan_cloud_operator_workqueue_depth', 'Current number of keys waiting in the work queue')
+WORKQUEUE_ADDS = Counter('ckan_cloud_operator_workqueue_adds_total', 'Total number of keys added to the work queue')
+WORKQUEUE_RETRIES = Counter('ckan_cloud_operator_workqueue_retries_total', 'Total number of rate limited retries')
+WORKQUEUE_QUEUE_DURATION = Histogram('ckan_cloud_operator_workqueue_queue_duration_seconds',
+                                     'Seconds a key waits in the work queue before it is processed')
+WORKQUEUE_WORK_DURATION = Histogram('ckan_cloud_operator_workqueue_work_duration_seconds',
+                                    'Seconds it takes to process a key')
+RECONCILE_TOTAL = Counter('ckan_cloud_operator_reconcile_total', 'Total number of reconciles by resource and result')
+
+
+def render():
+    lines = []
+    for metric in __METRICS:
+        lines += metric.render()
+    return '\n'.join(lines) + '\n'
+
+
+def serve(port, host='0.0.0.0'):
+    """Serve the metrics from a background thread, returns the server"""
+
+    class _Handler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = render().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), _Handler)
+    threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+    return server
+
+
+def _labels_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    values = ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in labels)
+    return '{' + values + '}'
+
+
+def _format_value(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
@@ -0,0 +1,151 @@
+"""De-duplicating, rate-limited work queue used by the controller workers
+
+Follows the semantics of the Kubernetes client-go work queue:
+
+* a key which is added while it's already waiting in the queue is only processed once
+* a key which is added while it's being processed is queued again when the processing is done,
+  so the same key is never processed by 2 workers at the same time
+* failed keys are re-added after a delay which is the max of a per-key exponential backoff
+  and an overall token bucket rate limit
+"""
+import heapq
+import threading
+import time
+
+from ckan_cloud_operator.controller import metrics
+
+
+class ShutDown(Exception):
+    pass
+
+
+class RateLimiter(object):
+    """Returns the delay before retrying a key: max of per-key exponential backoff and an overall token bucket"""
+
+    def __init__(self, base_delay=0.5, max_delay=300, qps=10, burst=100):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.qps = qps
+        self.burst = burst
+        self._failures = {}
+        self._tokens = burst
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def when(self, key):
+        with self._lock:
+            failures = self._failures.get(key, 0)
+            self._failures[key] = failures + 1
+            backoff = min(self.base_delay * 2 ** failures, self.max_delay)
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.qps)
+            self._last = now
+            self._tokens -= 1
+            bucket = -self._tokens / self.qps if self._tokens < 0 else 0
+            return max(backoff, bucket)
+
+    def num_requeues(self, key):
+        with self._lock:
+            return self._failures.get(key, 0)
+
+    def forget(self, key):
+        with self._lock:
+            self._failures.pop(key, None)
+
+
+class WorkQueue(object):
+
+    def __init__(self, rate_limiter=None, name='controller'):
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.name = name
+        self._queue = []
+        self._dirty = set()
+        self._processing = set()
+        self._added_at = {}
+        self._started_at = {}
+        self._waiting = []
+        self._shutting_down = False
+        self._cond = threading.Condition()
+        self._delay_thread = threading.Thread(target=self._run_delayed, name=f'{name}-queue-delay', daemon=True)
+        self._delay_thread.start()
+
+    def add(self, key):
+        with self._cond:
+            if self._shutting_down or key in self._dirty:
+                return
+            metrics.WORKQUEUE_ADDS.inc(name=self.name)
+            self._dirty.add(key)
+            self._added_at.setdefault(key, time.monotonic())
+            if key not in self._processing:
+                self._queue.append(key)
+                metrics.WORKQUEUE_DEPTH.set(len(self._queue), name=self.name)
+                self._cond.notify_all()
+
+    def add_after(self, key, delay):
+        if delay <= 0:
+            return self.add(key)
+        with self._cond:
+            if self._shutting_down:
+                return
+            heapq.heappush(self._waiting, (time.monotonic() + delay, id(key), key))
+            self._cond.notify_all()
+
+    def add_rate_limited(self, key):
+        metrics.WORKQUEUE_RETRIES.inc(name=self.name)
+        self.add_after(key, self.rate_limiter.when(key))
+
+    def forget(self, key):
+        self.rate_limiter.forget(key)
+
+    def num_requeues(self, key):
+        return self.rate_limiter.num_requeues(key)
+
+    def get(self, timeout=None):
+        """Returns the next key to process, raises ShutDown when the queue is shut down"""
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._queue or self._shutting_down, timeout):
+                return None
+            if not self._queue:
+                raise ShutDown()
+            key = self._queue.pop(0)
+            metrics.WORKQUEUE_DEPTH.set(len(self._queue), name=self.name)
+            self._processing.add(key)
+            self._dirty.discard(key)
+            now = time.monotonic()
+            metrics.WORKQUEUE_QUEUE_DURATION.observe(now - self._added_at.pop(key, now), name=self.name)
+            self._started_at[key] = now
+            return key
+
+    def done(self, key):
+        with self._cond:
+            self._processing.discard(key)
+            started_at = self._started_at.pop(key, None)
+            if started_at is not None:
+                metrics.WORKQUEUE_WORK_DURATION.observe(time.monotonic() - started_at, name=self.name)
+            if key in self._dirty:
+                self._queue.append(key)
+                metrics.WORKQUEUE_DEPTH.set(len(self._queue), name=self.name)
+                self._cond.notify_all()
+
+    def shut_down(self):
+        with self._cond:
+            self._shutting_down = True
+            self._cond.notify_all()
+
+    def __len__(self):
+        with self._cond:
+            return len(self._queue)
+
+    def _run_delayed(self):
+        with self._cond:
+            while not self._shutting_down:
+                if not self._waiting:
+                    self._cond.wait()
+                    continue
+                ready_at, _, key = self._waiting[0]
+                wait_seconds = ready_at - time.monotonic()
+                if wait_seconds > 0:
+                    self._cond.wait(wait_seconds)
+                    continue
+                heapq.heappop(self._waiting)
+                self.add(key)
@@ -2,6 +2,7 @@ import hashlib
 
 from ckan_cloud_operator import kubectl
 from ckan_cloud_operator import logs
+from ckan_cloud_operator.drivers.kubectl import cache as kubectl_cache
 
 from ckan_cloud_operator.config import manager as config_manager
 from ckan_cloud_operator.labels import manager as labels_manager
@@ -34,6 +35,20 @@ def get(singular, *args, name=None, required=True, get_cmd='get', **kwargs):
     return kubectl.get(f'{crd_prefix}{kind_suffix}', *args, required=required, get_cmd=get_cmd, **kwargs)
 
 
+def start_cache(*singulars, namespace='ckan-cloud'):
+    """Keep the given crds in memory using watches, for long running processes"""
+    for singular in singulars:
+        kubectl_cache.start(get_resource_kind(singular), namespace=namespace)
+
+
+def cache_snapshot(*singulars, namespace='ckan-cloud'):
+    """Context manager which serves reads of the given crds from a single listing, crds which are not installed are ignored"""
+    return kubectl_cache.snapshot(*[
+        get_resource_kind(singular) for singular in singulars
+        if config_manager.get(f'installed-crd-{singular}')
+    ], namespace=namespace)
+
+
 def edit(singular, *edit_args, name=None, **edit_kwargs):
     """Run kubectl.get for the given crd singular value and optional get args / kwargs"""
     crd_prefix = get_crd_prefix()
@@ -7,8 +7,8 @@ from dataflows import Flow, update_resource, printer, checkpoint, dump_to_path
 
 
 def get_kube_items(operator, what, spec_fields=None, metadata_fields=None, status_fields=None):
-    for item in yaml.load(subprocess.check_output(
-        f'{operator} kubectl -- get {what} -o yaml', shell=True
+    for item in json.loads(subprocess.check_output(
+        f'{operator} kubectl -- get {what} -o json', shell=True
     ))['items']:
         yield {
             **{k: v for k, v
@@ -102,9 +102,9 @@ def ckan_cloud_instances(operator):
             for instance in non_ckan_instances:
                 instance_name = instance['name']
                 get_route_args = instance['get-route-args']
-                deployment = yaml.load(
+                deployment = json.loads(
                     subprocess.check_output(
-                        f'{operator} kubectl -- -n {instance_name} get deployment {instance_name} -o yaml',
+                        f'{operator} kubectl -- -n {instance_name} get deployment {instance_name} -o json',
                         shell=True)
                 )
                 yield {
@@ -55,34 +55,23 @@ def initialize():
     if not routers_manager.get(router_name, required=False):
         routers_manager.create(router_name, routers_manager.get_traefik_router_spec())
     if config_manager.get('enable-deis-ckan', configmap_name='global-ckan-config') == 'y':
-        create(
-            'datapusher-1',
-            'registry.gitlab.com/viderum/docker-datapusher:cloud-datapusher-1-v9',
-            datapusher_envvars,
-            router_name
-        )
-        create(
-            'datapusher-de',
-            'registry.gitlab.com/viderum/docker-datapusher:cloud-de-git-943fc3e0',
-            datapusher_envvars,
-            router_name
-        )
-        create(
-            'datapusher-giga',
-            'registry.gitlab.com/viderum/docker-datapusher:cloud-giga-git-2b05b22d',
-            datapusher_envvars,
-            router_name
-        )
-        create(
-            'datapusher-increased-max-length',
-            'registry.gitlab.com/viderum/docker-datapusher:cloud-increased-max-length-git-84e86116',
-            datapusher_envvars,
-            router_name
-        )
-        update('datapusher-1')
-        update('datapusher-de')
-        update('datapusher-giga')
-        update('datapusher-increased-max-length')
+        datapushers = {
+            'datapusher-1': 'registry.gitlab.com/viderum/docker-datapusher:cloud-datapusher-1-v9',
+            'datapusher-de': 'registry.gitlab.com/viderum/docker-datapusher:cloud-de-git-943fc3e0',
+            'datapusher-giga': 'registry.gitlab.com/viderum/docker-datapusher:cloud-giga-git-2b05b22d',
+            'datapusher-increased-max-length': 'registry.gitlab.com/viderum/docker-datapusher:cloud-increased-max-length-git-84e86116',
+        }
+        kubectl.apply_many([
+            _get_datapusher(name, image, datapusher_envvars)
+            for name, image in datapushers.items()
+        ])
+        for name in datapushers:
+            routers_manager.create_subdomain_route(router_name, {
+                'target-type': 'datapusher',
+                'datapusher-name': name
+            })
+        _update_registry_secret()
+        kubectl.apply_many([_get_deployment(name) for name in datapushers])
         routers_manager.update(router_name)
 
 
@@ -92,11 +81,7 @@ def install_crds():
 
 
 def create(name, image, config, router_name=None):
-    labels =  _get_labels(name)
-    datapusher = kubectl.get_resource('stable.viderum.com/v1', 'CkanCloudDatapusher', name, labels)
-    datapusher['spec'] = {'image': image,
-                          'config': config}
-    kubectl.apply(datapusher)
+    kubectl.apply(_get_datapusher(name, image, config))
     if router_name:
         routers_manager.create_subdomain_route(router_name, {
             'target-type': 'datapusher',
@@ -106,13 +91,7 @@ def create(name, image, config, router_name=None):
 
 def update(name):
     _update_registry_secret()
-    datapusher = kubectl.get(f'CkanCloudDatapusher {name}')
-    deployment_name = get_deployment_name(name)
-    labels = _get_labels(name)
-    spec = _get_deployment_spec(labels, datapusher['spec'])
-    print(f'Updating CkanCloudDatapusher {name} (deployment_name={deployment_name})')
-    deployment = kubectl.get_deployment(deployment_name, labels, spec)
-    kubectl.apply(deployment)
+    kubectl.apply(_get_deployment(name))
 
 
 def delete(name):
@@ -155,7 +134,8 @@ def get(name, deployment=None, full=False):
         deployment_status = kubectl.get_deployment_detailed_status(
             deployment,
             f'ckan-cloud/datapusher-name={name}',
-            'datapusher'
+            'datapusher',
+            with_logs=full
         )
         ready = bool(len(deployment_status.get('errors', [])) == 0)
     else:
@@ -178,6 +158,23 @@ def list(full=False):
     return [get(datapusher['metadata']['name'], full=full) for datapusher in kubectl.get('CkanCloudDatapusher')['items']]
 
 
+def _get_datapusher(name, image, config):
+    labels = _get_labels(name)
+    datapusher = kubectl.get_resource('stable.viderum.com/v1', 'CkanCloudDatapusher', name, labels)
+    datapusher['spec'] = {'image': image,
+                          'config': config}
+    return datapusher
+
+
+def _get_deployment(name):
+    datapusher = kubectl.get(f'CkanCloudDatapusher {name}')
+    deployment_name = get_deployment_name(name)
+    labels = _get_labels(name)
+    spec = _get_deployment_spec(labels, datapusher['spec'])
+    print(f'Updating CkanCloudDatapusher {name} (deployment_name={deployment_name})')
+    return kubectl.get_deployment(deployment_name, labels, spec)
+
+
 def _get_labels(name):
     return {'ckan-cloud/datapusher-name': name}
 
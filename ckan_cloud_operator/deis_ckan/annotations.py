@@ -44,7 +44,7 @@ SECRET_ANNOTATIONS = [
 __NONE__ = object()
 
 
-class DeisCkanInstanceAnnotations(object):
+class DeisCkanInstanceAnnotations(kubectl.BatchAnnotationsMixin):
     """Manage annotations related to the instance which are used to store instance metadata"""
 
     def __init__(self, instance, override_flags=None, persist_overrides=False):
@@ -156,19 +156,28 @@ class DeisCkanInstanceAnnotations(object):
             return default
 
     def json_annotate(self, key, value, overwrite=True):
-        ans = []
         assert any([key.startswith(prefix) for prefix in JSON_ANNOTATION_PREFIXES]), f'invalid json annotation key: {key}'
-        value = json.dumps(value)
-        ans.append(f"{key}='{value}'")
-        self._annotate(*ans, overwrite=overwrite)
+        self._annotate_values({key: json.dumps(value)}, overwrite=overwrite)
 
     def _annotate(self, *annotations, overwrite=True):
-        cmd = f'kubectl -n ckan-cloud annotate {self.instance.kind} {self.instance.id}'
-        for annotation in annotations:
-            cmd += f' ckan-cloud/{annotation}'
-        if overwrite:
-            cmd += ' --overwrite'
-        subprocess.check_call(cmd, shell=True)
+        self._annotate_values(dict(kubectl.parse_annotation(annotation) for annotation in annotations),
+                              overwrite=overwrite)
+
+    def _annotate_values(self, annotations, overwrite=True):
+        annotations = {f'ckan-cloud/{k}': v for k, v in annotations.items()}
+        metadata = self.instance.values['metadata']
+        if not overwrite:
+            for k, v in annotations.items():
+                assert metadata.get('annotations', {}).get(k, v) == v, f'annotation {k} already has a value and overwrite is false'
+        metadata.setdefault('annotations', {}).update(**annotations)
+        self._save_annotations(annotations)
+
+    def _patch_annotations(self, annotations):
+        metadata = self.instance.values['metadata']
+        resource = kubectl.patch_annotations(self.instance.kind, self.instance.id, annotations,
+                                             resource_version=metadata.get('resourceVersion'))
+        if resource:
+            metadata['resourceVersion'] = resource['metadata']['resourceVersion']
 
     def _get_annotation(self, annotation, default=None):
         return self.instance.values['metadata'].get('annotations', {}).get(f'ckan-cloud/{annotation}', default)
@@ -1,5 +1,6 @@
 import subprocess
 import yaml
+import json
 import datetime
 import time
 from ckan_cloud_operator import kubectl
@@ -18,10 +19,10 @@ class DeisCkanInstanceDeployment(object):
         print(f'Deleting instance {self.instance.id}')
         subprocess.check_call(f'kubectl -n {self.instance.id} delete deployment/{self.instance.id} --now', shell=True)
 
-    def get(self):
-        exitcode, output = subprocess.getstatusoutput(f'kubectl -n {self.instance.id} get deployment/{self.instance.id} -o yaml')
+    def get(self, with_logs=True):
+        exitcode, output = subprocess.getstatusoutput(f'kubectl -n {self.instance.id} get deployment/{self.instance.id} -o json')
         if exitcode == 0:
-            deployment = yaml.load(output)
+            deployment = json.loads(output)
             status = kubectl.get_item_detailed_status(deployment)
             ready = len(status.get('error', [])) == 0
             status['pods'] = []
@@ -29,19 +30,22 @@ class DeisCkanInstanceDeployment(object):
             image = None
             latest_operator_timestamp, latest_pod_name, latest_pod_status = None, None, None
             if pods:
+                pods_logs = kubectl.get_pods_logs(
+                    [(pod['metadata']['name'], 'ckan') for pod in pods['items']],
+                    namespace=self.instance.id, tail=5
+                ) if with_logs else {}
                 for pod in pods['items']:
                     pod_operator_timestamp = pod['metadata']['annotations']['ckan-cloud/operator-timestamp']
                     if not latest_operator_timestamp or latest_operator_timestamp < pod_operator_timestamp:
                         latest_operator_timestamp = pod_operator_timestamp
                         latest_pod_name = pod['metadata']['name']
                     pod_status = kubectl.get_item_detailed_status(pod)
-                    status_code, output = subprocess.getstatusoutput(
-                        f'kubectl -n {self.instance.id} logs {pod["metadata"]["name"]} -c ckan --tail 5',
-                    )
-                    if status_code == 0:
-                        pod_status['logs'] = output
-                    else:
-                        pod_status['logs'] = None
+                    if with_logs:
+                        status_code, output = pods_logs[(pod['metadata']['name'], 'ckan')]
+                        if status_code == 0:
+                            pod_status['logs'] = output
+                        else:
+                            pod_status['logs'] = None
                     if not image:
                         image = pod["spec"]["containers"][0]["image"]
                     else:
@@ -51,7 +55,10 @@ class DeisCkanInstanceDeployment(object):
                     status['pods'].append(pod_status)
                     if latest_pod_name == pod_status['name']:
                         latest_pod_status = pod_status
-                if not latest_pod_status or len(latest_pod_status.get('errors', [])) > 0 or latest_pod_status['logs'] is None:
+                if (
+                    not latest_pod_status or len(latest_pod_status.get('errors', [])) > 0
+                    or (with_logs and latest_pod_status['logs'] is None)
+                ):
                     ready = False
             else:
                 ready = False
@@ -1,5 +1,6 @@
 import subprocess
 import yaml
+import json
 from ckan_cloud_operator import kubectl
 from ckan_cloud_operator import logs
 from ckan_cloud_operator.gitlab import CkanGitlab
@@ -92,9 +93,9 @@ class DeisCkanInstanceEnvvars(object):
         subprocess.check_call(f'kubectl -n {self.instance.id} delete secret/ckan-envvars', shell=True)
 
     def get(self, full=False):
-        exitcode, output = subprocess.getstatusoutput(f'kubectl -n {self.instance.id} get secret/ckan-envvars -o yaml')
+        exitcode, output = subprocess.getstatusoutput(f'kubectl -n {self.instance.id} get secret/ckan-envvars -o json')
         if exitcode == 0:
-            secret = kubectl.decode_secret(yaml.load(output))
+            secret = kubectl.decode_secret(json.loads(output))
             res = {'ready': 'CKAN_SITE_URL' in secret}
             if full:
                 res['envvars'] = secret
@@ -266,17 +266,20 @@ class DeisCkanInstance(object):
         else:
             expected_new_deployment_generation = 1
         print(f'old deployment generation = {old_deployment_generation}')
-        DeisCkanInstanceNamespace(self).update()
-        DeisCkanInstanceDb(self, 'db').update()
-        DeisCkanInstanceDb(self, 'datastore').update()
-        if not skip_solr:
-            DeisCkanInstanceSolr(self).update()
-        DeisCkanInstanceStorage(self).update()
-        DeisCkanInstanceRegistry(self).update()
-        envvars = DeisCkanInstanceEnvvars(self)
-        envvars.update()
+        # component statuses are saved together when all components were updated
+        with self.annotations.batch():
+            DeisCkanInstanceNamespace(self).update()
+            DeisCkanInstanceDb(self, 'db').update()
+            DeisCkanInstanceDb(self, 'datastore').update()
+            if not skip_solr:
+                DeisCkanInstanceSolr(self).update()
+            DeisCkanInstanceStorage(self).update()
+            DeisCkanInstanceRegistry(self).update()
+            envvars = DeisCkanInstanceEnvvars(self)
+            envvars.update()
+            if not skip_deployment:
+                DeisCkanInstanceDeployment(self).update()
         if not skip_deployment:
-            DeisCkanInstanceDeployment(self).update()
             while True:
                 time.sleep(.2)
                 new_deployment = kubectl.get(f'deployment {self.id}', required=False, namespace=self.id)
@@ -376,13 +379,16 @@ class DeisCkanInstance(object):
         else:
             subprocess.check_call(f'kubectl -n {self.id} {cmd}', shell=True)
 
-    def get(self, attr=None, exclude_attr=None):
-        """Get detailed information about the instance and related components"""
+    def get(self, attr=None, exclude_attr=None, with_logs=True):
+        """Get detailed information about the instance and related components
+
+        with_logs=False skips getting the pods logs, when only the readiness is needed
+        """
         gets = {
             'annotations': lambda: DeisCkanInstanceAnnotations(self).get(),
             'db': lambda: DeisCkanInstanceDb(self, 'db').get(),
             'datastore': lambda: DeisCkanInstanceDb(self, 'datastore').get(),
-            'deployment': lambda: DeisCkanInstanceDeployment(self).get(),
+            'deployment': lambda: DeisCkanInstanceDeployment(self).get(with_logs=with_logs),
             'envvars': lambda: DeisCkanInstanceEnvvars(self).get(),
             'namespace': lambda: DeisCkanInstanceNamespace(self).get(),
             'registry': lambda: DeisCkanInstanceRegistry(self).get(),
@@ -418,7 +424,7 @@ class DeisCkanInstance(object):
             else:
                 try:
                     instance = DeisCkanInstance(item['metadata']['name'], values=item)
-                    data = instance.get()
+                    data = instance.get(with_logs=full)
                     if not full:
                         data = {'id': instance.id, 'ready': data['ready']}
                 except Exception:
@@ -1,5 +1,4 @@
 import subprocess
-import yaml
 import os
 import json
 
@@ -30,9 +29,9 @@ def get_solr_config(old_site_id, path_to_old_cluster_kubeconfig):
 
 def get_instance_env(old_site_id, path_to_old_cluster_kubeconfig):
     output = subprocess.check_output(f'KUBECONFIG={path_to_old_cluster_kubeconfig} '
-                                     f'kubectl -n {old_site_id} get deployment {old_site_id}-cmd -o yaml',
+                                     f'kubectl -n {old_site_id} get deployment {old_site_id}-cmd -o json',
                                      shell=True)
-    deployment = yaml.load(output)
+    deployment = json.loads(output)
     containers = deployment['spec']['template']['spec']['containers']
     assert len(containers) == 1, f'invalid number of containers {len(containers)}'
     container = containers[0]
@@ -57,9 +56,9 @@ def get_instance_env(old_site_id, path_to_old_cluster_kubeconfig):
             assert len(e) == 0
             extra_values[name] = value
     output = subprocess.check_output(f'KUBECONFIG={path_to_old_cluster_kubeconfig} '
-                                     f'kubectl -n {old_site_id} get secret {fetch_secret_name} -o yaml',
+                                     f'kubectl -n {old_site_id} get secret {fetch_secret_name} -o json',
                                      shell=True)
-    secret = kubectl.decode_secret(yaml.load(output))
+    secret = kubectl.decode_secret(json.loads(output))
     instance_env = {}
     for key, secret_key in envvar_secrets.items():
         instance_env[key] = secret[secret_key]
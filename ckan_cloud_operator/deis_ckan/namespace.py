@@ -1,5 +1,5 @@
 import subprocess
-import yaml
+import json
 from ckan_cloud_operator import kubectl
 
 
@@ -24,14 +24,14 @@ class DeisCkanInstanceNamespace(object):
         subprocess.check_call(f'kubectl delete ns {ns}', shell=True)
 
     def get(self):
-        exitcode, output = subprocess.getstatusoutput(f'kubectl -n {self.instance.id} get ns/{self.instance.id} -o yaml')
+        exitcode, output = subprocess.getstatusoutput(f'kubectl -n {self.instance.id} get ns/{self.instance.id} -o json')
         events = [
             '{firstTimestamp} - {lastTimestamp} ({type}*{count}) {message}'.format(**e)
             for e in kubectl.get('events', namespace=self.instance.id)['items']
             if e['type'] != 'Normal'
         ]
         if exitcode == 0:
-            return {'ready': yaml.load(output).get('status', {}).get('phase') == 'Active', 'events': events}
+            return {'ready': json.loads(output).get('status', {}).get('phase') == 'Active', 'events': events}
         else:
             return {'ready': False, 'error': output, 'events': events}
 
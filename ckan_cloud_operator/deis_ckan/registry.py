@@ -1,5 +1,5 @@
 import subprocess
-import yaml
+import json
 from ckan_cloud_operator import kubectl
 
 
@@ -16,9 +16,9 @@ class DeisCkanInstanceRegistry(object):
         subprocess.check_call(f'kubectl -n {self.instance.id} delete secret/{self.instance.id}-registry', shell=True)
 
     def get(self):
-        exitcode, output = subprocess.getstatusoutput(f'kubectl -n {self.instance.id} get secret/{self.instance.id}-registry -o yaml')
+        exitcode, output = subprocess.getstatusoutput(f'kubectl -n {self.instance.id} get secret/{self.instance.id}-registry -o json')
         if exitcode == 0:
-            return {'ready': len(kubectl.decode_secret(yaml.load(output))) > 0}
+            return {'ready': len(kubectl.decode_secret(json.loads(output))) > 0}
         else:
             return {'ready': False, 'error': output}
 
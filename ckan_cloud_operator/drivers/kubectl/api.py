@@ -0,0 +1,369 @@
+"""Kubernetes API server backend for the kubectl module
+
+Runs the common kubectl get / apply / patch commands against the API server using a single pooled,
+keep-alive HTTP session instead of forking the kubectl binary for every call.
+
+Commands which are not supported raise NotSupported, the kubectl module falls back to the kubectl binary for those.
+"""
+import datetime
+import json
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    # optional, much faster decoding of large lists
+    import orjson
+except ImportError:
+    orjson = None
+
+from ckan_cloud_operator import logs
+from ckan_cloud_operator import yaml_config
+
+
+FIELD_MANAGER = 'ckan-cloud-operator'
+
+CONNECTION_POOL_SIZE = int(os.environ.get('CKAN_CLOUD_OPERATOR_KUBECTL_API_POOL_SIZE', '10'))
+
+REQUEST_TIMEOUT_SECONDS = int(os.environ.get('CKAN_CLOUD_OPERATOR_KUBECTL_API_TIMEOUT', '60'))
+
+WATCH_TIMEOUT_SECONDS = int(os.environ.get('CKAN_CLOUD_OPERATOR_KUBECTL_API_WATCH_TIMEOUT', '300'))
+
+INCLUSTER_NAMESPACE_FILE = '/var/run/secrets/kubernetes.io/serviceaccount/namespace'
+
+
+class NotSupported(Exception):
+    """The command can't be handled by the API backend and should be run using the kubectl binary"""
+    pass
+
+
+class ApiError(Exception):
+
+    def __init__(self, status, message):
+        super().__init__(f'{status}: {message}')
+        self.status = status
+        self.message = message
+
+
+__LOCK = threading.RLock()
+__CLIENT = {}
+__RESOURCES = {}
+__DISCOVERED_GROUPS = set()
+
+
+def get(what, *args, namespace='ckan-cloud', get_cmd='get', **kwargs):
+    """Equivalent of kubectl.get, returns the same data structure as `kubectl get -o yaml`"""
+    if get_cmd != 'get' or kwargs:
+        raise NotSupported()
+    kinds, name, label_selector, all_namespaces = parse_get_args(what, *args)
+    if name:
+        if len(kinds) != 1:
+            raise NotSupported()
+        resource = get_resource_info(kinds[0])
+        return request('GET', get_resource_path(resource, namespace, name))
+    items = []
+    for kind in kinds:
+        items += list_items(kind, namespace=namespace, label_selector=label_selector,
+                            all_namespaces=all_namespaces)['items']
+    return {'apiVersion': 'v1', 'kind': 'List', 'items': items, 'metadata': {'resourceVersion': ''}}
+
+
+def list_items(kind, namespace='ckan-cloud', label_selector=None, all_namespaces=False, resource_version=None,
+               field_selector=None):
+    """List resources of a single kind, items are returned with kind / apiVersion and list metadata is kept"""
+    resource = get_resource_info(kind)
+    params = {}
+    if label_selector:
+        params['labelSelector'] = label_selector
+    if field_selector:
+        params['fieldSelector'] = field_selector
+    if resource_version:
+        params['resourceVersion'] = resource_version
+    res = request('GET', get_resource_path(resource, None if all_namespaces else namespace), params=params)
+    for item in res.get('items') or []:
+        item.setdefault('kind', resource['kind'])
+        item.setdefault('apiVersion', resource['apiVersion'])
+    res['items'] = res.get('items') or []
+    return res
+
+
+def watch(kind, namespace='ckan-cloud', label_selector=None, all_namespaces=False, resource_version=None,
+          field_selector=None, timeout_seconds=None):
+    """Yields watch events ({'type': .., 'object': ..}) starting from the given resource version
+
+    The server closes the watch after timeout_seconds (default WATCH_TIMEOUT_SECONDS),
+    callers should re-watch from the last seen resource version
+    """
+    resource = get_resource_info(kind)
+    timeout_seconds = timeout_seconds or WATCH_TIMEOUT_SECONDS
+    params = {'watch': 'true', 'allowWatchBookmarks': 'true', 'timeoutSeconds': str(timeout_seconds)}
+    if label_selector:
+        params['labelSelector'] = label_selector
+    if field_selector:
+        params['fieldSelector'] = field_selector
+    if resource_version:
+        params['resourceVersion'] = resource_version
+    res = request('GET', get_resource_path(resource, None if all_namespaces else namespace), params=params,
+                  stream=True, timeout=timeout_seconds + REQUEST_TIMEOUT_SECONDS)
+    with res:
+        for line in res.iter_lines():
+            if line:
+                event = loads(line)
+                obj = event.get('object') or {}
+                if event.get('type') in ('ADDED', 'MODIFIED', 'DELETED'):
+                    obj.setdefault('kind', resource['kind'])
+                    obj.setdefault('apiVersion', resource['apiVersion'])
+                yield event
+
+
+def apply(resource, dry_run=False):
+    """Server-side apply of the given resource"""
+    resource_info = get_resource_info(resource['kind'], api_version=resource.get('apiVersion'))
+    name = resource['metadata']['name']
+    namespace = resource['metadata'].get('namespace') or get_default_namespace()
+    params = {'fieldManager': FIELD_MANAGER, 'force': 'true'}
+    if dry_run:
+        params['dryRun'] = 'All'
+    return request('PATCH', get_resource_path(resource_info, namespace, name), params=params,
+                   body=dumps(resource), content_type='application/apply-patch+yaml')
+
+
+def create(resource):
+    resource_info = get_resource_info(resource['kind'], api_version=resource.get('apiVersion'))
+    namespace = resource['metadata'].get('namespace') or get_default_namespace()
+    return request('POST', get_resource_path(resource_info, namespace), body=dumps(resource),
+                   content_type='application/json')
+
+
+def merge_patch(kind, name, patch, namespace='ckan-cloud'):
+    resource = get_resource_info(kind)
+    return request('PATCH', get_resource_path(resource, namespace, name), body=dumps(patch),
+                   content_type='application/merge-patch+json')
+
+
+def delete(kind, name, namespace='ckan-cloud', ignore_not_found=False):
+    resource = get_resource_info(kind)
+    try:
+        return request('DELETE', get_resource_path(resource, namespace, name))
+    except ApiError as e:
+        if ignore_not_found and e.status == 404:
+            return None
+        raise
+
+
+def parse_get_args(what, *args):
+    """Parses kubectl get arguments to (kinds, name, label_selector, all_namespaces)
+
+    Only the simple forms used by the operator are supported:
+        <kind>[,<kind>..] [<name>] [-l <selector>] [--all-namespaces]
+        <kind>/<name>
+    """
+    tokens = ' '.join([what, *args]).split()
+    positional, label_selector, all_namespaces = [], None, False
+    while tokens:
+        token = tokens.pop(0)
+        if token in ('-l', '--selector'):
+            if not tokens:
+                raise NotSupported()
+            label_selector = tokens.pop(0)
+        elif token.startswith('--selector='):
+            label_selector = token.replace('--selector=', '', 1)
+        elif token in ('-A', '--all-namespaces'):
+            all_namespaces = True
+        elif token.startswith('-'):
+            raise NotSupported()
+        else:
+            positional.append(token)
+    if len(positional) == 1 and '/' in positional[0]:
+        positional = positional[0].split('/', 1)
+    if len(positional) not in (1, 2):
+        raise NotSupported()
+    kinds = positional[0].split(',')
+    name = positional[1] if len(positional) == 2 else None
+    if 'all' in kinds:
+        raise NotSupported()
+    return kinds, name, label_selector, all_namespaces
+
+
+def get_resource_info(kind, api_version=None):
+    """Resolves a kind, plural, singular or short name (optionally with a .group suffix) to the API resource"""
+    key = kind.lower()
+    if api_version:
+        key = (key, api_version)
+        with __LOCK:
+            if key not in __RESOURCES:
+                __RESOURCES[key] = _discover_kind(kind.lower(), api_version)
+            return __RESOURCES[key]
+    with __LOCK:
+        if key not in __RESOURCES:
+            _discover(key)
+        if key not in __RESOURCES:
+            raise NotSupported()
+        return __RESOURCES[key]
+
+
+def get_resource_path(resource, namespace=None, name=None):
+    path = resource['path_prefix']
+    if resource['namespaced'] and namespace:
+        path += f'/namespaces/{namespace}'
+    path += '/' + resource['plural']
+    if name:
+        path += '/' + name
+    return path
+
+
+def get_default_namespace():
+    client = _get_client()
+    return client['namespace']
+
+
+def request(method, path, params=None, body=None, content_type=None, stream=False, timeout=None):
+    for retry_unauthorized in [True, False]:
+        client = _get_client()
+        headers = {'Accept': 'application/json', **_get_auth_headers(client['configuration'])}
+        if content_type:
+            headers['Content-Type'] = content_type
+        logs.debug(f'kubectl api {method} {path}', params=params)
+        res = client['session'].request(
+            method, client['host'] + path, params=params, data=body, headers=headers, stream=stream,
+            timeout=timeout or REQUEST_TIMEOUT_SECONDS
+        )
+        if res.status_code == 401 and retry_unauthorized:
+            # credentials expired (e.g. a rotated service account token), reload the config and retry once
+            logs.debug('kubectl api unauthorized, reloading credentials')
+            res.close()
+            _reload_client(client)
+            continue
+        break
+    if res.status_code >= 400:
+        try:
+            message = res.json().get('message')
+        except Exception:
+            message = res.text
+        raise ApiError(res.status_code, message)
+    return res if stream else loads(res.content)
+
+
+def loads(data):
+    """Decode JSON returned from kubectl or the API server, using orjson if it's installed"""
+    return orjson.loads(data) if orjson else json.loads(data)
+
+
+def dumps(resource):
+    return json.dumps(resource, default=_json_default)
+
+
+def reset():
+    """Close the pooled connections and clear the discovery cache"""
+    with __LOCK:
+        if __CLIENT.get('session'):
+            __CLIENT['session'].close()
+        __CLIENT.clear()
+        __RESOURCES.clear()
+        __DISCOVERED_GROUPS.clear()
+
+
+def _json_default(obj):
+    if isinstance(obj, datetime.datetime):
+        return obj.strftime(yaml_config.datetime_format)
+    return str(obj)
+
+
+def _get_client():
+    if not __CLIENT:
+        with __LOCK:
+            if not __CLIENT:
+                __CLIENT.update(_init_client())
+    return __CLIENT
+
+
+def _reload_client(client):
+    with __LOCK:
+        # another thread may have already reloaded the client
+        if __CLIENT.get('session') is client['session']:
+            __CLIENT.clear()
+            __CLIENT.update(_init_client())
+
+
+def _get_auth_headers(configuration):
+    """Get the auth headers for each request, auth_settings calls the configuration refresh_api_key_hook
+    so exec / gcp / oidc tokens are refreshed when they expire"""
+    return {
+        auth['key']: auth['value']
+        for auth in configuration.auth_settings().values()
+        if auth.get('in') == 'header' and auth.get('value')
+    }
+
+
+def _init_client():
+    from kubernetes import client as kubernetes_client, config as kubernetes_config
+    configuration = kubernetes_client.Configuration()
+    if os.path.exists(INCLUSTER_NAMESPACE_FILE) and not os.environ.get('KUBECONFIG'):
+        kubernetes_config.load_incluster_config(client_configuration=configuration)
+        with open(INCLUSTER_NAMESPACE_FILE) as f:
+            namespace = f.read().strip()
+    else:
+        kubernetes_config.load_kube_config(client_configuration=configuration)
+        _, active_context = kubernetes_config.list_kube_config_contexts()
+        namespace = active_context.get('context', {}).get('namespace') or 'default'
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=CONNECTION_POOL_SIZE, pool_maxsize=CONNECTION_POOL_SIZE)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.verify = (configuration.ssl_ca_cert or True) if configuration.verify_ssl else False
+    if configuration.cert_file and configuration.key_file:
+        session.cert = (configuration.cert_file, configuration.key_file)
+    return {'session': session, 'host': configuration.host.rstrip('/'), 'namespace': namespace,
+            'configuration': configuration}
+
+
+def _discover(key):
+    """Discover API resources until the given key is found, core API first and then groups in server priority order"""
+    if '/api/v1' not in __DISCOVERED_GROUPS:
+        _add_group_resources('/api/v1', 'v1')
+        __DISCOVERED_GROUPS.add('/api/v1')
+    if key in __RESOURCES:
+        return
+    for group in request('GET', '/apis').get('groups', []):
+        group_version = group['preferredVersion']['groupVersion']
+        path_prefix = f'/apis/{group_version}'
+        if path_prefix not in __DISCOVERED_GROUPS:
+            _add_group_resources(path_prefix, group_version, group_name=group['name'])
+            __DISCOVERED_GROUPS.add(path_prefix)
+            if key in __RESOURCES:
+                return
+
+
+def _discover_kind(kind, api_version):
+    path_prefix = '/api/v1' if api_version == 'v1' else f'/apis/{api_version}'
+    for resource in request('GET', path_prefix).get('resources', []):
+        if '/' not in resource['name'] and kind in (resource['kind'].lower(), resource['name']):
+            return _get_resource(resource, path_prefix, api_version)
+    raise NotSupported()
+
+
+def _add_group_resources(path_prefix, group_version, group_name=None):
+    for resource in request('GET', path_prefix).get('resources', []):
+        if '/' in resource['name']:
+            # subresources (e.g. pods/log)
+            continue
+        info = _get_resource(resource, path_prefix, group_version)
+        names = [resource['kind'].lower(), resource['name'], resource.get('singularName') or '',
+                 *(resource.get('shortNames') or [])]
+        for name in names:
+            if name:
+                __RESOURCES.setdefault(name, info)
+                if group_name:
+                    __RESOURCES.setdefault(f'{name}.{group_name}', info)
+
+
+def _get_resource(resource, path_prefix, group_version):
+    return {
+        'kind': resource['kind'],
+        'plural': resource['name'],
+        'namespaced': resource['namespaced'],
+        'apiVersion': group_version,
+        'path_prefix': path_prefix,
+    }
@@ -0,0 +1,339 @@
+"""Local in-memory cache of Kubernetes resources, kept per kind and namespace
+
+Two modes are supported:
+
+* informers - for long-running processes, start(kind) lists the resources once and keeps them up to date
+  using a watch from the last seen resourceVersion (requires access to the API server).
+* snapshots - for one-shot CLI commands, `with snapshot(kind, ..):` lists the resources once and serves
+  reads from memory until the end of the block, without watching.
+
+kubectl.get serves reads from the cache for cached kinds / namespaces, other reads are not affected.
+Items are returned as copies, so callers may modify them.
+"""
+import contextlib
+import copy
+import os
+import threading
+import time
+import traceback
+
+from ckan_cloud_operator import logs
+from ckan_cloud_operator.drivers.kubectl import api as kubectl_api
+
+
+# returned by get for named resources which don't exist in a synced cache
+NOT_FOUND = object()
+
+# max seconds to bypass an informer for resources modified by the operator, until the watch gets the modification
+STALE_SECONDS = int(os.environ.get('CKAN_CLOUD_OPERATOR_KUBECTL_CACHE_STALE_SECONDS', '30'))
+
+__LOCK = threading.Lock()
+__STORES = {}
+
+
+class Store(object):
+    """Resources of a single kind in a single namespace"""
+
+    def __init__(self, kind, namespace):
+        self.kind = kind
+        self.namespace = namespace
+        self.resource_version = None
+        self.synced = threading.Event()
+        self._items = {}
+        self._lock = threading.Lock()
+        self._handlers = []
+
+    def add_handler(self, handler):
+        """handler(event_type, obj) is called after every change, a relist calls it with SYNC for all items"""
+        self._handlers.append(handler)
+
+    def replace(self, items, resource_version=None):
+        with self._lock:
+            new_items = {item['metadata']['name']: item for item in items}
+            deleted = [item for name, item in self._items.items() if name not in new_items]
+            self._items = new_items
+            self.resource_version = resource_version
+        self.synced.set()
+        for item in deleted:
+            self._notify('DELETED', item)
+        for item in items:
+            self._notify('SYNC', item)
+
+    def handle_event(self, event_type, obj):
+        metadata = obj.get('metadata', {})
+        with self._lock:
+            if event_type in ('ADDED', 'MODIFIED'):
+                self._items[metadata['name']] = obj
+            elif event_type == 'DELETED':
+                self._items.pop(metadata['name'], None)
+            if metadata.get('resourceVersion'):
+                self.resource_version = metadata['resourceVersion']
+        if event_type in ('ADDED', 'MODIFIED', 'DELETED'):
+            self._notify(event_type, obj)
+
+    def get(self, name):
+        with self._lock:
+            item = self._items.get(name)
+        return copy.deepcopy(item) if item else None
+
+    def list(self, label_selector=None):
+        requirements = parse_label_selector(label_selector)
+        with self._lock:
+            items = [item for item in self._items.values()
+                     if match_labels(item.get('metadata', {}).get('labels') or {}, requirements)]
+        return copy.deepcopy(items)
+
+    def _notify(self, event_type, obj):
+        for handler in self._handlers:
+            try:
+                handler(event_type, obj)
+            except Exception:
+                logs.warning(f'{self.kind} event handler failed')
+                logs.debug(traceback.format_exc())
+
+
+class Snapshot(Store):
+    """Store which is listed once, on first read"""
+
+    def __init__(self, kind, namespace):
+        super().__init__(kind, namespace)
+        self._loading = False
+
+    def load(self):
+        from ckan_cloud_operator import kubectl
+        with self._lock:
+            if self._loading or self.synced.is_set():
+                return
+            self._loading = True
+        try:
+            res = kubectl.get(self.kind, namespace=self.namespace)
+            self.replace(res.get('items', []), (res.get('metadata') or {}).get('resourceVersion'))
+        finally:
+            self._loading = False
+
+
+class Informer(Store):
+    """Store which is kept up to date by a background watch
+
+    Resources modified by the operator are marked as stale, reads of stale resources bypass the informer
+    until the watch gets the modification (or STALE_SECONDS passed), so reconcilers read their own writes.
+    """
+
+    def __init__(self, kind, namespace):
+        super().__init__(kind, namespace)
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f'informer-{kind}-{namespace}', daemon=True)
+        # name -> (expected resource version or None, expiry time)
+        self._stale = {}
+        self._stale_all_expires = 0
+
+    def mark_stale(self, name=None, resource_version=None):
+        """Mark a modified resource as stale, or all the resources if name is not known"""
+        with self._lock:
+            if name:
+                self._stale[name] = (resource_version, time.time() + STALE_SECONDS)
+            else:
+                self._stale_all_expires = time.time() + STALE_SECONDS
+
+    def is_stale(self, name=None):
+        """Returns True if the given resource (or any resource if name is not specified) may be stale"""
+        now = time.time()
+        with self._lock:
+            if self._stale_all_expires > now:
+                return True
+            for stale_name, (_, expires) in list(self._stale.items()):
+                if expires <= now:
+                    del self._stale[stale_name]
+            return name in self._stale if name else bool(self._stale)
+
+    def handle_event(self, event_type, obj):
+        metadata = obj.get('metadata', {})
+        with self._lock:
+            stale = self._stale.get(metadata.get('name'))
+            if stale and (not stale[0] or stale[0] == metadata.get('resourceVersion') or event_type == 'DELETED'):
+                del self._stale[metadata['name']]
+        super().handle_event(event_type, obj)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def _run(self):
+        retry_seconds = 1
+        while not self._stopped.is_set():
+            try:
+                if not self.resource_version:
+                    res = kubectl_api.list_items(self.kind, namespace=self.namespace)
+                    self.replace(res['items'], res.get('metadata', {}).get('resourceVersion'))
+                for event in kubectl_api.watch(self.kind, namespace=self.namespace,
+                                               resource_version=self.resource_version):
+                    if self._stopped.is_set():
+                        return
+                    if event['type'] == 'ERROR':
+                        # usually 410 Gone - the resource version is too old, relist
+                        logs.debug(f'informer {self.kind} watch error, relisting', status=event['object'])
+                        self.resource_version = None
+                        break
+                    self.handle_event(event['type'], event['object'])
+                retry_seconds = 1
+            except kubectl_api.ApiError as e:
+                if e.status == 410:
+                    self.resource_version = None
+                else:
+                    logs.warning(f'informer {self.kind} failed, retrying in {retry_seconds} seconds')
+                    logs.debug(traceback.format_exc())
+                    self._stopped.wait(retry_seconds)
+                    retry_seconds = min(retry_seconds * 2, 60)
+            except Exception:
+                logs.warning(f'informer {self.kind} failed, retrying in {retry_seconds} seconds')
+                logs.debug(traceback.format_exc())
+                self._stopped.wait(retry_seconds)
+                retry_seconds = min(retry_seconds * 2, 60)
+
+
+def start(kind, namespace='ckan-cloud', wait_synced=True, timeout=60, handler=None):
+    """Start an informer for the given kind, reads of this kind will be served from memory from now on
+
+    handler(event_type, obj) is called for every change of the kind, see Store.add_handler
+    """
+    key = _get_key(kind, namespace)
+    with __LOCK:
+        informer = __STORES.get(key)
+        if not informer:
+            informer = __STORES[key] = Informer(kind, namespace)
+            if handler:
+                informer.add_handler(handler)
+            informer.start()
+        elif handler:
+            informer.add_handler(handler)
+    if wait_synced:
+        start_time = time.time()
+        assert informer.synced.wait(timeout), f'timeout waiting for {kind} informer to sync'
+        logs.debug(f'{kind} informer synced', seconds=time.time() - start_time)
+    return informer
+
+
+def stop(kind=None, namespace='ckan-cloud'):
+    """Stop the informer for the given kind, or all informers / snapshots if kind is not specified"""
+    with __LOCK:
+        keys = [_get_key(kind, namespace)] if kind else list(__STORES.keys())
+        for key in keys:
+            store = __STORES.pop(key, None)
+            if isinstance(store, Informer):
+                store.stop()
+
+
+@contextlib.contextmanager
+def snapshot(*kinds, namespace='ckan-cloud'):
+    """Serve reads of the given kinds from a single listing of each kind until the end of the block
+
+    Each kind is listed on the first read, kinds which are not read are not listed
+    """
+    keys = []
+    try:
+        with __LOCK:
+            for kind in kinds:
+                key = _get_key(kind, namespace)
+                if key not in __STORES:
+                    __STORES[key] = Snapshot(kind, namespace)
+                    keys.append(key)
+        yield
+    finally:
+        with __LOCK:
+            for key in keys:
+                __STORES.pop(key, None)
+
+
+def invalidate(kind=None, namespace='ckan-cloud', name=None, resource_version=None):
+    """Called after the operator modifies a resource of the given kind
+
+    Snapshots of this kind are dropped so that following reads get the modified resource,
+    informers are kept as they get the modification from the watch, until then reads of the
+    modified resource (or of all the kind resources, if name is not known) bypass the informer.
+    If kind is not specified (e.g. kubectl commands which may modify any kind) all the stores
+    of the namespace are invalidated, or of all namespaces if namespace is None as well.
+    """
+    with __LOCK:
+        if kind:
+            keys = [_get_key(kind, namespace)]
+        else:
+            keys = [key for key in __STORES if namespace is None or key[1] == namespace]
+        for key in keys:
+            store = __STORES.get(key)
+            if isinstance(store, Informer):
+                store.mark_stale(name if kind else None, resource_version)
+            elif store:
+                del __STORES[key]
+
+
+def get(what, *args, namespace='ckan-cloud', get_cmd='get', **kwargs):
+    """Returns the same data structure as kubectl.get if it can be served from the cache, None otherwise
+
+    NOT_FOUND is returned for named resources which don't exist in the cache
+    """
+    if not __STORES or get_cmd != 'get' or kwargs:
+        return None
+    try:
+        kinds, name, label_selector, all_namespaces = kubectl_api.parse_get_args(what, *args)
+    except kubectl_api.NotSupported:
+        return None
+    if len(kinds) != 1 or all_namespaces:
+        return None
+    store = __STORES.get(_get_key(kinds[0], namespace))
+    if isinstance(store, Snapshot):
+        store.load()
+    if not store or not store.synced.is_set():
+        return None
+    if isinstance(store, Informer) and store.is_stale(name):
+        return None
+    if name:
+        if label_selector:
+            return None
+        return store.get(name) or NOT_FOUND
+    try:
+        items = store.list(label_selector)
+    except kubectl_api.NotSupported:
+        return None
+    return {'apiVersion': 'v1', 'kind': 'List', 'items': items, 'metadata': {'resourceVersion': ''}}
+
+
+def parse_label_selector(label_selector):
+    """Parses equality based label selectors to a list of (key, operator, value), operator is one of =, !=, exists"""
+    requirements = []
+    for requirement in (label_selector or '').split(','):
+        requirement = requirement.strip()
+        if not requirement:
+            continue
+        elif ' ' in requirement or '(' in requirement:
+            # set based requirements (in / notin) are not supported
+            raise kubectl_api.NotSupported()
+        elif '!=' in requirement:
+            key, value = requirement.split('!=', 1)
+            requirements.append((key, '!=', value))
+        elif '=' in requirement:
+            key, value = requirement.replace('==', '=').split('=', 1)
+            requirements.append((key, '=', value))
+        elif requirement.startswith('!'):
+            requirements.append((requirement[1:], '!exists', None))
+        else:
+            requirements.append((requirement, 'exists', None))
+    return requirements
+
+
+def match_labels(labels, requirements):
+    for key, operator, value in requirements:
+        if operator == '=' and labels.get(key) != value:
+            return False
+        elif operator == '!=' and labels.get(key) == value:
+            return False
+        elif operator == 'exists' and key not in labels:
+            return False
+        elif operator == '!exists' and key in labels:
+            return False
+    return True
+
+
+def _get_key(kind, namespace):
+    return kind.lower(), namespace
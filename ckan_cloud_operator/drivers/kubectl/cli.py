@@ -23,3 +23,26 @@ def get(what, args, required, namespace, get_cmd, default_flow_style):
         driver.get(what, *args, required=required, namespace=namespace, get_cmd=get_cmd),
         default_flow_style=default_flow_style
     ))
+
+
+@kubectl.command()
+@click.argument('FILENAMES', nargs=-1)
+@click.option('--dry-run', is_flag=True)
+@click.option('--diff', is_flag=True, help='show the changes which would be made, without applying')
+def apply(filenames, dry_run, diff):
+    """Apply all the resources from the given multi-document yaml files together"""
+    resources = []
+    for filename in filenames:
+        with open(filename) as f:
+            for resource in yaml.safe_load_all(f):
+                if resource and resource.get('kind') == 'List':
+                    resources += resource.get('items', [])
+                elif resource:
+                    resources.append(resource)
+    results = driver.apply_many(resources, dry_run=dry_run, diff=diff, required=False)
+    for result in results:
+        if result['diff']:
+            print(result['diff'])
+        print(f'{result["kind"]}/{result["name"]}: {"error: " + result["error"] if result["error"] else "ok"}')
+    if any(result['error'] for result in results):
+        exit(1)
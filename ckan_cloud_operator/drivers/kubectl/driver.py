@@ -3,3 +3,7 @@ from ckan_cloud_operator import kubectl
 
 def get(what, *args, required=True, namespace=None, get_cmd=None, **kwargs):
     return kubectl.get(what, *args, required=required, namespace=namespace, get_cmd=get_cmd, **kwargs)
+
+
+def apply_many(resources, dry_run=False, diff=False, required=True):
+    return kubectl.apply_many(resources, dry_run=dry_run, diff=diff, required=required)
@@ -1,14 +1,201 @@
+import os
+import time
+import shlex
+import shutil
 import psycopg2
+import psycopg2.extensions
 import contextlib
+import subprocess
+import tempfile
+import threading
 import traceback
 
 from ckan_cloud_operator import logs
 
 
+# max number of idle connections kept open for each pool key
+POOL_MAX_IDLE_CONNECTIONS = int(os.environ.get('CKAN_CLOUD_OPERATOR_POSTGRES_POOL_MAX_IDLE_CONNECTIONS', '2'))
+
+# max number of idle connections kept open for all the pool keys, the least recently used keys are closed first
+# (e.g. connections to specific dbs which were used once)
+POOL_MAX_TOTAL_IDLE_CONNECTIONS = int(os.environ.get('CKAN_CLOUD_OPERATOR_POSTGRES_POOL_MAX_TOTAL_IDLE_CONNECTIONS', '8'))
+
+# statements which take longer than this are logged as info, others as debug
+SLOW_STATEMENT_SECONDS = float(os.environ.get('CKAN_CLOUD_OPERATOR_POSTGRES_SLOW_STATEMENT_SECONDS', '1'))
+
+# number of parallel jobs of pg_restore, used for custom format dumps
+RESTORE_JOBS = int(os.environ.get('CKAN_CLOUD_OPERATOR_POSTGRES_RESTORE_JOBS', '4'))
+
+# first bytes of a custom format dump (pg_dump --format=custom)
+CUSTOM_DUMP_MAGIC = b'PGDMP'
+
+# pool key -> (connection string, idle connections), ordered from least to most recently used
+__POOL = {}
+__POOL_LOCK = threading.Lock()
+__STATEMENT_STATS = {}
+__STATEMENT_STATS_LOCK = threading.Lock()
+
+
+class TimedCursor(psycopg2.extensions.cursor):
+    """Cursor which records the number of statements and their total duration by statement type"""
+
+    def execute(self, query, vars=None):
+        start_time = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            _record_statement(query, time.perf_counter() - start_time)
+
+
 @contextlib.contextmanager
 def connect(*args, **kwargs):
-    with psycopg2.connect(*args, **kwargs) as conn:
+    with contextlib.closing(psycopg2.connect(*args, cursor_factory=TimedCursor, **kwargs)) as conn:
+        with conn:
+            yield conn
+
+
+@contextlib.contextmanager
+def pooled_connect(connection_string, key=None, autocommit=False):
+    """Get an open connection from the pool of the given key (defaults to the connection string)
+
+    The transaction is committed (or rolled back on error) when the block exits and the connection
+    is returned to the pool, with autocommit each statement is committed immediately.
+    """
+    key = key or connection_string
+    conn = _acquire_pooled_connection(key, connection_string)
+    try:
+        conn.autocommit = autocommit
         yield conn
+        if not conn.autocommit:
+            conn.commit()
+    except Exception:
+        if not conn.closed:
+            conn.rollback()
+        raise
+    finally:
+        _release_pooled_connection(key, connection_string, conn)
+
+
+def close_pool():
+    with __POOL_LOCK:
+        for connection_string, connections in __POOL.values():
+            for conn in connections:
+                conn.close()
+        __POOL.clear()
+
+
+def get_statement_stats():
+    """Returns a dict of statement type -> {'count': int, 'seconds': float} of all the executed statements"""
+    with __STATEMENT_STATS_LOCK:
+        return {statement_type: dict(stats) for statement_type, stats in __STATEMENT_STATS.items()}
+
+
+def reset_statement_stats():
+    with __STATEMENT_STATS_LOCK:
+        __STATEMENT_STATS.clear()
+
+
+def execute_statements(conn, statements):
+    """Execute a list of (sql, args) statements in a single round trip
+
+    The statements run as a single implicit transaction, so statements which can't run inside
+    a transaction block (CREATE DATABASE) should be executed separately.
+    """
+    if not statements:
+        return
+    with conn.cursor() as cur:
+        cur.execute(b';\n'.join(cur.mogrify(sql, args) for sql, args in statements))
+
+
+def create_base_dbs_and_roles(admin_conn, dbs, roles=None, grant_to_user=None):
+    """Create dbs with owner roles of the same name, and additional login roles, using a minimal number of round trips
+
+    dbs / roles are dicts of name -> role password, returns a dict of db name -> errors, the same as create_base_db
+    """
+    roles = roles or {}
+    names = [*dbs, *roles]
+    with _autocommit(admin_conn):
+        with admin_conn.cursor() as cur:
+            cur.execute('select rolname from pg_roles where rolname = any(%s)', (names,))
+            existing_roles = {row[0] for row in cur.fetchall()}
+            cur.execute('select datname from pg_database where datname = any(%s)', (names,))
+            existing_dbs = {row[0] for row in cur.fetchall()}
+        errors = {db_name: [] for db_name in dbs}
+        create_roles = {}
+        for name, password in [*dbs.items(), *roles.items()]:
+            if name in existing_roles:
+                if name in dbs:
+                    logs.info(f'Role already exists: {name}')
+                    errors[name].append('role-exists')
+            else:
+                create_roles[name] = password
+        if create_roles:
+            logs.info(f'Creating roles: {", ".join(create_roles)}')
+        execute_statements(admin_conn, [
+            statement for role_name, role_password in create_roles.items() for statement in [
+                (f'CREATE ROLE "{role_name}" WITH LOGIN PASSWORD %s NOSUPERUSER NOCREATEDB NOCREATEROLE', (role_password,)),
+                (f'GRANT "{role_name}" TO postgres', None),
+            ]
+        ])
+        for db_name in dbs:
+            if db_name in existing_dbs:
+                logs.info(f'DB already exists: {db_name}')
+                errors[db_name].append('db-exists')
+            else:
+                logs.info(f'Creating DB: {db_name}')
+                with admin_conn.cursor() as cur:
+                    cur.execute(f'CREATE DATABASE "{db_name}";')
+        if grant_to_user:
+            execute_statements(admin_conn, [(f'GRANT "{db_name}" to "{grant_to_user}"', None) for db_name in dbs])
+    return errors
+
+
+def restore_from_url(connection_string, import_url, role=None, jobs=RESTORE_JOBS):
+    """Restore a dump from a url (gs://, s3://, http(s):// or a local path, optionally .gz) into an existing db
+
+    Plain SQL dumps are piped to psql while they are downloaded. Custom format dumps are restored using
+    pg_restore --jobs, which requires a seekable file, so they are downloaded to a temporary file first.
+    Objects are created by the given role, the same as the import user of a Cloud SQL import.
+    """
+    env = {**os.environ, 'PGOPTIONS': f'-c role={role}'} if role else None
+    download = subprocess.Popen(['bash', '-o', 'pipefail', '-c', _get_download_command(import_url)],
+                                stdout=subprocess.PIPE)
+    try:
+        header = download.stdout.read(len(CUSTOM_DUMP_MAGIC))
+        if header == CUSTOM_DUMP_MAGIC:
+            with tempfile.NamedTemporaryFile(suffix='.dump') as dump_file:
+                dump_file.write(header)
+                shutil.copyfileobj(download.stdout, dump_file)
+                dump_file.flush()
+                _check_download(download, import_url)
+                logs.info(f'Restoring custom format dump: {import_url}', jobs=jobs)
+                subprocess.check_call(['pg_restore', '--no-owner', '--no-acl', '--exit-on-error', f'--jobs={jobs}',
+                                       f'--dbname={connection_string}', dump_file.name], env=env)
+        else:
+            logs.info(f'Restoring plain SQL dump: {import_url}')
+            psql = subprocess.Popen(['psql', '--quiet', '--set=ON_ERROR_STOP=1', f'--dbname={connection_string}',
+                                     '--file=-'], stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, env=env)
+            try:
+                psql.stdin.write(header)
+                shutil.copyfileobj(download.stdout, psql.stdin)
+            except BrokenPipeError:
+                # psql exited on error, the returncode is checked below
+                pass
+            finally:
+                try:
+                    psql.stdin.close()
+                except BrokenPipeError:
+                    pass
+            returncode = psql.wait()
+            if returncode != 0:
+                # the download fails as well when psql stops reading, it's killed below
+                raise subprocess.CalledProcessError(returncode, 'psql')
+            _check_download(download, import_url)
+    finally:
+        if download.poll() is None:
+            download.kill()
+            download.wait()
+        download.stdout.close()
 
 
 def create_base_db(admin_conn, db_name, db_password, grant_to_user=None):
@@ -24,15 +211,13 @@ def create_base_db(admin_conn, db_name, db_password, grant_to_user=None):
         errors.append('db-exists')
     else:
         logs.info(f'Creating DB: {db_name}')
-        _set_session_autocommit(admin_conn)
-        with admin_conn.cursor() as cur:
-            cur.execute(f'CREATE DATABASE "{db_name}";')
-        _unset_session_autocommit(admin_conn)
+        with _autocommit(admin_conn):
+            with admin_conn.cursor() as cur:
+                cur.execute(f'CREATE DATABASE "{db_name}";')
     if grant_to_user:
-        _set_session_autocommit(admin_conn)
-        with admin_conn.cursor() as cur:
-            cur.execute(f'GRANT "{db_name}" to "{grant_to_user}";')
-        _unset_session_autocommit(admin_conn)
+        with _autocommit(admin_conn):
+            with admin_conn.cursor() as cur:
+                cur.execute(f'GRANT "{db_name}" to "{grant_to_user}";')
 
     return errors
 
@@ -41,37 +226,34 @@ def create_role_if_not_exists(admin_conn, role_name, role_password):
     roles = list(list_roles(admin_conn, role_name=role_name))
     if len(roles) == 0:
         logs.info(f'Creating role: {role_name}')
-        _set_session_autocommit(admin_conn)
-        with admin_conn.cursor() as cur:
-            cur.execute(f'CREATE ROLE "{role_name}" WITH LOGIN PASSWORD %s NOSUPERUSER NOCREATEDB NOCREATEROLE;',
-                        (role_password,))
-            cur.execute(f'GRANT "{role_name}" TO postgres;')
-        _unset_session_autocommit(admin_conn)
+        with _autocommit(admin_conn):
+            with admin_conn.cursor() as cur:
+                cur.execute(f'CREATE ROLE "{role_name}" WITH LOGIN PASSWORD %s NOSUPERUSER NOCREATEDB NOCREATEROLE;',
+                            (role_password,))
+                cur.execute(f'GRANT "{role_name}" TO postgres;')
 
 
 def delete_role(admin_conn, role_name):
     roles = list(list_roles(admin_conn, role_name=role_name))
     if len(roles) > 0:
         logs.info(f'Deleting role: {role_name}')
-        _set_session_autocommit(admin_conn)
-        with admin_conn.cursor() as cur:
-            try:
-                cur.execute(f'DROP ROLE "{role_name}"')
-            except psycopg2.ProgrammingError:
-                traceback.print_exc()
-        _unset_session_autocommit(admin_conn)
+        with _autocommit(admin_conn):
+            with admin_conn.cursor() as cur:
+                try:
+                    cur.execute(f'DROP ROLE "{role_name}"')
+                except psycopg2.ProgrammingError:
+                    traceback.print_exc()
 
 
 def delete_base_db(admin_conn, db_name):
     errors = []
     db_info = get_db_role_info(admin_conn, db_name)
     logs.info(f'Revoking connect and terminating all connections db: {db_name}')
-    _set_session_autocommit(admin_conn)
-    with admin_conn.cursor() as cur:
-        try: cur.execute(f'REVOKE CONNECT ON DATABASE "{db_name}" FROM public;')
-        except psycopg2.ProgrammingError:
-            traceback.print_exc()
-    _unset_session_autocommit(admin_conn)
+    with _autocommit(admin_conn):
+        with admin_conn.cursor() as cur:
+            try: cur.execute(f'REVOKE CONNECT ON DATABASE "{db_name}" FROM public;')
+            except psycopg2.ProgrammingError:
+                traceback.print_exc()
     with admin_conn.cursor() as cur:
         try: cur.execute('SELECT pg_terminate_backend(pg_stat_activity.pid) '
                          'FROM pg_stat_activity '
@@ -80,24 +262,22 @@ def delete_base_db(admin_conn, db_name):
             traceback.print_exc()
     if db_info.get('db'):
         logs.info(f'Deleting db: {db_name}')
-        _set_session_autocommit(admin_conn)
-        with admin_conn.cursor() as cur:
-            try: cur.execute(f'DROP DATABASE "{db_name}"')
-            except psycopg2.ProgrammingError:
-                traceback.print_exc()
-        _unset_session_autocommit(admin_conn)
+        with _autocommit(admin_conn):
+            with admin_conn.cursor() as cur:
+                try: cur.execute(f'DROP DATABASE "{db_name}"')
+                except psycopg2.ProgrammingError:
+                    traceback.print_exc()
     else:
         logs.info(f'DB does not exist: {db_name}')
         errors.append('db-does-not-exist')
     if db_info.get('role'):
         logs.info(f'Deleting role: {db_name}')
-        _set_session_autocommit(admin_conn)
-        with admin_conn.cursor() as cur:
-            try:
-                cur.execute(f'DROP ROLE "{db_name}"')
-            except psycopg2.ProgrammingError:
-                traceback.print_exc()
-        _unset_session_autocommit(admin_conn)
+        with _autocommit(admin_conn):
+            with admin_conn.cursor() as cur:
+                try:
+                    cur.execute(f'DROP ROLE "{db_name}"')
+                except psycopg2.ProgrammingError:
+                    traceback.print_exc()
     else:
         logs.info(f'Role does not exist: {db_name}')
         errors.append('role-does-not-exist')
@@ -167,11 +347,107 @@ def initialize_extensions(admin_db_conn, extension_names):
         ]))
 
 
-def _set_session_autocommit(conn):
-    conn.commit()
-    conn.set_session(autocommit=True)
+@contextlib.contextmanager
+def _autocommit(conn):
+    """Run the block in autocommit mode, the session is changed only if it's not already in autocommit mode"""
+    if conn.autocommit:
+        yield
+    else:
+        conn.commit()
+        conn.autocommit = True
+        try:
+            yield
+        finally:
+            conn.autocommit = False
+
+
+def _acquire_pooled_connection(key, connection_string):
+    with __POOL_LOCK:
+        pool_connection_string, idle_connections = __POOL.pop(key, (connection_string, []))
+    if pool_connection_string != connection_string:
+        # credentials changed
+        for conn in idle_connections:
+            conn.close()
+        idle_connections = []
+    for conn in reversed(idle_connections):
+        if _is_alive(conn):
+            idle_connections.remove(conn)
+            if idle_connections:
+                _release_pooled_connection(key, connection_string, *idle_connections)
+            return conn
+        conn.close()
+    return psycopg2.connect(connection_string, cursor_factory=TimedCursor)
+
+
+def _is_alive(conn):
+    """Ping an idle connection, it may have been terminated by the server (e.g. when its db was deleted)"""
+    if conn.closed or conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+        return False
+    try:
+        conn.autocommit = True
+        with conn.cursor(cursor_factory=psycopg2.extensions.cursor) as cur:
+            cur.execute('select 1')
+        return True
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        return False
+
+
+def _release_pooled_connection(key, connection_string, *conns):
+    close_connections = []
+    with __POOL_LOCK:
+        pool_connection_string, connections = __POOL.pop(key, (connection_string, []))
+        if pool_connection_string != connection_string:
+            close_connections += connections
+            connections = []
+        for conn in conns:
+            if conn.closed or len(connections) >= POOL_MAX_IDLE_CONNECTIONS:
+                close_connections.append(conn)
+            else:
+                connections.append(conn)
+        if connections:
+            __POOL[key] = (connection_string, connections)
+        num_idle_connections = sum(len(idle_connections) for _, idle_connections in __POOL.values())
+        for lru_key in list(__POOL):
+            if num_idle_connections <= POOL_MAX_TOTAL_IDLE_CONNECTIONS:
+                break
+            _, lru_connections = __POOL.pop(lru_key)
+            close_connections += lru_connections
+            num_idle_connections -= len(lru_connections)
+    for conn in close_connections:
+        conn.close()
+
+
+def _record_statement(query, seconds):
+    if isinstance(query, bytes):
+        query = query.decode(errors='replace')
+    statements = [statement.strip() for statement in str(query).split(';\n') if statement.strip()]
+    statement_type = ' '.join(statements[0].split()[:2]).upper() if statements else ''
+    if len(statements) > 1:
+        statement_type = f'{statement_type} (+{len(statements) - 1})'
+    with __STATEMENT_STATS_LOCK:
+        stats = __STATEMENT_STATS.setdefault(statement_type, {'count': 0, 'seconds': 0.0})
+        stats['count'] += 1
+        stats['seconds'] += seconds
+    (logs.info if seconds >= SLOW_STATEMENT_SECONDS else logs.debug)(
+        f'postgres statement: {statement_type}', seconds=round(seconds, 3)
+    )
+
+
+def _get_download_command(import_url):
+    if import_url.startswith('gs://'):
+        args = ['gsutil', 'cat', import_url]
+    elif import_url.startswith('s3://'):
+        args = ['aws', 's3', 'cp', import_url, '-']
+    elif import_url.startswith('http://') or import_url.startswith('https://'):
+        args = ['curl', '--silent', '--show-error', '--fail', '--location', import_url]
+    else:
+        args = ['cat', import_url]
+    command = ' '.join(shlex.quote(arg) for arg in args)
+    return f'{command} | gunzip -c' if import_url.endswith('.gz') else command
 
 
-def _unset_session_autocommit(conn):
-    conn.commit()
-    conn.set_session(autocommit=False)
+def _check_download(download, import_url):
+    download.stdout.close()
+    returncode = download.wait()
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, f'download {import_url}')
@@ -2,16 +2,53 @@ import yaml
 import base64
 import traceback
 import datetime
+import difflib
+import concurrent.futures
+import contextlib
 import json
 import logging
+import os
 import subprocess
+import time
 from ckan_cloud_operator import yaml_config
 from ckan_cloud_operator import logs
+from ckan_cloud_operator.drivers.kubectl import api as kubectl_api
+from ckan_cloud_operator.drivers.kubectl import cache as kubectl_cache
+
+
+# subprocess - run the kubectl binary for every call
+# api - use a pooled keep-alive connection to the Kubernetes API server, falls back to kubectl for unsupported commands
+KUBECTL_BACKEND = os.environ.get('CKAN_CLOUD_OPERATOR_KUBECTL_BACKEND', 'subprocess')
+
+# max number of concurrent apply / diff requests made by apply_many
+APPLY_MANY_CONCURRENCY = int(os.environ.get('CKAN_CLOUD_OPERATOR_KUBECTL_APPLY_CONCURRENCY', '8'))
+
+# max number of concurrent kubectl logs calls made by get_pods_logs and the timeout of each call
+LOGS_CONCURRENCY = int(os.environ.get('CKAN_CLOUD_OPERATOR_KUBECTL_LOGS_CONCURRENCY', '8'))
+LOGS_TIMEOUT_SECONDS = int(os.environ.get('CKAN_CLOUD_OPERATOR_KUBECTL_LOGS_TIMEOUT', '20'))
+
+# max seconds between polls of wait_for when using the subprocess backend, polls start at 1 second and double
+WAIT_POLL_MAX_SECONDS = float(os.environ.get('CKAN_CLOUD_OPERATOR_KUBECTL_WAIT_POLL_MAX_SECONDS', '10'))
+
+# kubectl commands which may modify resources, cached snapshots are dropped after running them
+MUTATING_COMMANDS = {'apply', 'create', 'delete', 'annotate', 'label', 'patch', 'edit', 'replace', 'scale', 'set',
+                     'rollout', 'expose', 'autoscale', 'taint'}
+
+
+class ApplyManyError(Exception):
+
+    def __init__(self, results):
+        self.results = results
+        failed = [f'{r["kind"]}/{r["name"]}: {r["error"]}' for r in results if r['error']]
+        super().__init__(f'failed to apply {len(failed)}/{len(results)} resources\n' + '\n'.join(failed))
 
 
 def check_call(cmd, namespace='ckan-cloud', use_first_pod=False):
     cmd = _parse_call_cmd(cmd, namespace, use_first_pod)
-    logs.subprocess_check_call(f'kubectl -n {namespace} {cmd}', shell=True)
+    try:
+        logs.subprocess_check_call(f'kubectl -n {namespace} {cmd}', shell=True)
+    finally:
+        _invalidate_cache_cmd(cmd, namespace)
 
 
 def get_deployment_pod_name(deployment_name, namespace='ckan-cloud', use_first_pod=False, required_phase=None):
@@ -28,25 +65,52 @@ def get_deployment_pod_name(deployment_name, namespace='ckan-cloud', use_first_p
 
 
 def check_output(cmd, namespace='ckan-cloud'):
-    return logs.subprocess_check_output(f'kubectl -n {namespace} {cmd}', shell=True)
+    try:
+        return logs.subprocess_check_output(f'kubectl -n {namespace} {cmd}', shell=True)
+    finally:
+        _invalidate_cache_cmd(cmd, namespace)
 
 
 def call(cmd, namespace='ckan-cloud'):
-    return subprocess.call(f'kubectl -n {namespace} {cmd}', shell=True)
+    try:
+        return subprocess.call(f'kubectl -n {namespace} {cmd}', shell=True)
+    finally:
+        _invalidate_cache_cmd(cmd, namespace)
 
 
 def getstatusoutput(cmd, namespace='ckan-cloud', use_first_pod=False):
     cmd = _parse_call_cmd(cmd, namespace, use_first_pod)
-    return subprocess.getstatusoutput(f'kubectl -n {namespace} {cmd}')
+    try:
+        return subprocess.getstatusoutput(f'kubectl -n {namespace} {cmd}')
+    finally:
+        _invalidate_cache_cmd(cmd, namespace)
 
 
 def get(what, *args, required=True, namespace='ckan-cloud', get_cmd='get', **kwargs):
+    cached = kubectl_cache.get(what, *args, namespace=namespace, get_cmd=get_cmd, **kwargs)
+    if cached is kubectl_cache.NOT_FOUND:
+        if required:
+            raise kubectl_api.ApiError(404, f'{what} {" ".join(args)} not found')
+        else:
+            return None
+    elif cached is not None:
+        return cached
+    if _use_api_backend():
+        try:
+            return kubectl_api.get(what, *args, namespace=namespace, get_cmd=get_cmd, **kwargs)
+        except kubectl_api.NotSupported:
+            pass
+        except kubectl_api.ApiError as e:
+            if required or e.status != 404:
+                raise
+            else:
+                return None
     extra_args = ' '.join(args)
     extra_kwargs = ' '.join([f'{k} {v}' for k, v in kwargs.items()])
     try:
-        return yaml.load(
+        return kubectl_api.loads(
             logs.subprocess_check_output(
-                f'kubectl -n {namespace} {get_cmd} {what} {extra_args} -o yaml {extra_kwargs}', shell=True,
+                f'kubectl -n {namespace} {get_cmd} {what} {extra_args} -o json {extra_kwargs}', shell=True,
             )
         )
     except subprocess.CalledProcessError:
@@ -65,7 +129,10 @@ def edit(what, *edit_args, namespace='ckan-cloud', **edit_kwargs):
     for item in items:
         name = item['metadata']['name']
         kind = item['kind']
-        subprocess.check_call(f'kubectl -n {namespace} edit {kind}/{name} {extra_edit_args} {extra_edit_kwargs}', shell=True)
+        try:
+            subprocess.check_call(f'kubectl -n {namespace} edit {kind}/{name} {extra_edit_args} {extra_edit_kwargs}', shell=True)
+        finally:
+            _invalidate_cache(item, namespace)
 
 
 def get_items_by_labels(resource_kind, labels, required=True, namespace='ckan-cloud'):
@@ -83,6 +150,24 @@ def edit_items_by_labels(resource_kind, labels, namespace='ckan-cloud'):
     edit(f'{resource_kind} -l {label_selector}', namespace=namespace)
 
 
+def wait_for(kind, name, condition, timeout, namespace='ckan-cloud', on_progress=None):
+    """Wait until condition(resource) returns a true value and return it, returns None on timeout
+
+    condition is called with None while the resource doesn't exist.
+    on_progress(resource) is called for every change of the resource seen while waiting.
+
+    With the api backend the resource is watched, so the wait ends as soon as the resource changes,
+    otherwise the resource is polled with exponential backoff up to WAIT_POLL_MAX_SECONDS.
+    """
+    deadline = time.time() + timeout
+    if _use_api_backend():
+        try:
+            return _wait_for_watch(kind, name, condition, deadline, namespace, on_progress)
+        except kubectl_api.NotSupported:
+            pass
+    return _wait_for_poll(kind, name, condition, deadline, namespace, on_progress)
+
+
 def delete_items_by_labels(resource_kinds, labels, namespace='ckan-cloud'):
     label_selector = ','.join([f'{k}={v}' for k,v in labels.items()])
     resource_kinds = ','.join(resource_kinds)
@@ -168,26 +253,35 @@ def get_item_detailed_status(item):
     return item_status
 
 
-def get_deployment_detailed_status(deployment, pod_label_selector, main_container_name, namespace='ckan-cloud'):
+def get_deployment_detailed_status(deployment, pod_label_selector, main_container_name, namespace='ckan-cloud',
+                                   with_logs=True):
+    """Get the deployment status with status of all pods and containers
+
+    with_logs=False skips getting the containers logs, when only the readiness is needed
+    """
     status = get_item_detailed_status(deployment)
     ready = len(status.get('error', [])) == 0
     status['pods'] = []
     pods = get(f'pods -l {pod_label_selector}', namespace=namespace, required=False)
     if pods:
+        pods_logs = get_pods_logs(
+            [(pod['metadata']['name'], container['name'])
+             for pod in pods['items'] for container in pod['spec']['containers']],
+            namespace=namespace, tail=5
+        ) if with_logs else {}
         for pod in pods['items']:
             pod_status = get_item_detailed_status(pod)
             pod_status['other-containers'] = []
             for container in pod['spec']['containers']:
                 container_name = container['name']
                 container_status = {'name': container_name}
-                status_code, output = subprocess.getstatusoutput(
-                    f'kubectl -n {namespace} logs {pod["metadata"]["name"]} -c {main_container_name} --tail 5',
-                )
-                if status_code == 0:
-                    container_status['logs'] = output
-                else:
-                    if container_name == main_container_name: ready = False
-                    container_status['logs'] = ''
+                if with_logs:
+                    status_code, output = pods_logs[(pod['metadata']['name'], container_name)]
+                    if status_code == 0:
+                        container_status['logs'] = output
+                    else:
+                        if container_name == main_container_name: ready = False
+                        container_status['logs'] = ''
                 container_status['image'] = container['image']
                 if container_name == main_container_name:
                     pod_status['main-container'] = container_status
@@ -197,18 +291,60 @@ def get_deployment_detailed_status(deployment, pod_label_selector, main_containe
     return dict(status, ready=ready, namespace=deployment['metadata']['namespace'])
 
 
+def get_pods_logs(pod_containers, namespace='ckan-cloud', tail=None, timeout=None):
+    """Get logs of multiple pod containers concurrently
+
+    pod_containers is a list of (pod_name, container_name) tuples,
+    returns a dict of (pod_name, container_name) -> (status_code, output),
+    calls which didn't complete within the timeout return status code -1
+    """
+    if not timeout:
+        timeout = LOGS_TIMEOUT_SECONDS
+
+    def _get_logs(pod_container):
+        pod_name, container_name = pod_container
+        cmd = ['kubectl', '-n', namespace, 'logs', pod_name, '-c', container_name]
+        if tail:
+            cmd += ['--tail', str(tail)]
+        try:
+            completed = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=timeout)
+        except subprocess.TimeoutExpired:
+            return -1, f'timeout getting logs of {pod_name} container {container_name}'
+        output = completed.stdout.decode(errors='replace')
+        if output.endswith('\n'):
+            output = output[:-1]
+        return completed.returncode, output
+
+    pod_containers = list(pod_containers)
+    if not pod_containers:
+        return {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(LOGS_CONCURRENCY, len(pod_containers))) as executor:
+        return dict(zip(pod_containers, executor.map(_get_logs, pod_containers)))
+
+
 def create(resource, is_yaml=False):
-    if is_yaml: resource = yaml.load(resource)
+    if is_yaml: resource = yaml.load(resource, Loader=yaml_config.Loader)
+    if _use_api_backend():
+        try:
+            _invalidate_cache(resource, result=kubectl_api.create(resource))
+            return
+        except kubectl_api.NotSupported:
+            pass
+        except kubectl_api.ApiError:
+            logging.exception('Failed to create resource\n%s', yaml.dump(resource, default_flow_style=False))
+            raise
     try:
-        logs.subprocess_run('kubectl create -f -', input=yaml.dump(resource).encode())
+        logs.subprocess_run('kubectl create -f -', input=yaml.dump(resource, Dumper=yaml_config.Dumper).encode())
     except:
         logging.exception('Failed to create resource\n%s', yaml.dump(resource, default_flow_style=False))
         raise
+    finally:
+        _invalidate_cache(resource)
 
 
 
 def apply(resource, is_yaml=False, reconcile=False, dry_run=False, force=False):
-    if is_yaml: resource = yaml.load(resource)
+    if is_yaml: resource = yaml.load(resource, Loader=yaml_config.Loader)
     cmd = 'auth reconcile' if reconcile else 'apply'
     args = []
     if dry_run:
@@ -216,16 +352,131 @@ def apply(resource, is_yaml=False, reconcile=False, dry_run=False, force=False):
     if force:
         args.append('--force')
     args = " ".join(args)
+    result = None
     try:
-        logs.subprocess_run(
-            f'kubectl {cmd} {args} -f -',
-            input=yaml.dump(resource).encode()
-        )
+        if _use_api_backend() and not reconcile and not force:
+            try:
+                result = kubectl_api.apply(resource, dry_run=dry_run)
+            except kubectl_api.NotSupported:
+                _apply_subprocess(cmd, args, resource)
+        else:
+            _apply_subprocess(cmd, args, resource)
     except:
         logging.exception('Failed to apply resource\n%s', yaml.dump(resource, default_flow_style=False))
         raise
     if dry_run:
         print(yaml.dump(resource, default_flow_style=False))
+    else:
+        _invalidate_cache(resource, result=result)
+    # the applied resource is returned only by the API backend
+    return result
+
+
+def _apply_subprocess(cmd, args, resource):
+    logs.subprocess_run(
+        f'kubectl {cmd} {args} -f -',
+        input=yaml.dump(resource, Dumper=yaml_config.Dumper).encode()
+    )
+
+
+def apply_many(resources, dry_run=False, diff=False, required=True):
+    """Apply a list of resources together
+
+    With the api backend resources are applied using concurrent server-side apply requests,
+    otherwise all resources are applied by a single kubectl process, if it fails each resource is applied separately
+    to find which resources failed.
+
+    Returns a list of results, one per resource: {kind, name, namespace, error, diff}
+    error is None for resources which were applied successfully
+    if diff is True nothing is applied and diff contains the changes which would be made to each resource
+    if required is True an ApplyManyError is raised after all resources were handled if any resource failed
+    """
+    results = [
+        {
+            'kind': resource['kind'],
+            'name': resource['metadata']['name'],
+            'namespace': resource['metadata'].get('namespace'),
+            'error': None,
+            'diff': None,
+        } for resource in resources
+    ]
+    if diff:
+        _run_many(_diff_one, resources, results)
+    elif _use_api_backend():
+        _run_many(lambda resource: kubectl_api.apply(resource, dry_run=dry_run), resources, results)
+    elif resources:
+        try:
+            logs.subprocess_run(
+                f'kubectl apply {"--dry-run" if dry_run else ""} -f -',
+                input=yaml.dump({'apiVersion': 'v1', 'kind': 'List', 'items': resources}, Dumper=yaml_config.Dumper).encode()
+            )
+        except subprocess.CalledProcessError:
+            logs.warning('Failed to apply resources together, applying each resource separately')
+            _run_many(
+                lambda resource: _apply_subprocess('apply', '--dry-run' if dry_run else '', resource),
+                resources, results
+            )
+    for resource in resources:
+        if not dry_run and not diff:
+            _invalidate_cache(resource)
+    if dry_run:
+        print(yaml.dump_all(resources, default_flow_style=False))
+    if required and any(result['error'] for result in results):
+        raise ApplyManyError(results)
+    return results
+
+
+def _run_many(func, resources, results):
+    with concurrent.futures.ThreadPoolExecutor(max_workers=APPLY_MANY_CONCURRENCY) as executor:
+        futures = {executor.submit(func, resource): result for resource, result in zip(resources, results)}
+        for future in concurrent.futures.as_completed(futures):
+            result = futures[future]
+            try:
+                res = future.result()
+                if isinstance(res, str):
+                    result['diff'] = res
+            except subprocess.CalledProcessError as e:
+                result['error'] = (e.stderr or b'').decode().strip() or str(e)
+            except Exception as e:
+                result['error'] = str(e) or type(e).__name__
+
+
+def _diff_one(resource):
+    if _use_api_backend():
+        try:
+            current = kubectl_api.request('GET', kubectl_api.get_resource_path(
+                kubectl_api.get_resource_info(resource['kind'], api_version=resource.get('apiVersion')),
+                resource['metadata'].get('namespace') or kubectl_api.get_default_namespace(),
+                resource['metadata']['name']
+            ))
+        except kubectl_api.ApiError as e:
+            if e.status != 404:
+                raise
+            current = {}
+        updated = kubectl_api.apply(resource, dry_run=True)
+        return ''.join(difflib.unified_diff(
+            _get_diff_yaml(current).splitlines(keepends=True), _get_diff_yaml(updated).splitlines(keepends=True),
+            fromfile=f'{resource["kind"]}/{resource["metadata"]["name"]} (live)',
+            tofile=f'{resource["kind"]}/{resource["metadata"]["name"]} (merged)'
+        ))
+    else:
+        res = subprocess.run(['kubectl', 'diff', '-f', '-'], input=yaml.dump(resource, Dumper=yaml_config.Dumper).encode(),
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        # kubectl diff exits with 1 if there are differences, greater than 1 on errors
+        if res.returncode > 1:
+            raise Exception(res.stderr.decode().strip())
+        return res.stdout.decode()
+
+
+def _get_diff_yaml(resource):
+    if not resource:
+        return ''
+    resource = dict(resource, metadata={
+        k: v for k, v in resource.get('metadata', {}).items()
+        if k not in ('managedFields', 'resourceVersion', 'generation', 'uid', 'creationTimestamp', 'selfLink')
+    })
+    resource.pop('status', None)
+    return yaml.safe_dump(resource, default_flow_style=False)
 
 
 def install_crd(plural, singular, kind):
@@ -255,7 +506,7 @@ def install_crd(plural, singular, kind):
                        'kind': kind
                    }
                }}
-        logs.subprocess_run('kubectl create -f -', input=yaml.dump(crd).encode())
+        logs.subprocess_run('kubectl create -f -', input=yaml.dump(crd, Dumper=yaml_config.Dumper).encode())
 
 
 def get_resource(api_version, kind, name, labels, namespace='ckan-cloud', **kwargs):
@@ -316,11 +567,70 @@ def add_operator_timestamp_annotation(metadata):
     metadata.setdefault('annotations', {})['ckan-cloud/operator-timestamp'] = now()
 
 
+def patch_annotations(resource_kind, resource_name, annotations, namespace='ckan-cloud', resource_version=None,
+                      max_conflict_retries=3):
+    """Set the given annotations using a single merge patch, returns the patched resource
+
+    If resource_version is given the patch fails with a conflict if the resource was modified since,
+    in that case the latest resource version is fetched and the patch is retried,
+    annotation values are absolute so retrying is safe.
+    """
+    for retry in range(max_conflict_retries + 1):
+        patch = {'metadata': {'annotations': annotations}}
+        if resource_version:
+            patch['metadata']['resourceVersion'] = resource_version
+        try:
+            return _merge_patch(resource_kind, resource_name, patch, namespace)
+        except (kubectl_api.ApiError, subprocess.CalledProcessError) as e:
+            if retry < max_conflict_retries and resource_version and is_conflict(e):
+                logs.debug(f'conflict patching {resource_kind} {resource_name} annotations, retrying')
+                resource_version = get(f'{resource_kind} {resource_name}', namespace=namespace)['metadata']['resourceVersion']
+            else:
+                raise
+
+
+def _merge_patch(resource_kind, resource_name, patch, namespace):
+    result = None
+    try:
+        if _use_api_backend():
+            try:
+                result = kubectl_api.merge_patch(resource_kind, resource_name, patch, namespace=namespace)
+                return result
+            except kubectl_api.NotSupported:
+                pass
+        result = kubectl_api.loads(logs.subprocess_check_output([
+            'kubectl', '-n', namespace, 'patch', resource_kind, resource_name,
+            '--type=merge', '-p', json.dumps(patch), '-o', 'json'
+        ]))
+        return result
+    finally:
+        kubectl_cache.invalidate(resource_kind, namespace, name=resource_name,
+                                 resource_version=(result or {}).get('metadata', {}).get('resourceVersion'))
+
+
+def is_conflict(e):
+    """Returns True if the kubectl / API error is a conflict with a modified resource version"""
+    if isinstance(e, kubectl_api.ApiError):
+        return e.status == 409
+    else:
+        return b'the object has been modified' in (e.stderr or b'') or b'Conflict' in (e.stderr or b'')
+
+
 def remove_finalizers(resource_kind, resource_name, ignore_not_found=False):
     if ignore_not_found and not get(f'{resource_kind} {resource_name}', required=False):
         return True
-    else:
-        return call(f'patch {resource_kind} {resource_name} -p \'{{"metadata":{{"finalizers":[]}}}}\' --type=merge') == 0
+    if _use_api_backend():
+        try:
+            kubectl_api.merge_patch(resource_kind, resource_name, {'metadata': {'finalizers': []}})
+            return True
+        except kubectl_api.NotSupported:
+            pass
+        except kubectl_api.ApiError:
+            logs.warning(traceback.format_exc())
+            return False
+        finally:
+            kubectl_cache.invalidate(resource_kind, name=resource_name)
+    return call(f'patch {resource_kind} {resource_name} -p \'{{"metadata":{{"finalizers":[]}}}}\' --type=merge') == 0
 
 
 def remove_resource_and_dependencies(resource_kind, resource_name, related_kinds, label_selector):
@@ -335,7 +645,39 @@ def remove_resource_and_dependencies(resource_kind, resource_name, related_kinds
 __NONE__ = object
 
 
-class BaseAnnotations(object):
+class BatchAnnotationsMixin(object):
+    """Batching of annotation changes, subclasses implement _patch_annotations(annotations)"""
+
+    @contextlib.contextmanager
+    def batch(self):
+        """Collect all annotation, status and flag changes made in the block and save them using a single patch
+
+        Changes are visible to get_status / get_flag immediately, they are saved when the block exits, also on errors
+        """
+        self._batch_depth = getattr(self, '_batch_depth', 0) + 1
+        if self._batch_depth == 1:
+            self._batch_annotations = {}
+        try:
+            yield self
+        finally:
+            self._batch_depth -= 1
+            if self._batch_depth == 0:
+                annotations, self._batch_annotations = self._batch_annotations, None
+                if annotations:
+                    self._patch_annotations(annotations)
+
+    def _save_annotations(self, annotations):
+        """Patch the annotations, or add them to the current batch"""
+        if getattr(self, '_batch_annotations', None) is not None:
+            self._batch_annotations.update(**annotations)
+        else:
+            self._patch_annotations(annotations)
+
+    def _patch_annotations(self, annotations):
+        raise NotImplementedError()
+
+
+class BaseAnnotations(BatchAnnotationsMixin):
     """Base class for managing annotations related to a custom resource"""
 
     @property
@@ -467,7 +809,10 @@ class BaseAnnotations(object):
             'type': 'Opaque',
             'data': secret['data']
         }
-        logs.subprocess_run(f'kubectl apply -f -', input=yaml.dump(secret).encode())
+        try:
+            logs.subprocess_run(f'kubectl apply -f -', input=yaml.dump(secret, Dumper=yaml_config.Dumper).encode())
+        finally:
+            _invalidate_cache(secret)
         self._secret = secret
 
     def set_secret(self, key, value):
@@ -499,27 +844,118 @@ class BaseAnnotations(object):
         }
 
     def json_annotate(self, key, value, overwrite=True):
-        ans = []
         assert any([key.startswith(prefix) for prefix in self.JSON_ANNOTATION_PREFIXES]), f'invalid json annotation key: {key}'
-        value = json.dumps(value)
-        ans.append(f"{key}='{value}'")
-        self._annotate(*ans, overwrite=overwrite)
+        self._annotate_values({key: json.dumps(value)}, overwrite=overwrite)
 
     def get_json_annotation(self, key):
         return json.loads(self._get_annotation(key))
 
     def _annotate(self, *annotations, overwrite=False):
-        cmd = f'kubectl -n ckan-cloud annotate {self.resource_kind} {self.resource_id}'
-        for annotation in annotations:
-            cmd += f' ckan-cloud/{annotation}'
-        if overwrite:
-            cmd += ' --overwrite'
-        logs.subprocess_check_call(cmd, shell=True)
+        self._annotate_values(dict(parse_annotation(annotation) for annotation in annotations), overwrite=overwrite)
+
+    def _annotate_values(self, annotations, overwrite=False):
+        annotations = {f'ckan-cloud/{k}': v for k, v in annotations.items()}
+        current_annotations = (self.resource_values or {}).get('metadata', {}).get('annotations') or {}
+        if not overwrite:
+            for k, v in annotations.items():
+                assert current_annotations.get(k, v) == v, f'annotation {k} already has a value and overwrite is false'
+        if self.resource_values:
+            self.resource_values['metadata'].setdefault('annotations', {}).update(**annotations)
+        self._save_annotations(annotations)
+
+    def _patch_annotations(self, annotations):
+        resource_version = (self.resource_values or {}).get('metadata', {}).get('resourceVersion')
+        resource = patch_annotations(self.resource_kind, self.resource_id, annotations, resource_version=resource_version)
+        if self.resource_values and resource:
+            self.resource_values['metadata']['resourceVersion'] = resource['metadata']['resourceVersion']
 
     def _get_annotation(self, annotation, default=None):
         return self.resource_values['metadata'].get('annotations', {}).get(f'ckan-cloud/{annotation}', default)
 
 
+def parse_annotation(annotation):
+    """Parses a kubectl annotate argument (key=value) to a (key, value) tuple"""
+    key, value = annotation.split('=', 1)
+    if len(value) > 1 and value[0] == value[-1] == "'":
+        value = value[1:-1]
+    return key, value
+
+
+def _invalidate_cache(resource, namespace='ckan-cloud', result=None):
+    """Invalidate the cache after the resource was modified, result is the modified resource returned by the API"""
+    kubectl_cache.invalidate(resource['kind'], resource['metadata'].get('namespace') or namespace,
+                             name=resource['metadata'].get('name'),
+                             resource_version=((result or {}).get('metadata') or {}).get('resourceVersion'))
+
+
+def _invalidate_cache_cmd(cmd, namespace):
+    """Drop cached snapshots after kubectl commands which may modify resources (delete, annotate, patch..)"""
+    args = cmd.split() if isinstance(cmd, str) else list(cmd)
+    if args and args[0] in MUTATING_COMMANDS:
+        all_namespaces = '--all-namespaces' in args or '-A' in args
+        kubectl_cache.invalidate(namespace=None if all_namespaces else namespace)
+
+
+def _use_api_backend():
+    return KUBECTL_BACKEND == 'api'
+
+
+def _wait_for_watch(kind, name, condition, deadline, namespace, on_progress):
+    field_selector = f'metadata.name={name}'
+    resource_version = None
+    while time.time() < deadline:
+        try:
+            if not resource_version:
+                res = kubectl_api.list_items(kind, namespace=namespace, field_selector=field_selector)
+                resource_version = res.get('metadata', {}).get('resourceVersion')
+                result = _check_wait_condition(condition, res['items'][0] if res['items'] else None, on_progress)
+                if result:
+                    return result
+            timeout_seconds = max(1, int(deadline - time.time()))
+            for event in kubectl_api.watch(kind, namespace=namespace, field_selector=field_selector,
+                                           resource_version=resource_version, timeout_seconds=timeout_seconds):
+                if event['type'] == 'ERROR':
+                    # usually 410 Gone - the resource version is too old, relist
+                    resource_version = None
+                    break
+                resource_version = event['object'].get('metadata', {}).get('resourceVersion', resource_version)
+                if event['type'] == 'BOOKMARK':
+                    continue
+                resource = None if event['type'] == 'DELETED' else event['object']
+                result = _check_wait_condition(condition, resource, on_progress)
+                if result:
+                    return result
+        except kubectl_api.ApiError as e:
+            if e.status == 410:
+                resource_version = None
+            else:
+                raise
+    return None
+
+
+def _wait_for_poll(kind, name, condition, deadline, namespace, on_progress):
+    poll_seconds = 1
+    resource_version = None
+    while True:
+        resource = get(f'{kind} {name}', namespace=namespace, required=False)
+        if not resource or resource.get('metadata', {}).get('resourceVersion') != resource_version:
+            result = _check_wait_condition(condition, resource, on_progress)
+            if result:
+                return result
+            resource_version = (resource or {}).get('metadata', {}).get('resourceVersion')
+        remaining_seconds = deadline - time.time()
+        if remaining_seconds <= 0:
+            return None
+        time.sleep(min(poll_seconds, remaining_seconds))
+        poll_seconds = min(poll_seconds * 2, WAIT_POLL_MAX_SECONDS)
+
+
+def _check_wait_condition(condition, resource, on_progress):
+    if on_progress:
+        on_progress(resource)
+    return condition(resource)
+
+
 def _parse_call_cmd(cmd, namespace, use_first_pod):
     args = []
     for arg in cmd.split(' '):
@@ -24,7 +24,9 @@ def debug(*args, **kwargs):
 
 
 def debug_verbose(*args, **kwargs):
-    log(DEBUG_VERBOSE, yaml.dump([args, kwargs], default_flow_style=False))
+    # the args are dumped only if verbose logs are enabled, the dump is slow for large objects (e.g. all routes)
+    if not _skip_log_level(DEBUG_VERBOSE):
+        log(DEBUG_VERBOSE, yaml.dump([args, kwargs], default_flow_style=False))
 
 
 def warning(*args, **kwargs):
@@ -113,7 +115,8 @@ def yaml_dump(data, *args, **kwargs):
     return yaml.dump(data, *args, Dumper=YamlSafeDumper, default_flow_style=False, **kwargs)
 
 
-class YamlSafeDumper(yaml.SafeDumper):
+# use the libyaml C emitter if ruamel.yaml.clib is installed
+class YamlSafeDumper(getattr(yaml, 'CSafeDumper', yaml.SafeDumper)):
 
     def ignore_aliases(self, data):
         return True
@@ -1,6 +1,8 @@
 import binascii
+import concurrent.futures
 import os
 import datetime
+import threading
 import traceback
 import time
 
@@ -31,6 +33,16 @@ from .constants import (
 )
 
 
+# max number of concurrent db imports to the same db instance (db prefix)
+IMPORT_CONCURRENCY_PER_DB_PREFIX = int(os.environ.get('CKAN_CLOUD_OPERATOR_MIGRATION_IMPORT_CONCURRENCY_PER_DB_PREFIX', '2'))
+
+# seconds between import progress events
+IMPORT_PROGRESS_SECONDS = int(os.environ.get('CKAN_CLOUD_OPERATOR_MIGRATION_IMPORT_PROGRESS_SECONDS', '60'))
+
+__IMPORT_SEMAPHORES = {}
+__IMPORT_SEMAPHORES_LOCK = threading.Lock()
+
+
 def initialize(log_kwargs=None, interactive=False):
     log_kwargs = log_kwargs or {}
     logs.info(f'Installing crds', **log_kwargs)
@@ -363,8 +375,7 @@ def _get_or_create_datastore_readonly_user_name(migration_name, datastore_name):
 
 def _initialize_postgis_extensions(db_name, db_prefix):
     logs.info('initializing postgis extensions for main db')
-    connection_string = db_manager.get_external_admin_connection_string(db_name, db_prefix=db_prefix)
-    with postgres_driver.connect(connection_string) as conn:
+    with db_manager.admin_connect(db_name, db_prefix=db_prefix) as conn:
         postgres_driver.initialize_extensions(conn, [
             'postgis', 'postgis_topology', 'fuzzystrmatch', 'postgis_tiger_geocoder'
         ])
@@ -378,9 +389,16 @@ def _initialize_postgis_extensions(db_name, db_prefix):
 
 def _update_db_proxy(db_name, datastore_name, datastore_ro_name, db_password, datastore_password, datastore_ro_password, db_prefix):
     logs.info('Updating db proxy')
-    db_proxy_manager.update(wait_updated=False)
+    db_host, db_port = db_manager.get_internal_unproxied_db_host_port()
+    # waits until the db proxy serves the new dbs, instead of sleeping until the secret is updated in the volume
+    db_proxy_manager.update(wait_updated=True, dbs_users=(
+        [(name, db_host, db_port) for name in [db_name, datastore_name] if name],
+        [(user, password) for user, password in [(db_name, db_password),
+                                                 (datastore_name, datastore_password),
+                                                 (datastore_ro_name, datastore_ro_password)] if user and password]
+    ))
     ok = False
-    for i in range(5):
+    for retry_seconds in [1, 2, 4, 8, 16, 0]:
         try:
             for user, password, db in [(db_name, db_password, db_name),
                                        (datastore_name, datastore_password, datastore_name),
@@ -393,11 +411,10 @@ def _update_db_proxy(db_name, datastore_name, datastore_ro_name, db_password, da
             break
         except Exception as e:
             logs.warning(str(e))
-        logs.info(f'Waiting for connection to db proxy...')
-        # 40 seconds on first iteration - to ensure secret is updated in pgbouncer volume
-        time.sleep(40 if i == 0 else 1)
-        db_proxy_manager.reload()
-        time.sleep(10 if i == 2 else 5)
+        if retry_seconds:
+            logs.info(f'Waiting {retry_seconds} seconds for connection to db proxy...')
+            time.sleep(retry_seconds)
+            db_proxy_manager.reload(db_names=[name for name in [db_name, datastore_name] if name])
     assert ok, 'failed to get connection to db proxy'
     yield {'step': 'update-db-proxy',
            'msg': f'Updated DB Proxy with the new dbs and roles: {db_name}, {datastore_name}, {datastore_ro_name} ({db_prefix})'}
@@ -405,8 +422,7 @@ def _update_db_proxy(db_name, datastore_name, datastore_ro_name, db_password, da
 
 def _create_base_dbs_and_roles(migration_name, db_name, datastore_name, recreate_dbs, datastore_ro_name, db_prefix=None):
     logs.info('Creating base DBS')
-    admin_connection_string = db_manager.get_external_admin_connection_string(db_prefix=db_prefix)
-    with postgres_driver.connect(admin_connection_string) as admin_conn:
+    with db_manager.admin_connect(db_prefix=db_prefix, autocommit=True) as admin_conn:
         if recreate_dbs:
             _delete_dbs(admin_conn, db_name, datastore_name, datastore_ro_name)
         if not datastore_name:
@@ -421,21 +437,20 @@ def _create_base_dbs_and_roles(migration_name, db_name, datastore_name, recreate
         )
         yield {'step': 'get-create-passwords', 'msg': 'Created Passwords'}
         admin_user = db_manager.get_admin_db_user(db_prefix=db_prefix)
-        if db_name:
-            db_errors = postgres_driver.create_base_db(admin_conn, db_name, db_password, grant_to_user=admin_user)
-        else:
-            db_errors = []
-        if datastore_name:
-            datastore_errors = postgres_driver.create_base_db(admin_conn, datastore_name, datastore_password,
-                                                              grant_to_user=admin_user)
-        else:
-            datastore_errors = []
+        # the roles and grants are created in a single round trip, the dbs one by one (not allowed in a transaction)
+        errors = postgres_driver.create_base_dbs_and_roles(
+            admin_conn,
+            {name: password for name, password in [(db_name, db_password), (datastore_name, datastore_password)] if name},
+            {datastore_ro_name: datastore_ro_password} if datastore_name else None,
+            grant_to_user=admin_user
+        )
+        db_errors = errors.get(db_name, [])
+        datastore_errors = errors.get(datastore_name, [])
         if datastore_name and db_name:
             assert (len(datastore_errors) == 0 and len(db_errors) == 0) or len(password_errors) == 3, \
                 'some passwords were not created, but DB / roles need to be created, we cannot know the right passwords'
         yield {'step': 'create-base-dbs', 'msg': f'Created Base DB and roles: {db_name}, {datastore_name} ({db_prefix})'}
         if datastore_name:
-            postgres_driver.create_role_if_not_exists(admin_conn, datastore_ro_name, datastore_ro_password)
             yield {'step': 'created-datastore-ro-role', 'msg': f'Created Datastore read-only user: {datastore_ro_name} ({db_prefix})'}
     yield {'step': 'created-base-dbs-and-roles', f'msg': f'Created base dbs and roles: {db_name}, {datastore_name}, {datastore_ro_name} ({db_prefix})'}
     yield from _update_db_proxy(db_name, datastore_name, datastore_ro_name, db_password, datastore_password, datastore_ro_password, db_prefix)
@@ -459,18 +474,57 @@ def _import_data(old_site_id, db_name, datastore_name, skip_datastore_import=Fal
     else:
         db_url, datastore_url = get_db_import_urls(old_site_id)
     assert db_url and (datastore_url or skip_datastore_import), f'failed to find db import urls for old site id {old_site_id}'
-    _gcloudsql().import_db(db_url, db_name, import_user=import_user or db_name, db_prefix=db_prefix)
-    yield {'step': 'import-db-data', 'msg': f'Imported DB: {db_name}'}
+    imports = [('import-db-data', 'DB', db_url, db_name)]
+    if not skip_datastore_import:
+        imports.append(('import-datastore-data', 'Datastore', datastore_url, datastore_name))
+    yield from _run_imports(imports, import_user, db_prefix)
     if skip_datastore_import:
         yield {'step': 'import-datastore-data', 'msg': 'skipped'}
-    else:
-        _gcloudsql().import_db(datastore_url, datastore_name, import_user=import_user or datastore_name, db_prefix=db_prefix)
-        yield {'step': 'import-datastore-data', 'msg': f'Imported Datastore: {datastore_name}'}
 
 
-def _gcloud():
-    return providers_manager.get_provider(cluster_provider_submodule)
+def _run_imports(imports, import_user, db_prefix):
+    """Run independent imports concurrently, limited per db prefix, yields events as the imports progress
+
+    imports is a list of (step, label, import url, db name)
+    """
+    semaphore = _get_import_semaphore(db_prefix)
+    start_times = {}
+
+    def _import(step, import_url, target_db_name):
+        with semaphore:
+            start_times[step] = time.time()
+            db_manager.import_db(import_url, target_db_name, import_user or target_db_name, db_prefix=db_prefix)
+            return time.time() - start_times[step]
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(imports)) as executor:
+        futures = {
+            executor.submit(_import, step, import_url, target_db_name): (step, label, target_db_name)
+            for step, label, import_url, target_db_name in imports
+        }
+        yield {'step': 'import-data-started',
+               'msg': f'Importing: {", ".join(name for _, _, _, name in imports)} ({db_prefix})'}
+        pending = set(futures)
+        while pending:
+            done, pending = concurrent.futures.wait(pending, timeout=IMPORT_PROGRESS_SECONDS,
+                                                    return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                step, label, target_db_name = futures[future]
+                seconds = future.result()
+                yield {'step': step, 'msg': f'Imported {label}: {target_db_name} ({round(seconds)} seconds)'}
+            if pending and not done:
+                # no import finished in IMPORT_PROGRESS_SECONDS
+                now = time.time()
+                yield {'step': 'import-data-progress', 'msg': 'Importing: ' + ', '.join(
+                    f'{target_db_name} ({round(now - start_times[step])} seconds)' if step in start_times
+                    else f'{target_db_name} (waiting for other imports to {db_prefix})'
+                    for step, label, target_db_name in sorted(futures[future] for future in pending)
+                )}
+
+
+def _get_import_semaphore(db_prefix):
+    with __IMPORT_SEMAPHORES_LOCK:
+        return __IMPORT_SEMAPHORES.setdefault(db_prefix or '', threading.BoundedSemaphore(IMPORT_CONCURRENCY_PER_DB_PREFIX))
 
 
-def _gcloudsql():
-    return db_manager.get_provider()
+def _gcloud():
+    return providers_manager.get_provider(cluster_provider_submodule)
@@ -0,0 +1,109 @@
+"""Registry of the databases and users of all the ckan instances and db migrations, used by the db proxy (PgBouncer)
+
+Reading the passwords one secret at a time takes a few kubectl calls per instance / migration, the registry
+is built from a constant number of list calls - the instances, the migrations and a single list of all the
+opaque secrets - and the entries are indexed by name, so a single migration can be updated incrementally.
+"""
+from ckan_cloud_operator import kubectl
+from ckan_cloud_operator.crds import manager as crds_manager
+
+from .constants import MIGRATION_CRD_SINGULAR
+
+
+class DbsUsersRegistry(object):
+
+    def __init__(self):
+        self.dbs = {}
+        self.users = {}
+
+    def add(self, dbs, users, overwrite=True):
+        """Add lists of (db name, db host, db port) and (user name, password), entries with missing values are skipped"""
+        for db in dbs:
+            if all(db) and (overwrite or db[0] not in self.dbs):
+                self.dbs[db[0]] = tuple(db)
+        for user in users:
+            if all(user) and (overwrite or user[0] not in self.users):
+                self.users[user[0]] = tuple(user)
+
+    def get_dbs_users(self):
+        return list(self.dbs.values()), list(self.users.values())
+
+
+def build():
+    """Build the registry of all the instances and migrations"""
+    from ckan_cloud_operator.providers.ckan import manager as ckan_manager
+    from ckan_cloud_operator.providers.db import manager as db_manager
+    from ckan_cloud_operator.providers.cluster import manager as cluster_manager
+    db_host, db_port = db_manager.get_internal_unproxied_db_host_port()
+    operator_namespace = cluster_manager.get_operator_namespace_name()
+    instances = (kubectl.get(ckan_manager.instance_kind(), required=False) or {}).get('items', [])
+    migrations = (crds_manager.get(MIGRATION_CRD_SINGULAR, required=False) or {}).get('items', [])
+    secrets = {
+        (secret['metadata']['namespace'], secret['metadata']['name']): secret
+        for secret in (kubectl.get('secrets', '--all-namespaces', '--field-selector', 'type=Opaque',
+                                   required=False) or {}).get('items', [])
+    }
+    registry = DbsUsersRegistry()
+    for instance in instances:
+        instance_id = instance['metadata']['name']
+        secret = kubectl.decode_secret(secrets.get((instance_id, f'{instance_id}-annotations')))
+        registry.add(*get_instance_dbs_users(instance, secret, db_host, db_port))
+    # migrations of existing instances have the same values, instance values take precedence
+    for migration in migrations:
+        secret_name = crds_manager.get_resource_name(MIGRATION_CRD_SINGULAR, migration['spec']['name'])
+        secret = kubectl.decode_secret(secrets.get((operator_namespace, secret_name)))
+        registry.add(*get_migration_dbs_users(migration['spec'], secret, db_host, db_port), overwrite=False)
+    return registry
+
+
+def get_all_dbs_users():
+    return build().get_dbs_users()
+
+
+def get_instance_dbs_users(instance, secret, db_host, db_port):
+    """Returns (dbs, users) of a deis instance from its annotations secret values"""
+    db_name = instance['spec'].get('db', {}).get('name')
+    datastore_name = instance['spec'].get('datastore', {}).get('name')
+    db_password = secret.get('databasePassword')
+    datastore_password = secret.get('datastorePassword')
+    datastore_ro_user = secret.get('datastoreReadonlyUser')
+    datastore_ro_password = secret.get('datatastoreReadonlyPassword')
+    if all([db_name, db_password, datastore_name, datastore_password, datastore_ro_user, datastore_ro_password]):
+        return (
+            [(db_name, db_host, db_port), (datastore_name, db_host, db_port)],
+            [(db_name, db_password), (datastore_name, datastore_password), (datastore_ro_user, datastore_ro_password)]
+        )
+    else:
+        return [], []
+
+
+def get_migration_dbs_users(spec, secret, db_host, db_port):
+    """Returns (dbs, users) of a db migration from its secret values"""
+    migration_type = spec.get('type')
+    db_name = spec.get('db-name')
+    datastore_name = spec.get('datastore-name')
+    datastore_ro_name = secret.get('datastore-readonly-user-name')
+    db_password = secret.get('database-password')
+    datastore_password = secret.get('datastore-password')
+    datastore_ro_password = secret.get('datastore-readonly-password')
+    if migration_type == 'deis-ckan':
+        required_values = [db_password, datastore_password, datastore_ro_password, db_name, datastore_name,
+                           datastore_ro_name]
+    elif migration_type == 'new-db':
+        datastore_name = None
+        required_values = [db_password]
+    elif migration_type == 'new-datastore':
+        db_name = None
+        required_values = [datastore_password, datastore_ro_password]
+    else:
+        required_values = [None]
+    if not all(required_values):
+        return [], []
+    return (
+        [(name, db_host, db_port) for name in [db_name, datastore_name] if name],
+        [
+            (name, password) for name, password
+            in [(db_name, db_password), (datastore_name, datastore_password), (datastore_ro_name, datastore_ro_password)]
+            if name and password
+        ]
+    )
@@ -120,7 +120,7 @@ def delete(instance_id, instance):
     assert len(errors) == 0, ', '.join(errors)
 
 
-def get(instance_id, instance=None):
+def get(instance_id, instance=None, with_logs=True):
     image = None
     latest_operator_timestamp, latest_pod_name, latest_pod_status = None, None, None
     item_app_statuses = {}
@@ -132,6 +132,12 @@ def get(instance_id, instance=None):
     num_resource_items = len(all_resources.get('items'))
     logs.debug(num_resource_items=num_resource_items)
     if num_resource_items > 0:
+        pods_logs = kubectl.get_pods_logs(
+            [(item['metadata']['name'], container)
+             for item in all_resources['items'] if _is_ckan_pod(item)
+             for container in ["secrets", "ckan"]],
+            namespace=instance_id
+        ) if with_logs else {}
         for item in all_resources['items']:
             item_kind = item['kind']
             try:
@@ -163,10 +169,8 @@ def get(instance_id, instance=None):
                     if not latest_operator_timestamp or latest_operator_timestamp < pod_operator_timestamp:
                         latest_operator_timestamp = pod_operator_timestamp
                         latest_pod_name = pod['metadata']['name']
-                    for container in ["secrets", "ckan"]:
-                        status_code, output = subprocess.getstatusoutput(
-                            f'kubectl -n {instance_id} logs {pod["metadata"]["name"]} -c {container}',
-                        )
+                    for container in (["secrets", "ckan"] if with_logs else []):
+                        status_code, output = pods_logs[(pod["metadata"]["name"], container)]
                         container_logs = output if status_code == 0 else None
                         logs.debug(len_container_logs=len(container_logs) if container_logs else 0)
                         if container == 'ckan':
@@ -184,7 +188,10 @@ def get(instance_id, instance=None):
                     ckan_deployment_status_pods.append(pod_status)
                     if latest_pod_name == pod_status['name']:
                         latest_pod_status = pod_status
-        if not latest_pod_status or len(latest_pod_status.get('errors', [])) > 0 or latest_pod_status['logs'] is None:
+        if (
+            not latest_pod_status or len(latest_pod_status.get('errors', [])) > 0
+            or (with_logs and latest_pod_status['logs'] is None)
+        ):
             ckan_deployment_ready = False
     else:
         ckan_deployment_ready = False
@@ -205,6 +212,43 @@ def get(instance_id, instance=None):
     }
 
 
+def get_all_statuses():
+    """Get the readiness of all instance deployments using cluster-wide queries instead of per-instance queries
+
+    Returns a dict of instance_id -> status, with the same ready / image / latest_pod_name / latest_operator_timestamp
+    values as get(instance_id, with_logs=False)
+    """
+    logs.debug('Getting all ckan deployments and pods')
+    deployments = kubectl.get('deployments --all-namespaces --field-selector metadata.name=ckan', required=False)
+    pods = kubectl.get('pods --all-namespaces -l app=ckan', required=False)
+    namespace_pods = {}
+    for pod in (pods or {}).get('items', []):
+        namespace_pods.setdefault(pod['metadata']['namespace'], []).append(pod)
+    statuses = {}
+    for deployment in (deployments or {}).get('items', []):
+        instance_id = deployment['metadata']['namespace']
+        ckan_deployment_status = kubectl.get_item_detailed_status(deployment)
+        ready = len(ckan_deployment_status.get('error', [])) == 0
+        image, latest_operator_timestamp, latest_pod = None, None, None
+        for pod in namespace_pods.get(instance_id, []):
+            pod_operator_timestamp = pod['metadata']['creationTimestamp']
+            if not latest_operator_timestamp or latest_operator_timestamp < pod_operator_timestamp:
+                latest_operator_timestamp = pod_operator_timestamp
+                latest_pod = pod
+            if image and image != pod["spec"]["containers"][0]["image"]:
+                ready = False
+            image = pod["spec"]["containers"][0]["image"]
+        if not latest_pod or len(kubectl.get_item_detailed_status(latest_pod).get('errors', [])) > 0:
+            ready = False
+        statuses[instance_id] = {
+            'ready': ready,
+            'image': image,
+            'latest_pod_name': latest_pod['metadata']['name'] if latest_pod else None,
+            'latest_operator_timestamp': latest_operator_timestamp,
+        }
+    return statuses
+
+
 def get_backend_url(instance_id, instance):
     return f'http://nginx.{instance_id}:8080'
 
@@ -470,3 +514,7 @@ def _scale_down_scale_up(deployment='ckan', namespace=None, replicas=1):
     kubectl.call(f'scale deployment {deployment} --replicas=0', namespace=namespace)
     kubectl.call(f'scale deployment {deployment} --replicas={replicas}', namespace=namespace)
     time.sleep(20)
+
+
+def _is_ckan_pod(item):
+    return item['kind'] == 'Pod' and (item['metadata'].get('labels') or {}).get('app') == 'ckan'
@@ -15,8 +15,12 @@ def delete(instance_id, instance_type, instance):
     return _get_deployment_provider(instance_type).delete(instance_id, instance)
 
 
-def get(instance_id, instance_type, instance):
-    return _get_deployment_provider(instance_type).get(instance_id, instance)
+def get(instance_id, instance_type, instance, with_logs=True):
+    return _get_deployment_provider(instance_type).get(instance_id, instance, with_logs=with_logs)
+
+
+def get_all_statuses(instance_type):
+    return _get_deployment_provider(instance_type).get_all_statuses()
 
 
 def get_backend_url(instance_id, instance_type, instance):
@@ -76,14 +76,16 @@ def update(instance_id_or_name, override_spec_json, persist_overrides, wait_read
 @click.argument('INSTANCE_ID_OR_NAME')
 @click.argument('ATTR', required=False)
 @click.option('--with-spec', is_flag=True)
-def get(instance_id_or_name, attr, with_spec):
+@click.option('--no-logs', is_flag=True, help='skip getting the pods logs, faster when only the status is needed')
+def get(instance_id_or_name, attr, with_spec, no_logs):
     """Get detailed information about an instance, optionally returning only a single get attribute
 
     Example: ckan-cloud-operator ckan instance get <INSTANCE_ID_OR_NAME> deployment
     """
     if attr == 'spec':
         with_spec = True
-    logs.print_yaml_dump(manager.get(instance_id_or_name, attr, with_spec=with_spec), exit_success=True)
+    logs.print_yaml_dump(manager.get(instance_id_or_name, attr, with_spec=with_spec, with_logs=not no_logs),
+                         exit_success=True)
 
 
 @instance.command()
@@ -98,12 +100,9 @@ def edit(instance_id_or_name):
 @click.option('-c', '--credentials', is_flag=True)
 @click.option('--name')
 def list_instances(full, quick, name, credentials):
-    instances = list(
-        manager.list_instances(full=full, quick=quick, 
-                               name=name, withCredentials=credentials)
-    )
     print('---')
-    logs.print_yaml_dump(instances)
+    for instance in manager.list_instances(full=full, quick=quick, name=name, withCredentials=credentials):
+        logs.print_yaml_dump([instance])
     logs.exit_great_success(quiet=True)
 
 
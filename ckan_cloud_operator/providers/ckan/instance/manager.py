@@ -218,15 +218,18 @@ def edit(instance_id_or_name):
     crds_manager.edit(INSTANCE_CRD_SINGULAR, name=instance_id)
 
 
-def get(instance_id_or_name, attr=None, exclude_attr=None, with_spec=False):
-    """Get detailed information about the instance and related components"""
+def get(instance_id_or_name, attr=None, exclude_attr=None, with_spec=False, with_logs=True):
+    """Get detailed information about the instance and related components
+
+    with_logs=False skips getting the pods logs, when only the readiness is needed
+    """
     instance_id, instance_type, instance = _get_instance_id_and_type(instance_id_or_name)
     if not exclude_attr:
         exclude_attr = []
     if not with_spec:
         exclude_attr.append('spec')
     gets = {
-        'deployment': lambda: deployment_manager.get(instance_id, instance_type, instance),
+        'deployment': lambda: deployment_manager.get(instance_id, instance_type, instance, with_logs=with_logs),
         'spec': lambda: instance['spec']
     }
     if exclude_attr:
@@ -267,11 +270,13 @@ def get_all_instances():
 
 
 def list_instances(full=False, quick=False, withCredentials=False, name=None):
+    """Yields the instances, the deployment statuses of all instances are fetched together on the first instance"""
     if quick:
         for instance in get_all_instance_id_names():
             if name is not None and instance['name'] != name: continue
             yield {**instance, 'ready': None}
     else:
+        deployment_statuses = {}
         for instance_data in get_all_instances():
             metadata_keys = ('name',)
             spec_keys = ('id', 'siteUrl', 'siteTitle', 'domain', 'registerSubdomain')
@@ -283,8 +288,11 @@ def list_instances(full=False, quick=False, withCredentials=False, name=None):
                 for k in metadata_keys:
                     instance_data[k] = metadata.get(k)
                 instance_type = instance_data['metadata']['labels'].get('{}/instance-type'.format(labels_manager.get_label_prefix()))
-                deployment = deployment_manager.get(instance_data['id'], instance_type, instance_data)
+                if instance_type not in deployment_statuses:
+                    deployment_statuses[instance_type] = deployment_manager.get_all_statuses(instance_type)
+                deployment = deployment_statuses[instance_type].get(instance_data['id']) or {'ready': False}
                 instance_data['ready'] = deployment.get('ready')
+                instance_data['image'] = deployment.get('image')
             except Exception as e:
                 pass
             if not full:
@@ -220,38 +220,8 @@ def instance_kind():
 
 
 def get_all_dbs_users():
-    from ckan_cloud_operator.deis_ckan.instance import DeisCkanInstance
-    from ckan_cloud_operator.providers.db import manager as db_manager
-    dbs, users = [], []
-    db_host, db_port = db_manager.get_internal_unproxied_db_host_port()
-    instance_db_names = []
-    instance_user_names = []
-    for item in DeisCkanInstance.list(quick=True, return_list=True):
-        instance_id = item['id']
-        instance = DeisCkanInstance(instance_id)
-        spec = instance.spec
-        db_name = spec.db['name']
-        db_password = instance.annotations.get_secret('databasePassword')
-        datastore_name = spec.datastore['name']
-        datastore_password = instance.annotations.get_secret('datastorePassword')
-        datastore_ro_user = instance.annotations.get_secret('datastoreReadonlyUser')
-        datastore_ro_password = instance.annotations.get_secret('datatastoreReadonlyPassword')
-        if all([db_name, db_password, datastore_name, datastore_password, datastore_ro_user, datastore_ro_password]):
-            dbs.append((db_name, db_host, db_port))
-            dbs.append((datastore_name, db_host, db_port))
-            instance_db_names += [db_name, datastore_name]
-            users.append((db_name, db_password))
-            users.append((datastore_name, datastore_password))
-            users.append((datastore_ro_user, datastore_ro_password))
-            instance_user_names += [db_name, datastore_name, datastore_ro_user]
-    migration_dbs, migration_users = ckan_db_migration_manager.get_all_dbs_users()
-    for migration_db in migration_dbs:
-        if migration_db[0] and migration_db[0] not in instance_db_names:
-            dbs.append(migration_db)
-    for migration_user in migration_users:
-        if migration_user[0] and migration_user[0] not in instance_user_names:
-            users.append(migration_user)
-    return dbs, users
+    from .db import registry as ckan_db_registry
+    return ckan_db_registry.get_all_dbs_users()
 
 
 def get_path_to_old_cluster_kubeconfig():
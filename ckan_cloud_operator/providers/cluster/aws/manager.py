@@ -232,3 +232,52 @@ def update_dns_record(sub_domain, root_domain, load_balancer_hostname):
         }
     )
     assert response['ResponseMetadata']['HTTPStatusCode'] == 200
+
+
+# max number of changes per Route53 ChangeBatch request (the API limit is 1000 changes / 32000 characters)
+ROUTE53_CHANGE_BATCH_SIZE = int(os.environ.get('CKAN_CLOUD_OPERATOR_ROUTE53_CHANGE_BATCH_SIZE', '500'))
+
+_dns_hosted_zone_ids = {}
+
+
+def update_dns_records(root_domain, records):
+    """Upsert multiple CNAME records in the root domain hosted zone, records is a dict of sub domain -> hostname
+
+    The hosted zone record sets are listed once and only changed records are upserted, in ChangeBatch requests.
+    Returns a dict with lists of changed and unchanged record names.
+    """
+    if not _dns_hosted_zone_ids.get(root_domain):
+        _dns_hosted_zone_ids[root_domain] = get_dns_hosted_zone_id(root_domain)
+    hosted_zone_id = _dns_hosted_zone_ids[root_domain]
+    client = get_boto3_client('route53')
+    existing_records = {}
+    for page in client.get_paginator('list_resource_record_sets').paginate(HostedZoneId=hosted_zone_id):
+        for record_set in page['ResourceRecordSets']:
+            if record_set['Type'] == 'CNAME':
+                existing_records[record_set['Name']] = [r['Value'] for r in record_set.get('ResourceRecords', [])]
+    res = {'changed': [], 'unchanged': []}
+    changes = []
+    for sub_domain, load_balancer_hostname in sorted(records.items()):
+        name = f'{sub_domain}.{root_domain}.'
+        if existing_records.get(name) == [load_balancer_hostname]:
+            res['unchanged'].append(name)
+            continue
+        res['changed'].append(name)
+        changes.append({
+            'Action': 'UPSERT',
+            'ResourceRecordSet': {
+                'Name': name,
+                'Type': 'CNAME',
+                'TTL': 300,
+                'ResourceRecords': [{'Value': load_balancer_hostname}],
+            }
+        })
+    logs.info('updating Route53 DNS records', root_domain=root_domain, hosted_zone_id=hosted_zone_id,
+              changed=len(res['changed']), unchanged=len(res['unchanged']))
+    for i in range(0, len(changes), ROUTE53_CHANGE_BATCH_SIZE):
+        response = client.change_resource_record_sets(
+            HostedZoneId=hosted_zone_id,
+            ChangeBatch={'Comment': 'ckan-cloud-operator', 'Changes': changes[i:i + ROUTE53_CHANGE_BATCH_SIZE]}
+        )
+        assert response['ResponseMetadata']['HTTPStatusCode'] == 200
+    return res
@@ -187,3 +187,25 @@ def create_dns_record(sub_domain, root_domain, load_balancer_ip_or_hostname):
         # Create if does not
         cmd = f'network dns record-set a add-record  -g {resource_group} -z {root_domain} -n {sub_domain} -a {load_balancer_ip_or_hostname}'
         az_check_output(cmd)
+
+
+def create_dns_records(root_domain, records):
+    """Create multiple A records in the root domain zone, records is a dict of sub domain -> ip
+
+    The zone record sets are listed once and only missing records are added, existing records are not modified
+    (same as create_dns_record). Returns a dict with lists of created and existing record names.
+    """
+    resource_group = _config_get('azure-rg')
+    existing_names = {
+        record_set['name'] for record_set in
+        json.loads(az_check_output(f'network dns record-set a list -g {resource_group} -z {root_domain} -o json'))
+    }
+    res = {'created': [], 'existing': []}
+    for sub_domain, load_balancer_ip_or_hostname in sorted(records.items()):
+        if sub_domain in existing_names:
+            res['existing'].append(sub_domain)
+            continue
+        logs.info('creating Azure DNS record', sub_domain=sub_domain, root_domain=root_domain)
+        az_check_output(f'network dns record-set a add-record  -g {resource_group} -z {root_domain} -n {sub_domain} -a {load_balancer_ip_or_hostname}')
+        res['created'].append(sub_domain)
+    return res
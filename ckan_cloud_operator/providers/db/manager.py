@@ -95,6 +95,14 @@ def get_external_admin_connection_string(db_name=None, db_prefix=None):
     return f'postgresql://{admin_user}:{admin_password}@{db_host}:{db_port}/{db_name}'
 
 
+def admin_connect(db_name=None, db_prefix=None, autocommit=False):
+    """Get a pooled admin connection for access from outside the cluster, reused across calls for the same db / prefix"""
+    return postgres_driver.pooled_connect(
+        get_external_admin_connection_string(db_name=db_name, db_prefix=db_prefix),
+        key=(db_prefix or '', db_name or ''), autocommit=autocommit
+    )
+
+
 def get_deis_instsance_external_connection_string(instance_id, is_datastore=False, is_datastore_readonly=False, admin=False, db_prefix=None):
     user, password, db_name, db_host, db_port = get_deis_instance_external_connection_details(
         instance_id, is_datastore=is_datastore, is_datastore_readonly=is_datastore_readonly,
@@ -213,9 +221,18 @@ def get_provider():
     return providers_manager.get_provider(db_provider_submodule)
 
 
+def import_db(import_url, db_name, import_user, db_prefix=None):
+    """Import a dump into an existing db, using a Cloud SQL import or a streaming restore for other providers"""
+    if providers_manager.get_provider_id(db_provider_submodule) == db_gcloudsql_provider_id:
+        get_provider().import_db(import_url, db_name, import_user=import_user, db_prefix=db_prefix)
+    else:
+        postgres_driver.restore_from_url(
+            get_external_admin_connection_string(db_name=db_name, db_prefix=db_prefix), import_url, role=import_user
+        )
+
+
 def check_db_exists(db_name, db_prefix=None):
-    admin_connection_string = get_external_admin_connection_string(db_prefix=db_prefix)
-    with postgres_driver.connect(admin_connection_string) as admin_conn:
+    with admin_connect(db_prefix=db_prefix) as admin_conn:
         return len(list(postgres_driver.list_roles(admin_conn, role_name=db_name))) > 0
 
 
@@ -49,8 +49,9 @@ def port_forward(db_prefix, all_daemon):
 @click.option('--verify-instance-id')
 @click.option('--set-pool-mode')
 @click.option('--reload', is_flag=True)
-def proxy_update(verify_instance_id, set_pool_mode, reload):
-    manager.update(wait_updated=reload, set_pool_mode=set_pool_mode)
+@click.option('--set-replicas', type=int, help='number of pgbouncer replicas, spread across nodes')
+def proxy_update(verify_instance_id, set_pool_mode, reload, set_replicas):
+    manager.update(wait_updated=reload, set_pool_mode=set_pool_mode, set_replicas=set_replicas)
     if verify_instance_id:
         from ckan_cloud_operator.providers.db import manager as db_manager
         logs.info(f'{verify_instance_id}: Checking DB..')
@@ -64,6 +65,25 @@ def proxy_update(verify_instance_id, set_pool_mode, reload):
     logs.exit_great_success()
 
 
+@proxy.command()
+@click.argument('WHAT', default='POOLS')
+def pgbouncer_show(what):
+    """Run an admin console SHOW command (e.g. POOLS, STATS, DATABASES) on all the pgbouncer replicas"""
+    from .pgbouncer import manager as pgbouncer_manager
+    from .pgbouncer import admin as pgbouncer_admin
+    replica_hosts = pgbouncer_admin.get_replica_hosts(pgbouncer_manager._get_resource_labels(for_deployment=True)['app'])
+    rows = pgbouncer_admin.show(replica_hosts.values(), what.upper())
+    logs.print_yaml_dump({pod_name: rows[host] for pod_name, host in replica_hosts.items()})
+
+
+@proxy.command()
+@click.option('--dry-run', is_flag=True)
+def pgbouncer_tune(dry_run):
+    """Set the pgbouncer pool size of each active database according to its demand"""
+    from .pgbouncer import manager as pgbouncer_manager
+    logs.print_yaml_dump(pgbouncer_manager.tune_pool_sizes(dry_run=dry_run))
+
+
 @proxy.command()
 def initialize():
     manager.initialize()
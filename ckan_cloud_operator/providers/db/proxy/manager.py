@@ -11,12 +11,14 @@ def start_port_forward(db_prefix=None):
     get_provider().start_port_forward(db_prefix=db_prefix)
 
 
-def update(wait_updated=False, set_pool_mode=None):
-    get_provider().update(wait_updated=wait_updated, set_pool_mode=set_pool_mode)
+def update(wait_updated=False, set_pool_mode=None, dbs_users=None, set_replicas=None):
+    """Update the proxy config, dbs_users is an optional tuple of (dbs, users) to update only these entries"""
+    get_provider().update(wait_updated=wait_updated, set_pool_mode=set_pool_mode, dbs_users=dbs_users,
+                          set_replicas=set_replicas)
 
 
-def reload():
-    get_provider().reload()
+def reload(db_names=None):
+    get_provider().reload(db_names=db_names)
 
 
 def get_provider(default=None, required=True):
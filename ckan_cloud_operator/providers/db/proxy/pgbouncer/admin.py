@@ -0,0 +1,122 @@
+"""PgBouncer admin console client
+
+Connects to the special pgbouncer database of each replica (pod ip) as the db admin user, which is set as
+pgbouncer admin_users. Connections are kept open and reused, the admin console doesn't support transactions
+so the connections are in autocommit mode.
+
+RELOAD re-reads the config files from the mounted secret, which is updated by kubelet some time after the
+secret is changed, so after reloading SHOW DATABASES is polled (with backoff, reloading again each time)
+until the expected databases are served, instead of sleeping for the maximal propagation time.
+"""
+import concurrent.futures
+import os
+import time
+
+import psycopg2
+
+from ckan_cloud_operator import kubectl
+from ckan_cloud_operator import logs
+
+
+# seconds to wait for all the replicas to serve the expected databases after a reload
+RELOAD_TIMEOUT_SECONDS = int(os.environ.get('CKAN_CLOUD_OPERATOR_PGBOUNCER_RELOAD_TIMEOUT_SECONDS', '180'))
+
+# max seconds between polls of the admin console while waiting for the config to be reloaded
+RELOAD_POLL_MAX_SECONDS = int(os.environ.get('CKAN_CLOUD_OPERATOR_PGBOUNCER_RELOAD_POLL_MAX_SECONDS', '10'))
+
+# seconds to wait for connection to the admin console of a replica
+CONNECT_TIMEOUT_SECONDS = int(os.environ.get('CKAN_CLOUD_OPERATOR_PGBOUNCER_CONNECT_TIMEOUT_SECONDS', '5'))
+
+PORT = 5432
+
+__CONNECTIONS = {}
+
+
+def get_replica_hosts(deployment_app):
+    """Returns a dict of pod name -> pod ip of the running pgbouncer replicas"""
+    pods = kubectl.get('pods', '-l', f'app={deployment_app}', required=False) or {'items': []}
+    return {
+        pod['metadata']['name']: pod['status']['podIP']
+        for pod in pods['items']
+        if pod.get('status', {}).get('phase') == 'Running' and pod['status'].get('podIP')
+    }
+
+
+def execute(host, command):
+    """Run an admin console command, returns a list of row dicts (empty for commands without results)"""
+    for retry in [True, False]:
+        conn = _get_connection(host)
+        try:
+            with conn.cursor() as cur:
+                cur.execute(command)
+                if not cur.description:
+                    return []
+                columns = [column[0] for column in cur.description]
+                return [dict(zip(columns, row)) for row in cur.fetchall()]
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            # the pooled connection was closed, e.g. the replica restarted
+            _close_connection(host)
+            if not retry:
+                raise
+
+
+def show(hosts, what):
+    """Run SHOW <what> on all the given replicas in parallel, returns a dict of host -> rows"""
+    return _map_hosts(lambda host: execute(host, f'SHOW {what}'), hosts)
+
+
+def reload(hosts, db_names=None, pool_sizes=None, timeout=RELOAD_TIMEOUT_SECONDS):
+    """Reload all the given replicas in parallel and wait until they serve the given databases
+
+    pool_sizes is an optional dict of db name -> pool size, to wait for these databases pool sizes as well.
+    Returns a dict of host -> set of the missing db names (empty if the replica was reloaded successfully)
+    """
+    deadline = time.time() + timeout
+    expected_pool_sizes = {**{db_name: None for db_name in db_names or ()}, **(pool_sizes or {})}
+    return _map_hosts(lambda host: _reload_replica(host, expected_pool_sizes, deadline), hosts)
+
+
+def _reload_replica(host, expected_pool_sizes, deadline):
+    delay = 1
+    while True:
+        execute(host, 'RELOAD')
+        pool_sizes = {row['name']: row.get('pool_size') for row in execute(host, 'SHOW DATABASES')}
+        missing_db_names = {
+            db_name for db_name, pool_size in expected_pool_sizes.items()
+            if db_name not in pool_sizes or (pool_size is not None and pool_sizes[db_name] != pool_size)
+        }
+        if not missing_db_names or time.time() + delay > deadline:
+            return missing_db_names
+        logs.info(f'{host}: waiting for pgbouncer config to be updated', missing_dbs=len(missing_db_names),
+                  retry_seconds=delay)
+        time.sleep(delay)
+        delay = min(delay * 2, RELOAD_POLL_MAX_SECONDS)
+
+
+def _map_hosts(func, hosts):
+    hosts = list(hosts)
+    if not hosts:
+        return {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(hosts)) as executor:
+        return dict(zip(hosts, executor.map(func, hosts)))
+
+
+def _get_connection(host):
+    conn = __CONNECTIONS.get(host)
+    if conn is None or conn.closed:
+        from ckan_cloud_operator.providers.db import manager as db_manager
+        admin_user, admin_password, _ = db_manager.get_admin_db_credentials()
+        conn = psycopg2.connect(host=host, port=PORT, user=admin_user, password=admin_password, dbname='pgbouncer',
+                                connect_timeout=CONNECT_TIMEOUT_SECONDS)
+        conn.autocommit = True
+        __CONNECTIONS[host] = conn
+    return conn
+
+
+def _close_connection(host):
+    conn = __CONNECTIONS.pop(host, None)
+    if conn is not None:
+        try:
+            conn.close()
+        except Exception:
+            pass
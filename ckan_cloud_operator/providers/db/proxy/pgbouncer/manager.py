@@ -19,11 +19,15 @@ def _config_get_volume_spec(volume_name, is_secret=False, suffix=None): return p
 # custom provider code starts here
 #
 
-import time
+import concurrent.futures
+import json
 import os
 import subprocess
+import time
 import traceback
 
+import psycopg2
+
 from distutils.util import strtobool
 
 from ckan_cloud_operator import kubectl
@@ -31,6 +35,8 @@ from ckan_cloud_operator import logs
 
 from ckan_cloud_operator.providers.db import manager as db_manager
 from ckan_cloud_operator.providers.cluster import manager as cluster_manager
+from ckan_cloud_operator.providers.db.proxy.pgbouncer import admin as pgbouncer_admin
+from ckan_cloud_operator.providers.db.proxy.pgbouncer import tuning as pgbouncer_tuning
 
 
 def initialize():
@@ -40,24 +46,97 @@ def initialize():
     _set_provider()
 
 
-def update(wait_updated=False, set_pool_mode=None):
+def update(wait_updated=False, set_pool_mode=None, dbs_users=None, set_replicas=None):
+    """Update the config secret, if dbs_users is set only the given (dbs, users) entries are added / updated
+
+    With wait_updated, reloads the replicas and waits until they serve the updated databases
+    """
     if set_pool_mode:
         _config_set('pool-mode', set_pool_mode)
-    _apply_config_secret()
-    if wait_updated:
-        logs.info('Waiting 1 minute for pgbouncer secret to be updated...')
-        time.sleep(60)
-        reload()
+    if set_replicas:
+        _config_set('replicas', str(int(set_replicas)))
+        _apply_deployment()
+    if dbs_users and not set_pool_mode:
+        updated = _update_config_secret_entries(*dbs_users)
+        db_names = [db_name for db_name, _, _ in dbs_users[0]]
+    else:
+        db_names = _apply_config_secret()
+        updated = True
+    if wait_updated and updated:
+        reload(db_names=db_names)
 
 
-def reload():
+def reload(db_names=None, pool_sizes=None):
+    """Reload the config of all the replicas in parallel, waiting until they serve the given db names
+
+    Uses the admin console of each replica, if the replicas are not reachable (e.g. when running outside
+    of the cluster) falls back to running pgbouncer -R in each pod once the mounted config is updated
+    """
     deployment_app = _get_resource_labels(for_deployment=True)['app']
-    logs.info('Reloading pgbouncers...')
-    for pod_name in kubectl.check_output(
-            f'get pods -l app={deployment_app} --output=custom-columns=name:.metadata.name --no-headers'
-    ).decode().splitlines():
+    replica_hosts = pgbouncer_admin.get_replica_hosts(deployment_app)
+    logs.info(f'Reloading {len(replica_hosts)} pgbouncers...')
+    try:
+        missing_db_names = pgbouncer_admin.reload(replica_hosts.values(), db_names=db_names, pool_sizes=pool_sizes)
+    except psycopg2.OperationalError as e:
+        logs.warning(f'Failed to connect to the pgbouncer admin console, reloading using kubectl exec: {e}')
+        failed_pod_names = _exec_reload(replica_hosts)
+        assert not failed_pod_names, f'pgbouncers mounted config was not updated: {failed_pod_names}'
+        return
+    failed_pod_names = [pod_name for pod_name, host in replica_hosts.items() if missing_db_names[host]]
+    for pod_name in replica_hosts:
+        if pod_name not in failed_pod_names:
+            logs.info(f'{pod_name}: PgBouncer Reloaded')
+    assert not failed_pod_names, f'pgbouncers were reloaded but are missing some dbs: {failed_pod_names}'
+
+
+def tune_pool_sizes(dry_run=False):
+    """Set the pool size of each active database according to its demand, see tuning.py
+
+    Returns a dict of db name -> pool size
+    """
+    deployment_app = _get_resource_labels(for_deployment=True)['app']
+    replica_hosts = pgbouncer_admin.get_replica_hosts(deployment_app)
+    assert replica_hosts, 'no running pgbouncer replicas'
+    pool_sizes = pgbouncer_tuning.tune(list(replica_hosts.values()), pgbouncer_admin.show)
+    if not dry_run and pool_sizes != _get_pool_sizes():
+        _config_set('pool-sizes', json.dumps(pool_sizes, sort_keys=True))
+        reload(db_names=_apply_config_secret(), pool_sizes=pool_sizes)
+    return pool_sizes
+
+
+def _exec_reload(replica_hosts, timeout=pgbouncer_admin.RELOAD_TIMEOUT_SECONDS):
+    """Reload each pod using kubectl exec, after the mounted config files match the config secret
+
+    kubelet updates the mounted secret some time after it's changed, so the mounted files are polled (with backoff)
+    like the admin console reload polls SHOW DATABASES. Returns the names of pods which were not updated in time.
+    """
+    config = _config_get(is_secret=True) or {}
+    deadline = time.time() + timeout
+
+    def exec_reload(pod_name):
+        delay = 1
+        while True:
+            mounted_config = {
+                filename: kubectl.check_output(f'exec {pod_name} -- cat /var/local/pgbouncer/{filename}').decode()
+                for filename in ['pgbouncer.ini', 'users.txt']
+            }
+            if all(mounted_config[filename].strip() == (config.get(filename) or '').strip()
+                   for filename in mounted_config):
+                break
+            if time.time() + delay > deadline:
+                logs.warning(f'{pod_name}: timed out waiting for the pgbouncer config to be updated')
+                return False
+            logs.info(f'{pod_name}: waiting for pgbouncer config to be updated', retry_seconds=delay)
+            time.sleep(delay)
+            delay = min(delay * 2, pgbouncer_admin.RELOAD_POLL_MAX_SECONDS)
         kubectl.check_call(f'exec {pod_name} -- pgbouncer -q -u pgbouncer -d -R /var/local/pgbouncer/pgbouncer.ini')
         logs.info(f'{pod_name}: PgBouncer Reloaded')
+        return True
+
+    pod_names = list(replica_hosts)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(len(pod_names), 1)) as executor:
+        return [pod_name for pod_name, reloaded in zip(pod_names, executor.map(exec_reload, pod_names))
+                if not reloaded]
 
 
 def get_internal_proxy_host_port():
@@ -98,20 +177,17 @@ def _apply_config_secret(force=False):
             dbs, users = [], []
         else:
             raise
+    pool_sizes = _get_pool_sizes()
     for db_name, db_host, db_port in dbs:
         assert db_name not in update_dbs
-        update_dbs[db_name] = f'{db_name} = host={db_host} port={db_port} dbname={db_name}'
+        update_dbs[db_name] = _get_database_line(db_name, db_host, db_port, pool_sizes.get(db_name))
     for name, password in users:
         assert name not in users
         update_users[name] = password
-    pg_bouncer_ini = ["[databases]"]
-    for db_name, line in update_dbs.items():
-        pg_bouncer_ini.append(line)
     db_admin_user, _, _ = db_manager.get_admin_db_credentials()
     # see https://pgbouncer.github.io/config.html
     pool_mode = _config_get('pool-mode', 'transaction')
-    pg_bouncer_ini += [
-        "",
+    pgbouncer_section = [
         "[pgbouncer]",
         "listen_port = 5432",
         "listen_addr = 0.0.0.0",
@@ -139,24 +215,80 @@ def _apply_config_secret(force=False):
         ]),
         f"admin_users = {db_admin_user}",
     ]
-    users_txt = []
-    for name, password in update_users.items():
-        users_txt.append(f'"{name}" "{password}"')
-    updated_secret = {
-        'pgbouncer.ini': "\n".join(pg_bouncer_ini),
-        'users.txt': "\n".join(users_txt)
+    _config_set(values=_get_config_secret_values(update_dbs, pgbouncer_section, update_users), is_secret=True)
+    return list(update_dbs)
+
+
+def _update_config_secret_entries(dbs, users):
+    """Add / update only the given databases and users in the current config secret, returns True if it changed"""
+    config = _config_get(is_secret=True) or {}
+    if not config.get('pgbouncer.ini'):
+        _apply_config_secret()
+        return True
+    current_dbs, pgbouncer_section, current_users = _parse_config_secret_values(config)
+    update_dbs, update_users = dict(current_dbs), dict(current_users)
+    pool_sizes = _get_pool_sizes()
+    for db_name, db_host, db_port in dbs:
+        update_dbs[db_name] = _get_database_line(db_name, db_host, db_port, pool_sizes.get(db_name))
+    for name, password in users:
+        update_users[name] = password
+    changed_dbs = sorted(k for k, v in update_dbs.items() if current_dbs.get(k) != v)
+    changed_users = sorted(k for k, v in update_users.items() if current_users.get(k) != v)
+    if changed_dbs or changed_users:
+        logs.info('Updating pgbouncer config entries', dbs=changed_dbs, users=changed_users)
+        _config_set(values=_get_config_secret_values(update_dbs, pgbouncer_section, update_users), is_secret=True)
+        return True
+    else:
+        logs.info('Pgbouncer config entries are up to date')
+        return False
+
+
+def _get_database_line(db_name, db_host, db_port, pool_size=None):
+    pool_size = f' pool_size={pool_size}' if pool_size else ''
+    return f'{db_name} = host={db_host} port={db_port} dbname={db_name}{pool_size}'
+
+
+def _get_pool_sizes():
+    """Per-database pool sizes set by tune_pool_sizes"""
+    return json.loads(_config_get('pool-sizes', '{}'))
+
+
+def _get_config_secret_values(dbs, pgbouncer_section, users):
+    """dbs is a dict of db name -> [databases] line, users a dict of user name -> password"""
+    return {
+        'pgbouncer.ini': "\n".join(["[databases]", *dbs.values(), "", *pgbouncer_section]),
+        'users.txt': "\n".join(f'"{name}" "{password}"' for name, password in users.items())
     }
-    _config_set(values=updated_secret, is_secret=True)
+
+
+def _parse_config_secret_values(config):
+    """Returns (dbs, the [pgbouncer] section lines, users) of the current config secret values"""
+    dbs, pgbouncer_section, section = {}, [], None
+    for line in config['pgbouncer.ini'].splitlines():
+        if line.startswith('['):
+            section = line
+        if section == '[databases]' and ' = ' in line:
+            dbs[line.split(' = ')[0]] = line
+        elif section and section != '[databases]':
+            pgbouncer_section.append(line)
+    users = {}
+    for line in (config.get('users.txt') or '').splitlines():
+        name, password = line[1:-1].split('" "', 1)
+        users[name] = password
+    return dbs, pgbouncer_section, users
 
 
 def _apply_deployment():
+    replicas = int(_config_get('replicas', '1'))
     kubectl.apply(kubectl.get_deployment(
         _get_resource_name(),
         _get_resource_labels(for_deployment=True),
         {
-            'replicas': 1,
+            'replicas': replicas,
             'revisionHistoryLimit': 10,
-            'strategy': {'type': 'RollingUpdate', },
+            'strategy': {'type': 'RollingUpdate', **({
+                'rollingUpdate': {'maxSurge': 1, 'maxUnavailable': 0}
+            } if replicas > 1 else {})},
             'template': {
                 'metadata': {
                     'labels': _get_resource_labels(for_deployment=True),
@@ -198,13 +330,29 @@ def _apply_deployment():
                     ],
                     'volumes': [
                         _config_get_volume_spec('config', is_secret=True),
-                    ]
+                    ],
+                    **({'affinity': _get_replicas_affinity()} if replicas > 1 else {})
                 }
             }
         }
     ))
 
 
+def _get_replicas_affinity():
+    """Prefer to schedule the replicas on different nodes"""
+    return {
+        'podAntiAffinity': {
+            'preferredDuringSchedulingIgnoredDuringExecution': [{
+                'weight': 100,
+                'podAffinityTerm': {
+                    'labelSelector': {'matchLabels': {'app': _get_resource_labels(for_deployment=True)['app']}},
+                    'topologyKey': 'kubernetes.io/hostname'
+                }
+            }]
+        }
+    }
+
+
 def _apply_service():
     deployment_app = _get_resource_labels(for_deployment=True)['app']
     kubectl.apply(kubectl.get_service(
@@ -0,0 +1,116 @@
+"""Per-database pool size tuning of the pgbouncer replicas
+
+All the databases share the same default_pool_size, so busy databases wait for server connections while
+idle ones keep theirs open. The tuner reads SHOW POOLS / SHOW STATS of all the replicas and sets a pool_size
+for each active database in the [databases] section, proportional to its demand:
+
+    demand = active server connections + waiting clients + average wait time (ms) / WAIT_MS_PER_CONNECTION
+
+averaged over the replicas. Each pgbouncer replica has its own pools, so the server connections budget
+(postgres max_connections minus RESERVED_CONNECTIONS) is divided by the number of replicas. Idle databases use
+the default pool size, their server connections are closed after server_idle_timeout but may be reopened at any
+time, so default_pool_size of each idle database and reserve_pool_size of each active database are subtracted from
+the budget. Each active database gets at least MIN_POOL_SIZE and at most MAX_POOL_SIZE, the total doesn't exceed
+the remaining budget.
+"""
+import os
+
+from ckan_cloud_operator import logs
+
+
+# postgres connections which are not available for pgbouncer (superuser reserved, admin operations, monitoring)
+RESERVED_CONNECTIONS = int(os.environ.get('CKAN_CLOUD_OPERATOR_PGBOUNCER_RESERVED_CONNECTIONS', '20'))
+
+# min / max pool size of an active database
+MIN_POOL_SIZE = int(os.environ.get('CKAN_CLOUD_OPERATOR_PGBOUNCER_MIN_POOL_SIZE', '2'))
+MAX_POOL_SIZE = int(os.environ.get('CKAN_CLOUD_OPERATOR_PGBOUNCER_MAX_POOL_SIZE', '50'))
+
+# average client wait time which counts as demand for one more server connection
+WAIT_MS_PER_CONNECTION = int(os.environ.get('CKAN_CLOUD_OPERATOR_PGBOUNCER_WAIT_MS_PER_CONNECTION', '100'))
+
+ADMIN_DB_NAME = 'pgbouncer'
+
+
+def get_demands(replicas_pools, replicas_stats):
+    """Returns a dict of db name -> average demand per replica, for databases with any activity
+
+    replicas_pools / replicas_stats are dicts of replica -> rows of SHOW POOLS / SHOW STATS
+    """
+    demands, active_db_names = {}, set()
+    for pools in replicas_pools.values():
+        for pool in pools:
+            db_name = pool['database']
+            if db_name == ADMIN_DB_NAME:
+                continue
+            if any(int(pool.get(key) or 0) for key in ['cl_active', 'cl_waiting', 'sv_active', 'sv_idle', 'sv_used']):
+                active_db_names.add(db_name)
+            demands[db_name] = demands.get(db_name, 0) + int(pool.get('sv_active') or 0) + int(pool.get('cl_waiting') or 0)
+    for stats in replicas_stats.values():
+        for stat in stats:
+            db_name = stat['database']
+            if db_name == ADMIN_DB_NAME:
+                continue
+            if int(stat.get('avg_xact_count') or 0):
+                active_db_names.add(db_name)
+            # avg_wait_time is in microseconds
+            wait_ms = int(stat.get('avg_wait_time') or 0) / 1000
+            demands[db_name] = demands.get(db_name, 0) + wait_ms / WAIT_MS_PER_CONNECTION
+    num_replicas = max(len(replicas_pools), 1)
+    return {db_name: demands.get(db_name, 0) / num_replicas for db_name in sorted(active_db_names)}
+
+
+def get_pool_sizes(demands, budget):
+    """Divide the per-replica server connections budget between the active databases according to their demand"""
+    if not demands or budget <= 0:
+        return {}
+    min_pool_size = max(min(MIN_POOL_SIZE, budget // len(demands)), 1)
+    pool_sizes = {db_name: min_pool_size for db_name in demands}
+    remaining_budget = budget - min_pool_size * len(demands)
+    total_demand = sum(demands.values())
+    if remaining_budget > 0 and total_demand > 0:
+        for db_name, demand in demands.items():
+            pool_sizes[db_name] = min(min_pool_size + int(remaining_budget * demand / total_demand), MAX_POOL_SIZE)
+    return pool_sizes
+
+
+def get_pool_sizes_budget(budget, num_active_dbs, num_idle_dbs, default_pool_size, reserve_pool_size):
+    """Returns the part of the per-replica budget which is left for the pool sizes of the active databases"""
+    pool_sizes_budget = budget - reserve_pool_size * num_active_dbs - default_pool_size * num_idle_dbs
+    logs.info('pgbouncer pool sizes budget', active_dbs=num_active_dbs, idle_dbs=num_idle_dbs,
+              default_pool_size=default_pool_size, reserve_pool_size=reserve_pool_size,
+              pool_sizes_budget=pool_sizes_budget)
+    if pool_sizes_budget < num_active_dbs:
+        logs.warning('pgbouncer server connections budget is exhausted by the default and reserve pools')
+    return pool_sizes_budget
+
+
+def get_config(replicas_config):
+    """Returns a dict of the config values of the first replica, replicas_config is a dict of replica -> SHOW CONFIG"""
+    for rows in replicas_config.values():
+        return {row['key']: row['value'] for row in rows}
+    return {}
+
+
+def get_budget(num_replicas):
+    """Returns the server connections budget of each replica, based on the postgres max_connections"""
+    from ckan_cloud_operator.providers.db import manager as db_manager
+    with db_manager.admin_connect() as conn:
+        with conn.cursor() as cur:
+            cur.execute('SHOW max_connections')
+            max_connections = int(cur.fetchone()[0])
+    budget = (max_connections - RESERVED_CONNECTIONS) // max(num_replicas, 1)
+    logs.info('pgbouncer server connections budget', max_connections=max_connections, replicas=num_replicas,
+              budget_per_replica=budget)
+    return budget
+
+
+def tune(replica_hosts, show):
+    """Returns the pool sizes for the given replicas, show(hosts, what) runs an admin console SHOW command"""
+    demands = get_demands(show(replica_hosts, 'POOLS'), show(replica_hosts, 'STATS'))
+    config = get_config(show(replica_hosts, 'CONFIG'))
+    db_names = {
+        row['name'] for rows in show(replica_hosts, 'DATABASES').values() for row in rows
+    } - {ADMIN_DB_NAME}
+    budget = get_pool_sizes_budget(get_budget(len(replica_hosts)), len(demands), len(db_names - set(demands)),
+                                   int(config.get('default_pool_size') or 0), int(config.get('reserve_pool_size') or 0))
+    return get_pool_sizes(demands, budget)
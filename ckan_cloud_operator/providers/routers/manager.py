@@ -86,3 +86,38 @@ def update_dns_record(dns_provider, sub_domain, root_domain, load_balancer_ip_or
         return
     else:
         raise NotImplementedError()
+
+
+def update_dns_records(dns_provider, domains, load_balancer_ip_or_hostname, cloudflare_email=None,
+                       cloudflare_auth_key=None):
+    """Sync the records of multiple domains to the load balancer, domains is a dict of root domain -> sub domains
+
+    Each zone's current records are fetched once and only missing or changed records are written,
+    returns a dict of root domain -> provider specific summary of the changes.
+    """
+    logs.info('updating DNS records', dns_provider=dns_provider, root_domains=len(domains),
+              records=sum(len(sub_domains) for sub_domains in domains.values()),
+              load_balancer_ip_or_hostname=load_balancer_ip_or_hostname)
+    res = {}
+    for root_domain, sub_domains in domains.items():
+        if dns_provider == 'cloudflare':
+            from ckan_cloud_operator import cloudflare
+            res[root_domain] = cloudflare.update_records(
+                cloudflare_email, cloudflare_auth_key, root_domain,
+                {f'{sub_domain}.{root_domain}': load_balancer_ip_or_hostname for sub_domain in sub_domains}
+            )
+        elif dns_provider == 'route53':
+            from ckan_cloud_operator.providers.cluster.aws import manager as aws_manager
+            res[root_domain] = aws_manager.update_dns_records(
+                root_domain, {sub_domain: load_balancer_ip_or_hostname for sub_domain in sub_domains}
+            )
+        elif dns_provider == 'azure':
+            from ckan_cloud_operator.providers.cluster.azure import manager as azure_manager
+            res[root_domain] = azure_manager.create_dns_records(
+                root_domain, {sub_domain: load_balancer_ip_or_hostname for sub_domain in sub_domains}
+            )
+        elif dns_provider.lower() == 'none':
+            return res
+        else:
+            raise NotImplementedError()
+    return res
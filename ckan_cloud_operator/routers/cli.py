@@ -3,6 +3,10 @@ import yaml
 
 from ckan_cloud_operator.routers import manager as routers_manager
 from ckan_cloud_operator.routers.routes import manager as routes_manager
+from ckan_cloud_operator.crds import manager as crds_manager
+from ckan_cloud_operator.drivers.kubectl import cache as kubectl_cache
+from ckan_cloud_operator.providers.ckan.constants import INSTANCE_CRD_SINGULAR, INSTANCE_NAME_CRD_SINGULAR
+from ckan_cloud_operator import kubectl
 from ckan_cloud_operator import logs
 
 
@@ -21,13 +25,22 @@ def add_cli_commands(click, command_group, great_success):
     @click.argument('CLOUDFLARE_EMAIL', required=False, default='default')
     @click.argument('CLOUDFLARE_API_KEY', required=False, default='default')
     @click.option('--external-domains', is_flag=True)
-    def routers_create(traefik_router_name, default_root_domain, cloudflare_email, cloudflare_api_key, external_domains):
+    @click.option('--hot-reload', is_flag=True, help='reload route changes without restarting traefik')
+    @click.option('--replicas', type=int, help="number of traefik replicas, only used with --hot-reload, routers with let's encrypt run a single replica")
+    @click.option('--shards', type=int, help='spread the routes across this number of traefik deployments')
+    @click.option('--crd-provider', is_flag=True, help='write the routes as traefik IngressRoute objects')
+    def routers_create(traefik_router_name, default_root_domain, cloudflare_email, cloudflare_api_key, external_domains,
+                       hot_reload, replicas, shards, crd_provider):
         """Create a Traefik router, with domain registration and let's encrypt based on Cloudflare"""
+        if crd_provider:
+            from ckan_cloud_operator.routers.traefik import crd as traefik_crd
+            traefik_crd.install_crds()
         routers_manager.create(
             traefik_router_name,
             routers_manager.get_traefik_router_spec(
                 default_root_domain, cloudflare_email, cloudflare_api_key,
-                external_domains=external_domains
+                external_domains=external_domains, hot_reload=hot_reload, replicas=replicas, shards=shards,
+                crd_provider=crd_provider
             )
         )
         routers_manager.update(traefik_router_name)
@@ -38,7 +51,10 @@ def add_cli_commands(click, command_group, great_success):
     @click.option('--wait-ready', is_flag=True)
     def routers_update(router_name, wait_ready):
         """Update a router to latest resource spec"""
-        routers_manager.update(router_name, wait_ready)
+        # routes and the instances they point to are read many times while generating the router config
+        with kubectl_cache.snapshot('CkanCloudRoute'), \
+                crds_manager.cache_snapshot(INSTANCE_CRD_SINGULAR, INSTANCE_NAME_CRD_SINGULAR):
+            routers_manager.update(router_name, wait_ready)
         great_success()
 
     @command_group.command('list')
@@ -173,6 +189,7 @@ def add_cli_commands(click, command_group, great_success):
             routes = routers_manager.get_all_routes()
         if routes:
             if one: assert len(routes) == 1, 'too many routes!'
+            index = routes_manager.get_index()
             for route in routes:
                 if external_domain:
                     data = routers_manager.get_route_frontend_hostname(route)
@@ -184,7 +201,7 @@ def add_cli_commands(click, command_group, great_success):
                     try:
                         data = {
                             'name': route['metadata']['name'],
-                            'backend-url': routes_manager.get_backend_url(route),
+                            'backend-url': routes_manager.get_backend_url(route, index=index),
                             'frontend-hostname': routes_manager.get_frontend_hostname(route),
                             'router-name': route['spec']['router_name']
                         }
@@ -196,6 +213,52 @@ def add_cli_commands(click, command_group, great_success):
                     else:
                         print(yaml.dump([data], default_flow_style=False))
 
+    @command_group.command('get-route')
+    @click.option('--host', help='frontend hostname, including extra external domains')
+    @click.option('--target', help='route target, e.g. ckan-instance/<instance id> or datapusher/<datapusher name>')
+    @click.option('--router', 'router_name', help='router name')
+    @click.option('--full', is_flag=True, help='get the CkanCloudRoute objects instead of the lookup entries')
+    def get_route(host, target, router_name, full):
+        """Find routes using the routes lookup index without listing all the routes"""
+        from ckan_cloud_operator.routers.routes import lookup as routes_lookup
+        assert len([v for v in [host, target, router_name] if v]) == 1, 'one of --host / --target / --router is required'
+        lookup = routes_lookup.get()
+        if host:
+            route_names = lookup.get_hostname_routes(host)
+        elif target:
+            route_names = lookup.get_target_routes(target)
+        else:
+            route_names = lookup.get_router_routes(router_name)
+        if full:
+            logs.print_yaml_dump([kubectl.get(f'CkanCloudRoute {route_name}', required=False)
+                                  for route_name in route_names])
+        else:
+            logs.print_yaml_dump({route_name: lookup.routes[route_name] for route_name in route_names})
+
+    @command_group.command('check-route-conflicts')
+    @click.argument('HOSTNAME', required=False)
+    def check_route_conflicts(hostname):
+        """Check for hostnames which are served by more than one route
+
+        With HOSTNAME, checks if a new route for this hostname would conflict with existing routes
+        """
+        from ckan_cloud_operator.routers.routes import lookup as routes_lookup
+        lookup = routes_lookup.get()
+        conflicts = {hostname: lookup.get_hostname_routes(hostname)} if hostname else lookup.get_all_conflicts()
+        conflicts = {hostname: route_names for hostname, route_names in conflicts.items() if route_names}
+        if conflicts:
+            logs.print_yaml_dump(conflicts)
+            logs.exit_catastrophic_failure(quiet=True)
+        great_success()
+
+    @command_group.command('rebuild-route-index')
+    def rebuild_route_index():
+        """Rebuild the routes lookup index from all the routes"""
+        from ckan_cloud_operator.routers.routes import lookup as routes_lookup
+        lookup = routes_lookup.rebuild()
+        logs.info(f'indexed {len(lookup.routes)} routes with {len(lookup.hostnames)} hostnames')
+        great_success()
+
     @command_group.command('delete-routes')
     @click.option('-p', '--datapusher-name', required=False)
     @click.option('-d', '--deis-instance-id', required=False)
@@ -217,6 +280,67 @@ def add_cli_commands(click, command_group, great_success):
         routers_manager.delete(router_name, router_type)
         great_success()
 
+    @command_group.command('migrate-to-crd-provider')
+    @click.argument('ROUTER_NAME')
+    @click.option('--dry-run', is_flag=True, help='print the IngressRoute objects which will be created')
+    def migrate_to_crd_provider(router_name, dry_run):
+        """Switch a traefik router from the generated file config to IngressRoute objects"""
+        from ckan_cloud_operator.routers.traefik import crd as traefik_crd
+        traefik_crd.migrate(router_name, dry_run=dry_run)
+        great_success()
+
+    @command_group.command('aggregate-access-logs')
+    @click.argument('ROUTER_NAME', required=False)
+    @click.option('--file', 'file_patterns', multiple=True,
+                  help='read (rotated) log files matching this glob pattern instead of the router pods logs')
+    @click.option('--output-dir', default='data/access-logs', help='directory for the aggregated columnar files')
+    @click.option('--flush-seconds', type=int, help='seconds between writes of the aggregated counters')
+    @click.option('--since', help='aggregate the router pods logs since this duration (e.g. 1h) and exit')
+    def aggregate_access_logs(router_name, file_patterns, output_dir, flush_seconds, since):
+        """Aggregate the traefik access logs per route, requires the enable-access-log router spec"""
+        from ckan_cloud_operator.routers.traefik import access_logs
+        if file_patterns:
+            assert not router_name and not since, 'ROUTER_NAME / --since are not supported with --file'
+            lines = access_logs.iter_file_lines(file_patterns)
+        else:
+            assert router_name, 'ROUTER_NAME or --file is required'
+            lines = access_logs.iter_pod_log_lines(routers_manager.get_deployment_router_names(router_name),
+                                                   follow=not since, since=since)
+        access_logs.aggregate(lines, output_dir, flush_seconds=flush_seconds or access_logs.FLUSH_SECONDS)
+        great_success()
+
+    @command_group.command('top-routes')
+    @click.option('--output-dir', default='data/access-logs', help='directory of the aggregated columnar files')
+    @click.option('--limit', type=int, default=20)
+    @click.option('--sort-by', default='requests',
+                  type=click.Choice(['requests', 'avg_ms', 'status_4xx', 'status_5xx', 'bytes', 'bot_requests']))
+    @click.option('--since-seconds', type=int, help='only use counters flushed in the last number of seconds')
+    def top_routes(output_dir, limit, sort_by, since_seconds):
+        """Show the routes with most requests from the aggregated access logs"""
+        from ckan_cloud_operator.routers.traefik import access_logs
+        logs.print_yaml_dump(access_logs.get_top_routes(output_dir, limit=limit, sort_by=sort_by,
+                                                        since_seconds=since_seconds))
+
+    @command_group.command('probe')
+    @click.argument('ROUTER_NAME')
+    @click.option('--http', is_flag=True, help='probe plain HTTP instead of HTTPS')
+    @click.option('--concurrency', type=int, help='max number of concurrent requests')
+    @click.option('--timeout', type=float, help='seconds to wait for each request')
+    @click.option('--full', is_flag=True, help='print the results of all the hostnames, not only the summary')
+    @click.option('--no-save', is_flag=True, help='do not save the summary in the router health-summary annotation')
+    def probe(router_name, http, concurrency, timeout, full, no_save):
+        """Check that all the router hostnames respond, through the router load balancer
+
+        Prints a summary of the response statuses, latencies and TLS certificate expiry days
+        """
+        from ckan_cloud_operator.routers import health as routers_health
+        results, summary = routers_health.probe_router(
+            router_name, https=not http, save=not no_save,
+            concurrency=concurrency or routers_health.PROBE_CONCURRENCY,
+            timeout=timeout or routers_health.PROBE_TIMEOUT_SECONDS
+        )
+        logs.print_yaml_dump({'results': results, 'summary': summary} if full else summary)
+
     @command_group.command('get')
     @click.argument('ROUTER_NAME')
     @click.option('--dns', is_flag=True)
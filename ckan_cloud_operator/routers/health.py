@@ -0,0 +1,177 @@
+"""Synthetic health checks of all the frontend hostnames of a router
+
+Each hostname is requested through the router load balancer (connecting to the load balancer address with the
+hostname as TLS SNI and Host header), so the check doesn't depend on the DNS and verifies the router itself.
+Requests are made concurrently using asyncio, bounded by the concurrency argument, with only the standard library.
+
+The results are kept as a compact summary in the router health-summary annotation, shown by routers get.
+"""
+import asyncio
+import datetime
+import os
+import ssl
+import time
+
+from ckan_cloud_operator import logs
+from ckan_cloud_operator.routers.routes import manager as routes_manager
+
+
+# max number of concurrent requests
+PROBE_CONCURRENCY = int(os.environ.get('CKAN_CLOUD_OPERATOR_ROUTER_PROBE_CONCURRENCY', '50'))
+
+# seconds to wait for the connection and the response status line of each request
+PROBE_TIMEOUT_SECONDS = float(os.environ.get('CKAN_CLOUD_OPERATOR_ROUTER_PROBE_TIMEOUT_SECONDS', '10'))
+
+# certificates which expire in less than this number of days are listed in the summary
+TLS_EXPIRY_WARNING_DAYS = int(os.environ.get('CKAN_CLOUD_OPERATOR_ROUTER_PROBE_TLS_EXPIRY_WARNING_DAYS', '14'))
+
+# max number of failing / expiring hostnames listed in the summary, to keep the annotation small
+SUMMARY_MAX_HOSTNAMES = int(os.environ.get('CKAN_CLOUD_OPERATOR_ROUTER_PROBE_SUMMARY_MAX_HOSTNAMES', '20'))
+
+SUMMARY_ANNOTATION = 'health-summary'
+
+USER_AGENT = 'ckan-cloud-operator-router-prober'
+
+
+def get_probe_targets(router_name):
+    """Returns a list of (hostname, route name, load balancer address) of all the router routes"""
+    from ckan_cloud_operator.routers import manager as routers_manager
+    from ckan_cloud_operator.routers.traefik import deployment as traefik_deployment
+    from ckan_cloud_operator.routers.sharded_traefik import manager as sharded_traefik_manager
+    router, spec, router_type, annotations, labels, router_type_config = routers_manager._init_router(
+        router_name, required=True
+    )
+    routes = routes_manager.list(labels)
+    if router_type == sharded_traefik_manager.ROUTER_TYPE:
+        deployments_routes = sharded_traefik_manager.get_routes_shards(router_name, spec, routes)
+    else:
+        deployments_routes = {router_name: routes}
+    targets = []
+    for deployment_router_name, deployment_routes in deployments_routes.items():
+        if not deployment_routes:
+            continue
+        address = traefik_deployment.get_load_balancer_ip(deployment_router_name, failfast=True)
+        assert address, f'router {deployment_router_name} has no load balancer address'
+        for route in deployment_routes:
+            route_name = routes_manager.get_name(route)
+            hostnames = [routers_manager.get_route_frontend_hostname(route),
+                         *route['spec'].get('extra-external-domains', [])]
+            targets += [(hostname, route_name, address) for hostname in hostnames]
+    return targets
+
+
+def probe(targets, https=True, concurrency=PROBE_CONCURRENCY, timeout=PROBE_TIMEOUT_SECONDS, port=None):
+    """Request all the targets concurrently, returns a list of results in the same order as targets"""
+    return asyncio.run(_probe_all(targets, https, concurrency, timeout, port or (443 if https else 80)))
+
+
+def get_summary(results, https=True):
+    now = time.time()
+    latencies = sorted(result['latency_ms'] for result in results if result.get('latency_ms') is not None)
+    failing = [result for result in results if not _is_ok(result)]
+    tls_expiry_days = sorted(
+        (result['tls_expiry_days'], result['hostname'])
+        for result in results if result.get('tls_expiry_days') is not None
+    )
+    statuses = {}
+    for result in results:
+        status = f'{result["status"] // 100}xx' if result.get('status') else 'error'
+        statuses[status] = statuses.get(status, 0) + 1
+    return {
+        'checked-at': datetime.datetime.utcfromtimestamp(now).strftime('%Y-%m-%dT%H:%M:%SZ'),
+        'scheme': 'https' if https else 'http',
+        'hostnames': len(results),
+        'ok': len(results) - len(failing),
+        'statuses': statuses,
+        'latency-ms': {
+            'p50': _get_percentile(latencies, .5),
+            'p95': _get_percentile(latencies, .95),
+            'max': latencies[-1] if latencies else None,
+        },
+        'failing': {
+            result['hostname']: result.get('error') or result['status']
+            for result in failing[:SUMMARY_MAX_HOSTNAMES]
+        },
+        'min-tls-expiry-days': tls_expiry_days[0][0] if tls_expiry_days else None,
+        'tls-expiring': {
+            hostname: days for days, hostname in tls_expiry_days[:SUMMARY_MAX_HOSTNAMES]
+            if days < TLS_EXPIRY_WARNING_DAYS
+        },
+    }
+
+
+def probe_router(router_name, https=True, concurrency=PROBE_CONCURRENCY, timeout=PROBE_TIMEOUT_SECONDS, save=True):
+    """Probe all the router hostnames, returns (results, summary) and saves the summary on the router"""
+    from ckan_cloud_operator.routers import manager as routers_manager
+    targets = get_probe_targets(router_name)
+    logs.info(f'probing {len(targets)} hostnames of router {router_name}', concurrency=concurrency)
+    start_time = time.time()
+    results = probe(targets, https=https, concurrency=concurrency, timeout=timeout)
+    summary = get_summary(results, https=https)
+    summary['seconds'] = round(time.time() - start_time, 1)
+    if save:
+        router, spec, router_type, annotations, labels, router_type_config = routers_manager._init_router(
+            router_name, required=True
+        )
+        annotations.json_annotate(SUMMARY_ANNOTATION, summary)
+    return results, summary
+
+
+async def _probe_all(targets, https, concurrency, timeout, port):
+    semaphore = asyncio.Semaphore(concurrency)
+    ssl_context = ssl.create_default_context() if https else None
+
+    async def probe_target(hostname, route_name, address):
+        async with semaphore:
+            result = await _probe_hostname(hostname, address, port, ssl_context, timeout)
+        return {'hostname': hostname, 'route': route_name, **result}
+
+    return await asyncio.gather(*[probe_target(*target) for target in targets])
+
+
+async def _probe_hostname(hostname, address, port, ssl_context, timeout):
+    """Returns a dict with the response status, latency (until the status line), TLS expiry or the error"""
+    start_time = time.perf_counter()
+    writer = None
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(
+            address, port, ssl=ssl_context, server_hostname=hostname if ssl_context else None
+        ), timeout)
+        result = {}
+        if ssl_context:
+            result['tls_expiry_days'] = _get_tls_expiry_days(writer.get_extra_info('ssl_object').getpeercert())
+        writer.write(
+            f'HEAD / HTTP/1.1\r\nHost: {hostname}\r\nUser-Agent: {USER_AGENT}\r\nConnection: close\r\n\r\n'.encode()
+        )
+        status_line = await asyncio.wait_for(reader.readline(), timeout)
+        result['latency_ms'] = round((time.perf_counter() - start_time) * 1000)
+        try:
+            result['status'] = int(status_line.split()[1])
+        except (IndexError, ValueError):
+            result['error'] = f'invalid response: {status_line[:100]!r}'
+        return result
+    except asyncio.TimeoutError:
+        return {'error': 'timeout'}
+    except ssl.SSLError as e:
+        return {'error': f'tls: {getattr(e, "verify_message", None) or e.reason or e}'}
+    except OSError as e:
+        return {'error': e.strerror or str(e) or e.__class__.__name__}
+    finally:
+        if writer:
+            writer.close()
+
+
+def _get_tls_expiry_days(peer_cert):
+    if not peer_cert or not peer_cert.get('notAfter'):
+        return None
+    return int((ssl.cert_time_to_seconds(peer_cert['notAfter']) - time.time()) // 86400)
+
+
+def _is_ok(result):
+    return bool(result.get('status')) and result['status'] < 500 and not result.get('error')
+
+
+def _get_percentile(sorted_values, percentile):
+    if not sorted_values:
+        return None
+    return sorted_values[min(int(len(sorted_values) * percentile), len(sorted_values) - 1)]
@@ -5,7 +5,9 @@ from ckan_cloud_operator import kubectl
 from ckan_cloud_operator import logs
 from ckan_cloud_operator.routers.annotations import CkanRoutersAnnotations
 from ckan_cloud_operator.routers.traefik import manager as traefik_manager
+from ckan_cloud_operator.routers.sharded_traefik import manager as sharded_traefik_manager
 from ckan_cloud_operator.routers.routes import manager as routes_manager
+from ckan_cloud_operator.routers.routes import lookup as routes_lookup
 from ckan_cloud_operator.providers.routers.manager import get_env_id, get_default_root_domain, get_dns_provider
 
 
@@ -13,6 +15,10 @@ ROUTER_TYPES = {
     'traefik': {
         'default': True,
         'manager': traefik_manager
+    },
+    # routes are spread across multiple traefik deployments, see routers/sharded_traefik/manager.py
+    'sharded-traefik': {
+        'manager': sharded_traefik_manager
     }
 }
 
@@ -39,12 +45,13 @@ def create(router_name, router_spec):
 
 
 def get_traefik_router_spec(default_root_domain=None, cloudflare_email=None, cloudflare_api_key=None,
-                            wildcard_ssl_domain=None, external_domains=False, dns_provider=None):
+                            wildcard_ssl_domain=None, external_domains=False, dns_provider=None,
+                            hot_reload=False, replicas=None, shards=None, crd_provider=False):
     if not default_root_domain: default_root_domain = 'default'
     if not cloudflare_email: cloudflare_email = 'default'
     if not cloudflare_api_key: cloudflare_api_key = 'default'
     return {
-        'type': 'traefik',
+        'type': 'sharded-traefik' if shards else 'traefik',
         'default-root-domain': default_root_domain,
         # the cloudflare spec is not saved as part of the CkanCloudRouter spec
         # it is removed and saved as a secret by the traefik router manager
@@ -54,7 +61,12 @@ def get_traefik_router_spec(default_root_domain=None, cloudflare_email=None, clo
         },
         'wildcard-ssl-domain': wildcard_ssl_domain,
         'external-domains': bool(external_domains),
-        'dns-provider': dns_provider
+        'dns-provider': dns_provider,
+        # reload the dynamic config without restarting traefik, see routers/traefik/deployment.py
+        **({'hot-reload': True, 'replicas': replicas} if hot_reload else {}),
+        **({'shards': shards} if shards else {}),
+        # routes are written as IngressRoute objects, see routers/traefik/crd.py
+        **({'provider': 'kubernetes-crd'} if crd_provider else {})
     }
 
 
@@ -63,6 +75,17 @@ def update(router_name, wait_ready=False, dry_run=False):
     print(f'Updating CkanCloudRouter {router_name} (type={router_type}) (labels={labels})')
     routes = routes_manager.list(labels)
     router_type_config['manager'].update(router_name, wait_ready, spec, annotations, routes, dry_run=dry_run)
+    if not dry_run:
+        _update_routes_lookup(routes_lookup.sync_router, router_name, routes)
+
+
+def get_deployment_router_names(router_name):
+    """Returns the names of the traefik deployments of the router, sharded routers have a deployment per shard"""
+    router, spec, router_type, annotations, labels, router_type_config = _init_router(router_name, required=True)
+    if router_type == sharded_traefik_manager.ROUTER_TYPE:
+        return sharded_traefik_manager.get_shard_names(router_name, spec)
+    else:
+        return [router_name]
 
 
 def list(full=False, values_only=False, async_print=True):
@@ -169,6 +192,9 @@ def create_subdomain_route(router_name, route_spec, dry_run=False):
         labels['ckan-cloud/route-app-instance-id'] = spec['app-instance-id'] = route_spec['app-instance-id']
     route = kubectl.get_resource('stable.viderum.com/v1', 'CkanCloudRoute', route_name, labels, spec=spec)
     kubectl.apply(route, dry_run=dry_run)
+    conflicts = _update_routes_lookup(routes_lookup.add_route, route, dry_run=dry_run)
+    if conflicts:
+        logs.warning(f'route {route_name} hostnames are served by other routes', conflicts=conflicts)
 
 
 def install_crds():
@@ -183,6 +209,7 @@ def delete(router_name, router_type=None):
     else:
         router, spec, router_type, annotations, labels, router_type_config = _init_router(router_name)
     router_type_config['manager'].delete(router_name)
+    _update_routes_lookup(routes_lookup.remove_router, router_name)
 
 
 def get_datapusher_routes(datapusher_name, edit=False):
@@ -276,6 +303,15 @@ def get_cloudflare_rate_limits(root_domain):
     return cloudflare.get_zone_rate_limits(*routers_manager.get_cloudflare_credentials(), root_domain)
 
 
+def _update_routes_lookup(func, *args, **kwargs):
+    """The routes lookup is rebuilt from the routes on the next router update, so failing to update it is not fatal"""
+    try:
+        return func(*args, **kwargs)
+    except Exception as e:
+        logs.warning(f'failed to update the routes lookup: {e}')
+        return None
+
+
 def _get_labels(router_name, router_type):
     return {'ckan-cloud/router-name': router_name, 'ckan-cloud/router-type': router_type}
 
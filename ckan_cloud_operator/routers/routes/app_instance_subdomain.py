@@ -1,6 +1,7 @@
 from ckan_cloud_operator import kubectl
 
 from ckan_cloud_operator.providers.apps import manager as apps_manager
+from ckan_cloud_operator.providers.apps.deployment import manager as apps_deployment_manager
 
 
 from ckan_cloud_operator.routers.routes.backend_url_subdomain import (
@@ -13,6 +14,9 @@ from ckan_cloud_operator.routers.routes.backend_url_subdomain import (
 )
 
 
-def get_backend_url(route):
+def get_backend_url(route, index=None):
     name, spec = _init_route(route)
-    return apps_manager.get_backend_url(spec['app-instance-id'])
+    if index:
+        return apps_deployment_manager.get_backend_url(*index.get_app_instance(spec['app-instance-id']))
+    else:
+        return apps_manager.get_backend_url(spec['app-instance-id'])
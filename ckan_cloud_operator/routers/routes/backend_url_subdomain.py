@@ -1,4 +1,4 @@
-def get_backend_url(route):
+def get_backend_url(route, index=None):
     name, spec = _init_route(route)
     return spec['backend-url']
 
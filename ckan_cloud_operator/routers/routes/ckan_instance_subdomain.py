@@ -1,6 +1,7 @@
 from ckan_cloud_operator import kubectl
 
 from ckan_cloud_operator.providers.ckan.instance import manager as ckan_instance_manager
+from ckan_cloud_operator.providers.ckan.deployment import manager as ckan_deployment_manager
 
 
 from ckan_cloud_operator.routers.routes.backend_url_subdomain import (
@@ -13,6 +14,9 @@ from ckan_cloud_operator.routers.routes.backend_url_subdomain import (
 )
 
 
-def get_backend_url(route):
+def get_backend_url(route, index=None):
     name, spec = _init_route(route)
-    return ckan_instance_manager.get_backend_url(spec['ckan-instance-id'])
+    if index:
+        return ckan_deployment_manager.get_backend_url(*index.get_ckan_instance(spec['ckan-instance-id']))
+    else:
+        return ckan_instance_manager.get_backend_url(spec['ckan-instance-id'])
@@ -10,7 +10,7 @@ from ckan_cloud_operator.routers.routes.backend_url_subdomain import (
 )
 
 
-def get_backend_url(route):
+def get_backend_url(route, index=None):
     name, spec = _init_route(route)
     datapusher_name = spec['datapusher-name']
     return datapushers.get_service_url(datapusher_name)
@@ -11,10 +11,10 @@ from ckan_cloud_operator.routers.routes.backend_url_subdomain import (
 )
 
 
-def get_backend_url(route):
+def get_backend_url(route, index=None):
     name, spec = _init_route(route)
     deis_instance_id = spec['deis-instance-id']
-    target_port = _get_instance_target_port(deis_instance_id)
+    target_port = _get_instance_target_port(deis_instance_id, index=index)
     return f'http://{name}.{deis_instance_id}:{target_port}'
 
 
@@ -36,9 +36,12 @@ def pre_deployment_hook(route, labels):
         kubectl.apply(route_service)
 
 
-def _get_instance_target_port(instance_id):
+def _get_instance_target_port(instance_id, index=None):
     target_port = 5000
-    instance = kubectl.get(f'ckancloudckaninstance {instance_id}', required=False)
+    if index:
+        instance = index.get_deis_instance(instance_id)
+    else:
+        instance = kubectl.get(f'ckancloudckaninstance {instance_id}', required=False)
     if instance:
         _target_port = instance.get('spec', {}).get('routes', {}).get('target-port')
         if _target_port:
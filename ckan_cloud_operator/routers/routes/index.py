@@ -0,0 +1,65 @@
+"""In-memory index of the resources which routes backend urls are resolved from
+
+Resolving the backend url of a single route gets the instance / instance name custom resources
+(up to 3 kubectl calls per route), the index lists each kind once and resolves all routes from memory.
+"""
+from ckan_cloud_operator import kubectl
+from ckan_cloud_operator import logs
+from ckan_cloud_operator.crds import manager as crds_manager
+from ckan_cloud_operator.labels import manager as labels_manager
+from ckan_cloud_operator.providers.ckan.constants import INSTANCE_CRD_SINGULAR, INSTANCE_NAME_CRD_SINGULAR
+from ckan_cloud_operator.providers.apps.constants import APP_CRD_SINGULAR, APP_NAME_CRD_SINGULAR
+
+
+class RoutesIndex(object):
+
+    def __init__(self):
+        self._items = {}
+
+    def get_ckan_instance(self, instance_id_or_name):
+        """Returns (instance_id, instance_type, instance), same as ckan instance manager _get_instance_id_and_type"""
+        instance_id, instance = self._get_instance(INSTANCE_CRD_SINGULAR, INSTANCE_NAME_CRD_SINGULAR,
+                                                   instance_id_or_name)
+        if instance:
+            instance_type = instance['metadata']['labels'].get(f'{labels_manager.get_label_prefix()}/instance-type')
+        else:
+            instance_type = None
+        assert instance_id and instance_type and len(instance) > 2, \
+            f'Failed to find instance (instance_id_or_name={instance_id_or_name})'
+        return instance_id, instance_type, instance
+
+    def get_app_instance(self, instance_id_or_name):
+        """Returns (instance_id, instance), same as apps manager _get_instance"""
+        instance_id, instance = self._get_instance(APP_CRD_SINGULAR, APP_NAME_CRD_SINGULAR, instance_id_or_name)
+        assert instance_id and instance and len(instance) > 2, \
+            f'Failed to find instance (instance_id_or_name={instance_id_or_name})'
+        return instance_id, instance
+
+    def get_deis_instance(self, instance_id):
+        """Deis instances are ckan instance custom resources which are named by the instance id"""
+        items = self._get_items('ckancloudckaninstance', lambda: kubectl.get('ckancloudckaninstance', required=False))
+        return items.get(instance_id)
+
+    def _get_instance(self, singular, name_singular, instance_id_or_name):
+        instance = self._get(singular, instance_id_or_name)
+        if instance:
+            return instance_id_or_name, instance
+        instance_name = self._get(name_singular, instance_id_or_name)
+        if instance_name:
+            instance_id = instance_name['spec'].get('latest-instance-id')
+            return instance_id, self._get(singular, instance_id)
+        return None, None
+
+    def _get(self, singular, name):
+        if not name:
+            return None
+        items = self._get_items(singular, lambda: crds_manager.get(singular, required=False))
+        return items.get(crds_manager.get_resource_name(singular, name))
+
+    def _get_items(self, key, get_list):
+        if key not in self._items:
+            res = get_list()
+            items = res.get('items', []) if res else []
+            logs.debug(f'indexed {len(items)} {key} resources')
+            self._items[key] = {item['metadata']['name']: item for item in items}
+        return self._items[key]
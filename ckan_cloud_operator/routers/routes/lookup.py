@@ -0,0 +1,221 @@
+"""Persisted lookup index of routes by frontend hostname, route target and router
+
+Finding the route which serves a hostname otherwise requires listing and scanning all the CkanCloudRoute objects.
+The index is kept in a single configmap (gzipped, so it fits tens of thousands of routes) and loaded once per process,
+lookups and hostname conflict checks are then dict lookups. The configmap is saved with the resource version it was
+loaded with, so concurrent updates from other processes are not overwritten - on conflict it's reloaded and the update
+is applied again.
+
+The index is updated when routes are created (routers manager create_subdomain_route), when routers are deleted
+and when a router is updated - the routes of the updated router are synced, so routes which were created / deleted
+by other means are fixed on the next router update. `routers rebuild-route-index` rebuilds it from all the routes.
+"""
+import base64
+import gzip
+import json
+import subprocess
+
+from ckan_cloud_operator import kubectl
+from ckan_cloud_operator import logs
+from ckan_cloud_operator.drivers.kubectl import api as kubectl_api
+from ckan_cloud_operator.routers.routes import manager as routes_manager
+
+
+CONFIGMAP_NAME = 'routes-lookup'
+
+DATA_KEY = 'routes.json.gz'
+
+LABELS = {'ckan-cloud/routes-lookup': 'true'}
+
+# number of times an update is retried when the configmap was modified by another process
+MAX_CONFLICT_RETRIES = 5
+
+
+class RoutesLookup(object):
+
+    def __init__(self, routes=None, resource_version=None):
+        self.resource_version = resource_version
+        self.routes = {}
+        self.hostnames = {}
+        self.targets = {}
+        self.routers = {}
+        for route_name, entry in (routes or {}).items():
+            self.add(route_name, **entry)
+
+    def add(self, route_name, hostnames, router, target):
+        self.remove(route_name)
+        self.routes[route_name] = {'hostnames': sorted(hostnames), 'router': router, 'target': target}
+        for hostname in hostnames:
+            self.hostnames.setdefault(hostname, set()).add(route_name)
+        self.targets.setdefault(target, set()).add(route_name)
+        self.routers.setdefault(router, set()).add(route_name)
+
+    def remove(self, route_name):
+        entry = self.routes.pop(route_name, None)
+        if entry:
+            for key, index in [*[(hostname, self.hostnames) for hostname in entry['hostnames']],
+                               (entry['target'], self.targets), (entry['router'], self.routers)]:
+                index[key].discard(route_name)
+                if not index[key]:
+                    del index[key]
+
+    def sync_router(self, router_name, entries):
+        """Replace the routes of the router with the given dict of route name -> entry"""
+        for route_name in self.routers.get(router_name, set()) - set(entries):
+            self.remove(route_name)
+        for route_name, entry in entries.items():
+            self.add(route_name, **entry)
+
+    def get_hostname_routes(self, hostname):
+        return sorted(self.hostnames.get(hostname.lower(), ()))
+
+    def get_target_routes(self, target):
+        return sorted(self.targets.get(target, ()))
+
+    def get_router_routes(self, router_name):
+        return sorted(self.routers.get(router_name, ()))
+
+    def get_conflicts(self, hostname, route_name=None):
+        """Returns the other routes which serve the hostname"""
+        return [name for name in self.get_hostname_routes(hostname) if name != route_name]
+
+    def get_all_conflicts(self):
+        return {hostname: sorted(route_names) for hostname, route_names in self.hostnames.items()
+                if len(route_names) > 1}
+
+
+__LOOKUP = {}
+
+
+def get(reload=False):
+    """Returns the routes lookup, loaded from the configmap once per process"""
+    if reload or 'lookup' not in __LOOKUP:
+        configmap = kubectl.get(f'configmap {CONFIGMAP_NAME}', required=False)
+        data = ((configmap or {}).get('binaryData') or {}).get(DATA_KEY)
+        routes = json.loads(gzip.decompress(base64.b64decode(data))) if data else {}
+        resource_version = (configmap or {}).get('metadata', {}).get('resourceVersion')
+        __LOOKUP['lookup'] = RoutesLookup(routes, resource_version)
+        logs.debug('loaded routes lookup', routes=len(routes))
+    return __LOOKUP['lookup']
+
+
+def save(lookup):
+    """Save the lookup, fails with a conflict if the configmap was modified since the lookup was loaded"""
+    data = gzip.compress(json.dumps(lookup.routes, separators=(',', ':'), sort_keys=True).encode())
+    configmap = kubectl.get_resource('v1', 'ConfigMap', CONFIGMAP_NAME, LABELS)
+    if lookup.resource_version:
+        configmap['metadata']['resourceVersion'] = lookup.resource_version
+    configmap['binaryData'] = {DATA_KEY: base64.b64encode(data).decode()}
+    try:
+        result = kubectl.apply(configmap)
+    except Exception:
+        # the lookup has unsaved changes
+        __LOOKUP.pop('lookup', None)
+        raise
+    lookup.resource_version = (result or {}).get('metadata', {}).get('resourceVersion')
+    if lookup.resource_version:
+        __LOOKUP['lookup'] = lookup
+    else:
+        # saved using the kubectl subprocess, the new resource version is not known so it's reloaded on next get
+        __LOOKUP.pop('lookup', None)
+
+
+def update(update_func):
+    """Apply update_func to the lookup and save it, update_func returns False if the lookup was not modified
+
+    On conflict with a concurrent save the lookup is reloaded and update_func is applied again
+    """
+    for retry in range(MAX_CONFLICT_RETRIES + 1):
+        lookup = get(reload=retry > 0)
+        if update_func(lookup) is False:
+            return lookup
+        try:
+            save(lookup)
+            return lookup
+        except (kubectl_api.ApiError, subprocess.CalledProcessError) as e:
+            if retry < MAX_CONFLICT_RETRIES and kubectl.is_conflict(e):
+                logs.debug('conflict saving the routes lookup, reloading')
+            else:
+                raise
+
+
+def get_entry(route):
+    """Returns the lookup entry of a CkanCloudRoute"""
+    from ckan_cloud_operator.providers.routers.manager import get_default_root_domain
+    spec = route['spec']
+    hostname = routes_manager.get_frontend_hostname(route)
+    if hostname.endswith('.default'):
+        hostname = hostname[:-len('default')] + get_default_root_domain()
+    router_name = spec.get('router_name') or route['metadata'].get('labels', {}).get('ckan-cloud/router-name')
+    target_type = spec.get('route-target-type') or spec['type'].replace('-subdomain', '')
+    target_resource_id = spec.get('route-target-resource-id') or next((
+        spec[key] for key in ['ckan-instance-id', 'app-instance-id', 'deis-instance-id', 'datapusher-name',
+                              'backend-url'] if spec.get(key)
+    ), None)
+    return {
+        'hostnames': sorted({hostname.lower() for hostname in [hostname, *spec.get('extra-external-domains', [])]}),
+        'router': router_name,
+        'target': get_target(target_type, target_resource_id),
+    }
+
+
+def get_target(target_type, target_resource_id):
+    return f'{target_type}/{target_resource_id}'
+
+
+def add_route(route, dry_run=False):
+    """Add a created route to the lookup, returns the other routes which serve the same hostnames"""
+    route_name = routes_manager.get_name(route)
+    entry = get_entry(route)
+    conflicts = {}
+
+    def _add_route(lookup):
+        conflicts.clear()
+        for hostname in entry['hostnames']:
+            route_names = lookup.get_conflicts(hostname, route_name)
+            if route_names:
+                conflicts[hostname] = route_names
+        if lookup.routes.get(route_name) == entry or dry_run:
+            return False
+        lookup.add(route_name, **entry)
+
+    update(_add_route)
+    return conflicts
+
+
+def sync_router(router_name, routes):
+    """Sync the lookup with the current routes of the router, saves only if something changed"""
+    entries = {}
+    for route in routes:
+        try:
+            entries[routes_manager.get_name(route)] = get_entry(route)
+        except Exception as e:
+            logs.warning(f'failed to get routes lookup entry of route {routes_manager.get_name(route)}: {e}')
+
+    def _sync_router(lookup):
+        current_entries = {route_name: lookup.routes[route_name]
+                           for route_name in lookup.get_router_routes(router_name)}
+        if current_entries == entries:
+            return False
+        lookup.sync_router(router_name, entries)
+
+    update(_sync_router)
+
+
+def remove_router(router_name):
+
+    def _remove_router(lookup):
+        if not lookup.get_router_routes(router_name):
+            return False
+        lookup.sync_router(router_name, {})
+
+    update(_remove_router)
+
+
+def rebuild():
+    """Rebuild the lookup from all the CkanCloudRoute objects"""
+    lookup = RoutesLookup()
+    for route in (kubectl.get('CkanCloudRoute', required=False) or {}).get('items', []):
+        lookup.add(routes_manager.get_name(route), **get_entry(route))
+    save(lookup)
+    return lookup
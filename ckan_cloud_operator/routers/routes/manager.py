@@ -3,6 +3,7 @@ from ckan_cloud_operator.routers.routes import ckan_instance_subdomain
 from ckan_cloud_operator.routers.routes import app_instance_subdomain
 from ckan_cloud_operator.routers.routes import datapusher_subdomain
 from ckan_cloud_operator.routers.routes import backend_url_subdomain
+from ckan_cloud_operator.routers.routes.index import RoutesIndex
 from ckan_cloud_operator import kubectl
 from ckan_cloud_operator import logs
 
@@ -40,8 +41,14 @@ def get_name(route):
     return route['metadata']['name']
 
 
-def get_backend_url(route):
-    return get_module(route).get_backend_url(route)
+def get_backend_url(route, index=None):
+    """Returns the route backend url, index is a RoutesIndex to resolve from, see get_index"""
+    return get_module(route).get_backend_url(route, index=index)
+
+
+def get_index():
+    """Returns an index which resolves the backend urls of many routes without kubectl calls per route"""
+    return RoutesIndex()
 
 
 def get_frontend_hostname(route):
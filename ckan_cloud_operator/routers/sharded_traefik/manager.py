@@ -0,0 +1,121 @@
+"""Router which spreads its routes across multiple traefik deployments (shards)
+
+Routes are assigned to shards by consistent hashing of the frontend hostname (see ring.py). Each shard is
+a regular traefik deployment named after the shard (router-traefik-<router>-shard-<n>) with its own
+configmaps and load balancer, so the config size and parse time are bounded by the number of routes per shard.
+
+A shard is applied only if its own config changed (see traefik deployment update), so a route change
+only reloads the shard the route is assigned to. When the number of shards changes, shards which receive
+routes are updated first (which also points the routes DNS to them), then the shards which lost routes,
+and finally the resources of removed shards are deleted.
+"""
+import re
+
+from ckan_cloud_operator import kubectl
+from ckan_cloud_operator import logs
+from ckan_cloud_operator.routers.routes import manager as routes_manager
+from ckan_cloud_operator.routers.traefik import manager as traefik_manager
+from ckan_cloud_operator.routers.traefik import deployment as traefik_deployment
+from ckan_cloud_operator.routers.traefik import crd as traefik_crd
+from ckan_cloud_operator.routers.sharded_traefik.ring import HashRing
+
+
+ROUTER_TYPE = 'sharded-traefik'
+
+DEFAULT_SHARDS = 2
+
+
+def create(router):
+    router['spec']['shards'] = int(router['spec'].get('shards') or DEFAULT_SHARDS)
+    assert router['spec']['shards'] > 0, f'invalid sharded traefik router spec: {router["spec"]}'
+    return traefik_manager.create(router)
+
+
+def delete(router_name):
+    for shard_name in _get_existing_shard_names(router_name):
+        _delete_shard(shard_name)
+    traefik_manager.delete(router_name)
+
+
+def get_shard_names(router_name, spec):
+    return [f'{router_name}-shard-{i}' for i in range(int(spec.get('shards') or DEFAULT_SHARDS))]
+
+
+def get_routes_shards(router_name, spec, routes):
+    """Returns a dict of shard name -> list of routes assigned to the shard"""
+    shard_names = get_shard_names(router_name, spec)
+    ring = HashRing(shard_names)
+    shards = {shard_name: [] for shard_name in shard_names}
+    for route in routes:
+        shards[ring.get_shard(routes_manager.get_frontend_hostname(route))].append(route)
+    return shards
+
+
+def get_dns_data(router_name, router, failfast=False):
+    return {
+        shard_name: traefik_deployment.get_dns_data(shard_name, router, failfast=failfast)
+        for shard_name in get_shard_names(router_name, router['spec'])
+    }
+
+
+def get(router_name, attr='deployment', router=None, failfast=False):
+    if not router:
+        router = kubectl.get(f'CkanCloudRouter {router_name}')
+    deployment_data = lambda: _get_deployment_data(get_shard_names(router_name, router['spec']))
+    dns_data = lambda: get_dns_data(router_name, router, failfast=failfast)
+    if attr == 'deployment':
+        return deployment_data()
+    elif attr == 'dns':
+        return dns_data()
+    else:
+        return {'deployment': deployment_data(), 'dns': dns_data()}
+
+
+def update(router_name, wait_ready, spec, annotations, routes, dry_run=False):
+    logs.debug(f'updating sharded traefik router: {router_name}')
+    routes_shards = get_routes_shards(router_name, spec, routes)
+    removed_shard_names = [shard_name for shard_name in _get_existing_shard_names(router_name)
+                           if shard_name not in routes_shards]
+    previous_route_shards = {
+        route_name: shard_name
+        for shard_name in [*routes_shards, *removed_shard_names]
+        for route_name in traefik_deployment.get_route_names(shard_name, spec)
+    }
+    receiving_shard_names = {
+        shard_name for shard_name, shard_routes in routes_shards.items()
+        if any(previous_route_shards.get(routes_manager.get_name(route), shard_name) != shard_name
+               for route in shard_routes)
+    }
+    for shard_name in sorted(routes_shards, key=lambda shard_name: shard_name not in receiving_shard_names):
+        logs.info(f'updating router shard {shard_name}', routes=len(routes_shards[shard_name]),
+                  receiving_routes=shard_name in receiving_shard_names)
+        traefik_deployment.update(shard_name, wait_ready, spec, annotations, routes_shards[shard_name],
+                                  dry_run=dry_run)
+    if not dry_run:
+        for shard_name in removed_shard_names:
+            logs.info(f'deleting removed router shard {shard_name}')
+            _delete_shard(shard_name)
+
+
+def _get_deployment_data(shard_names):
+    shards = {shard_name: traefik_deployment.get(shard_name) for shard_name in shard_names}
+    return {
+        'ready': all(shard.get('ready') for shard in shards.values()),
+        'shards': shards
+    }
+
+
+def _get_existing_shard_names(router_name):
+    deployments = kubectl.get(f'deployment -l ckan-cloud/router-type={ROUTER_TYPE}', required=False)
+    shard_names = []
+    for deployment in (deployments or {}).get('items', []):
+        match = re.match(f'^router-traefik-({re.escape(router_name)}-shard-[0-9]+)$', deployment['metadata']['name'])
+        if match:
+            shard_names.append(match.group(1))
+    return shard_names
+
+
+def _delete_shard(shard_name):
+    for kind in ['deployment', 'service', 'configmap', 'secret', 'PersistentVolumeClaim']:
+        kubectl.check_call(f'delete --ignore-not-found -l ckan-cloud/router-name={shard_name} {kind}')
+    traefik_crd.delete(shard_name)
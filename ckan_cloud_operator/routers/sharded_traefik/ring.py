@@ -0,0 +1,30 @@
+"""Consistent hash ring which assigns route frontend hostnames to router shards
+
+Each shard is placed on the ring at VIRTUAL_NODES points, so when a shard is added only ~1/N of the
+hostnames move to it and the other hostnames stay on the same shard.
+"""
+import bisect
+import hashlib
+
+
+VIRTUAL_NODES = 128
+
+
+class HashRing(object):
+
+    def __init__(self, shards, virtual_nodes=VIRTUAL_NODES):
+        assert shards, 'hash ring requires at least one shard'
+        self.shards = list(shards)
+        self._points = sorted(
+            (_hash(f'{shard}#{i}'), shard)
+            for shard in self.shards for i in range(virtual_nodes)
+        )
+        self._keys = [point for point, _ in self._points]
+
+    def get_shard(self, key):
+        i = bisect.bisect(self._keys, _hash(key)) % len(self._keys)
+        return self._points[i][1]
+
+
+def _hash(value):
+    return int(hashlib.md5(value.encode()).hexdigest()[:16], 16)
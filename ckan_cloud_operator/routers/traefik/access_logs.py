@@ -0,0 +1,234 @@
+"""Streaming aggregation of the traefik JSON access logs per route
+
+Lines are read from the router pods logs (kubectl logs -f) or from (rotated, optionally gzipped) log files.
+Each route has a fixed-size row of counters (see COLUMNS) in a single flat array, so aggregating a line
+is a few integer increments without per-line allocations, and the parsed user agents are kept in an LRU cache.
+
+Every flush_seconds the counters are written to a gzipped columnar file in the output directory and reset,
+get_top_routes sums the files to find the routes with most requests / slowest responses.
+
+Traefik logs the route name as the service name of the file provider (<route name>@file),
+for other providers the request host is used.
+"""
+import array
+import bisect
+import collections
+import datetime
+import functools
+import glob
+import gzip
+import json
+import os
+import subprocess
+import time
+
+import httpagentparser
+
+from ckan_cloud_operator import logs
+from ckan_cloud_operator.drivers.kubectl import api as kubectl_api
+
+
+# max number of distinct user agent strings to keep parsed in memory
+USER_AGENT_CACHE_SIZE = int(os.environ.get('CKAN_CLOUD_OPERATOR_ACCESS_LOGS_UA_CACHE_SIZE', '10000'))
+
+# seconds between writes of the aggregated counters
+FLUSH_SECONDS = int(os.environ.get('CKAN_CLOUD_OPERATOR_ACCESS_LOGS_FLUSH_SECONDS', '60'))
+
+# max number of router pods to follow the logs of concurrently
+MAX_LOG_REQUESTS = int(os.environ.get('CKAN_CLOUD_OPERATOR_ACCESS_LOGS_MAX_LOG_REQUESTS', '20'))
+
+# upper bounds of the latency histogram buckets, requests slower than the last bound go to an additional bucket
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+COLUMNS = (
+    'requests', 'status_1xx', 'status_2xx', 'status_3xx', 'status_4xx', 'status_5xx', 'bot_requests',
+    'duration_us', 'bytes',
+    *[f'latency_le_{ms}ms' for ms in LATENCY_BUCKETS_MS], f'latency_gt_{LATENCY_BUCKETS_MS[-1]}ms',
+)
+
+FILE_PREFIX = 'access-logs-'
+FILE_SUFFIX = '.json.gz'
+
+_LATENCY_BUCKETS_NS = [ms * 1000000 for ms in LATENCY_BUCKETS_MS]
+_STATUS_COLUMN = COLUMNS.index('status_1xx') - 1
+_BOT_COLUMN = COLUMNS.index('bot_requests')
+_DURATION_COLUMN = COLUMNS.index('duration_us')
+_BYTES_COLUMN = COLUMNS.index('bytes')
+_LATENCY_COLUMN = COLUMNS.index(f'latency_le_{LATENCY_BUCKETS_MS[0]}ms')
+
+
+class Aggregator(object):
+
+    def __init__(self):
+        self.routes = {}
+        self.counters = array.array('Q')
+        self.user_agents = collections.Counter()
+        self.start_time = time.time()
+        self.skipped_lines = 0
+
+    def add_line(self, line):
+        """Aggregate a single log line, lines which are not JSON access logs are skipped"""
+        line = line.strip()
+        if not line.startswith(b'{'):
+            self.skipped_lines += 1
+            return
+        try:
+            entry = kubectl_api.loads(line)
+        except ValueError:
+            self.skipped_lines += 1
+            return
+        if 'DownstreamStatus' not in entry:
+            self.skipped_lines += 1
+            return
+        self.add(entry)
+
+    def add(self, entry):
+        route = _get_route_key(entry)
+        row = self.routes.get(route)
+        if row is None:
+            row = self.routes[route] = len(self.counters)
+            self.counters.extend([0] * len(COLUMNS))
+        counters = self.counters
+        counters[row] += 1
+        status = int(entry.get('DownstreamStatus') or 0) // 100
+        if 1 <= status <= 5:
+            counters[row + _STATUS_COLUMN + status] += 1
+        duration_ns = int(entry.get('Duration') or 0)
+        counters[row + _DURATION_COLUMN] += duration_ns // 1000
+        counters[row + _BYTES_COLUMN] += int(entry.get('DownstreamContentSize') or 0)
+        counters[row + _LATENCY_COLUMN + bisect.bisect_left(_LATENCY_BUCKETS_NS, duration_ns)] += 1
+        user_agent = entry.get('request_User-Agent')
+        if user_agent:
+            os_name, browser_name, is_bot = parse_user_agent(user_agent)
+            if is_bot:
+                counters[row + _BOT_COLUMN] += 1
+            self.user_agents[f'{os_name or "unknown"}/{browser_name or "unknown"}'] += 1
+
+    def get_columns(self):
+        num_columns = len(COLUMNS)
+        return {
+            column: self.counters[i::num_columns].tolist()
+            for i, column in enumerate(COLUMNS)
+        }
+
+    def flush(self, output_dir):
+        """Write the counters to a new columnar file in output_dir and reset them, returns the file name"""
+        end_time = time.time()
+        data = {
+            'start': self.start_time,
+            'end': end_time,
+            'routes': list(self.routes),
+            'columns': self.get_columns(),
+            'user-agents': dict(self.user_agents),
+        }
+        os.makedirs(output_dir, exist_ok=True)
+        timestamp = datetime.datetime.utcfromtimestamp(end_time).strftime('%Y%m%dT%H%M%S%f')
+        file_name = os.path.join(output_dir, f'{FILE_PREFIX}{timestamp}{FILE_SUFFIX}')
+        with gzip.open(file_name + '.tmp', 'wt') as f:
+            json.dump(data, f, separators=(',', ':'))
+        os.rename(file_name + '.tmp', file_name)
+        logs.info(f'flushed access logs of {len(self.routes)} routes', file_name=file_name,
+                  requests=sum(data['columns']['requests']), skipped_lines=self.skipped_lines,
+                  user_agent_cache=parse_user_agent.cache_info())
+        self.routes, self.counters, self.user_agents = {}, array.array('Q'), collections.Counter()
+        self.start_time, self.skipped_lines = end_time, 0
+        return file_name
+
+
+@functools.lru_cache(maxsize=USER_AGENT_CACHE_SIZE)
+def parse_user_agent(user_agent):
+    """Returns (os name, browser name, is bot), the same user agents repeat in most requests so they are cached"""
+    try:
+        detected = httpagentparser.detect(user_agent)
+    except Exception:
+        return None, None, False
+    return detected.get('os', {}).get('name'), detected.get('browser', {}).get('name'), bool(detected.get('bot'))
+
+
+def aggregate(lines, output_dir, flush_seconds=FLUSH_SECONDS):
+    """Aggregate the given log lines (bytes), flushing to output_dir every flush_seconds and at the end"""
+    aggregator = Aggregator()
+    for line in lines:
+        aggregator.add_line(line)
+        if time.time() - aggregator.start_time >= flush_seconds:
+            aggregator.flush(output_dir)
+    if aggregator.routes:
+        aggregator.flush(output_dir)
+
+
+def iter_pod_log_lines(router_names, follow=True, since=None):
+    """Yield the log lines of the traefik containers of the given routers pods"""
+    label_selector = 'ckan-cloud/router-name in ({})'.format(','.join(router_names))
+    cmd = ['kubectl', '-n', 'ckan-cloud', 'logs', '-l', label_selector, '-c', 'traefik',
+           f'--max-log-requests={MAX_LOG_REQUESTS}']
+    # with a label selector kubectl returns only the last 10 lines of each pod by default
+    cmd += ['-f', '--tail=0'] if follow else ['--tail=-1']
+    if since:
+        cmd += [f'--since={since}']
+    logs.info(' '.join(cmd))
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+    try:
+        yield from process.stdout
+    finally:
+        process.kill()
+        process.wait()
+
+
+def iter_file_lines(file_patterns):
+    """Yield the lines of the files matching the given glob patterns, oldest file first so rotated files are in order"""
+    file_names = sorted({
+        file_name for pattern in file_patterns for file_name in glob.glob(pattern)
+    }, key=os.path.getmtime)
+    for file_name in file_names:
+        logs.info(f'reading access logs file: {file_name}')
+        with (gzip.open(file_name, 'rb') if file_name.endswith('.gz') else open(file_name, 'rb')) as f:
+            yield from f
+
+
+def get_top_routes(output_dir, limit=20, sort_by='requests', since_seconds=None):
+    """Sum the flushed counters per route and return the top routes
+
+    Each route has the summed columns and requests_per_second, avg_ms and p95_ms (the latency bucket upper bound),
+    sort_by is one of the numeric columns (not p95_ms).
+    """
+    min_end_time = time.time() - since_seconds if since_seconds else None
+    totals, start_time, end_time = {}, None, None
+    for file_name in sorted(glob.glob(os.path.join(output_dir, f'{FILE_PREFIX}*{FILE_SUFFIX}'))):
+        with gzip.open(file_name, 'rt') as f:
+            data = json.load(f)
+        if min_end_time and data['end'] < min_end_time:
+            continue
+        start_time = data['start'] if start_time is None else min(start_time, data['start'])
+        end_time = data['end'] if end_time is None else max(end_time, data['end'])
+        for column, values in data['columns'].items():
+            for route, value in zip(data['routes'], values):
+                route_totals = totals.setdefault(route, dict.fromkeys(COLUMNS, 0))
+                route_totals[column] = route_totals.get(column, 0) + value
+    seconds = max((end_time or 0) - (start_time or 0), 1)
+    routes = [_get_route_stats(route, route_totals, seconds) for route, route_totals in totals.items()]
+    return sorted(routes, key=lambda route: route[sort_by], reverse=True)[:limit]
+
+
+def _get_route_stats(route, route_totals, seconds):
+    requests = route_totals['requests']
+    latency_columns = COLUMNS[_LATENCY_COLUMN:]
+    p95_ms, cumulative_requests = None, 0
+    for ms, column in zip((*LATENCY_BUCKETS_MS, f'>{LATENCY_BUCKETS_MS[-1]}'), latency_columns):
+        cumulative_requests += route_totals[column]
+        if requests and cumulative_requests >= requests * .95:
+            p95_ms = ms
+            break
+    return {
+        'route': route,
+        'requests_per_second': requests / seconds,
+        'avg_ms': route_totals['duration_us'] / requests / 1000 if requests else 0,
+        'p95_ms': p95_ms,
+        **{column: route_totals[column] for column in COLUMNS if column not in latency_columns},
+    }
+
+
+def _get_route_key(entry):
+    service_name = entry.get('ServiceName') or ''
+    if service_name.endswith('@file'):
+        return service_name[:-len('@file')]
+    return entry.get('RequestHost') or service_name or 'unknown'
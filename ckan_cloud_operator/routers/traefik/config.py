@@ -1,3 +1,5 @@
+import json
+import hashlib
 import traceback
 
 from ckan_cloud_operator import logs
@@ -106,11 +108,13 @@ def _add_letsencrypt(dns_provider, static_config, letsencrypt_cloudflare_email,
         }
 
 
-def _add_route(dynamic_config, domains, route, enable_ssl_redirect, external_domains, wildcard_ssl_domain):
+def _add_route(dynamic_config, domains, route, enable_ssl_redirect, external_domains, wildcard_ssl_domain, index=None,
+               backend_url=None):
     route_name = routes_manager.get_name(route)
     logs.info(f'adding route to traefik v2 dynamic config: {route_name}')
     logs.debug_verbose(dynamic_config=dynamic_config, domains=domains, route=route, enable_ssl_redirect=enable_ssl_redirect)
-    backend_url = routes_manager.get_backend_url(route)
+    if backend_url is None:
+        backend_url = routes_manager.get_backend_url(route, index=index)
     frontend_hostname = routes_manager.get_frontend_hostname(route)
     print(f'F/B = {frontend_hostname} {backend_url}')
     root_domain, sub_domain = routes_manager.get_domain_parts(route)
@@ -204,16 +208,31 @@ def _add_route(dynamic_config, domains, route, enable_ssl_redirect, external_dom
             }
 
 
-def get_static(routes, letsencrypt_cloudflare_email, enable_access_log=False, wildcard_ssl_domain=None, external_domains=False, dns_provider=None, acme_email=None, dynamic_config_file=None):
+def get_static(routes, letsencrypt_cloudflare_email, enable_access_log=False, wildcard_ssl_domain=None, external_domains=False, dns_provider=None, acme_email=None, dynamic_config_file=None, dynamic_config_dir=None, kubernetes_crd_label_selector=None):
+    """Get the static config, the dynamic config is loaded once from dynamic_config_file or watched in dynamic_config_dir
+
+    dynamic_config_dir should be a configmap volume, kubelet updates it by atomically swapping the directory,
+    so traefik never reads a partially written dynamic config.
+
+    With kubernetes_crd_label_selector the routes are watched from IngressRoute objects instead, see traefik/crd.py
+    """
     if not dns_provider:
         dns_provider = 'cloudflare'
-    assert dynamic_config_file, "missing dynamic_config_file"
+    assert dynamic_config_file or dynamic_config_dir or kubernetes_crd_label_selector, "missing dynamic_config_file"
     logs.info('Generating traefik v2 static configuration', routes_len=len(routes) if routes else 0,
               letsencrypt_cloudflare_email=letsencrypt_cloudflare_email, enable_access_log=enable_access_log,
               wildcard_ssl_domain=wildcard_ssl_domain, external_domains=external_domains)
     static_config = _get_base_static_config(
         providers={
+            # all namespaces are watched, the IngressRoutes point at services in the instance namespaces
+            "kubernetesCRD": {
+                "labelSelector": kubernetes_crd_label_selector
+            }
+        } if kubernetes_crd_label_selector else {
             "file": {
+                "watch": True,
+                "directory": dynamic_config_dir
+            } if dynamic_config_dir else {
                 "watch": False,
                 "filename": dynamic_config_file
             }
@@ -223,7 +242,14 @@ def get_static(routes, letsencrypt_cloudflare_email, enable_access_log=False, wi
                 'accessLog': {
                     "format": "json",
                     "fields": {
-                        'defaultMode': "keep"
+                        'defaultMode': "keep",
+                        # used by the access logs aggregation, see traefik/access_logs.py
+                        'headers': {
+                            'defaultMode': 'drop',
+                            'names': {
+                                'User-Agent': 'keep'
+                            }
+                        }
                     }
                 },
             }
@@ -242,6 +268,22 @@ def get_static(routes, letsencrypt_cloudflare_email, enable_access_log=False, wi
 
 
 def get_dynamic(routes, letsencrypt_cloudflare_email, wildcard_ssl_domain=None, external_domains=False, dns_provider=None, force=False):
+    dynamic_config, _, _ = get_dynamic_incremental(
+        routes, letsencrypt_cloudflare_email, wildcard_ssl_domain=wildcard_ssl_domain,
+        external_domains=external_domains, dns_provider=dns_provider, force=force
+    )
+    return dynamic_config
+
+
+def get_dynamic_incremental(routes, letsencrypt_cloudflare_email, wildcard_ssl_domain=None, external_domains=False,
+                            dns_provider=None, force=False, previous_dynamic_config=None, previous_routes_hashes=None):
+    """Get the dynamic config, copying unchanged routes from the previous dynamic config
+
+    previous_routes_hashes is the routes_hashes returned from the previous call, a route is regenerated
+    only if the hash of its spec, backend url and the relevant router settings changed.
+
+    Returns (dynamic_config, routes_hashes, summary), summary lists the added, changed and removed route names.
+    """
     if not dns_provider:
         dns_provider = 'cloudflare'
     logs.info('Generating traefik v2 dynamic configuration', routes_len=len(routes) if routes else 0,
@@ -261,21 +303,38 @@ def get_dynamic(routes, letsencrypt_cloudflare_email, wildcard_ssl_domain=None,
         }
     }
     domains = {}
-    if dns_provider == 'cloudflare' and letsencrypt_cloudflare_email:
-        enable_ssl_redirect = True
-    elif dns_provider == 'route53':
-        enable_ssl_redirect = True
-    elif dns_provider == 'azure':
-        enable_ssl_redirect = True
-    else:
-        enable_ssl_redirect = False
+    enable_ssl_redirect = get_enable_ssl_redirect(dns_provider, letsencrypt_cloudflare_email)
     logs.info(enable_ssl_redirect=enable_ssl_redirect)
     logs.info('Adding routes')
+    if not previous_dynamic_config or not previous_routes_hashes:
+        previous_dynamic_config, previous_routes_hashes = {'http': {}}, {}
+    routes_hashes = {}
+    summary = {'added': [], 'changed': [], 'removed': [], 'unchanged': 0}
     i = 0
     errors = 0
+    index = routes_manager.get_index()
     for route in routes:
         try:
-            _add_route(dynamic_config, domains, route, enable_ssl_redirect, external_domains, wildcard_ssl_domain)
+            route_name = routes_manager.get_name(route)
+            backend_url = routes_manager.get_backend_url(route, index=index)
+            route_hash = _get_route_hash(route, backend_url, enable_ssl_redirect, external_domains, wildcard_ssl_domain)
+            previous_route_hash = previous_routes_hashes.get(route_name)
+            if not _copy_route(previous_dynamic_config, dynamic_config, route_hash, previous_route_hash):
+                route_config = {'http': {'routers': {}, 'services': {}}}
+                _add_route(route_config, domains, route, enable_ssl_redirect, external_domains, wildcard_ssl_domain,
+                           index=index, backend_url=backend_url)
+                for key in ['routers', 'services']:
+                    dynamic_config['http'][key].update(route_config['http'][key])
+                route_hash = {
+                    'hash': route_hash,
+                    'routers': sorted(route_config['http']['routers']),
+                    'services': sorted(route_config['http']['services']),
+                }
+                summary['changed' if previous_route_hash else 'added'].append(route_name)
+            else:
+                route_hash = previous_route_hash
+                summary['unchanged'] += 1
+            routes_hashes[route_name] = route_hash
             i += 1
         except Exception as e:
             if force:
@@ -284,7 +343,46 @@ def get_dynamic(routes, letsencrypt_cloudflare_email, wildcard_ssl_domain=None,
                 errors += 1
             else:
                 raise
-    logs.info(f'Added {i} routes')
+    summary['removed'] = sorted(set(previous_routes_hashes) - set(routes_hashes))
+    logs.info(f'Added {i} routes', added=len(summary['added']), changed=len(summary['changed']),
+              removed=len(summary['removed']), unchanged=summary['unchanged'])
     if errors > 0:
         logs.warning(f'Encountered {errors} errors')
-    return dynamic_config
+    return dynamic_config, routes_hashes, summary
+
+
+def get_enable_ssl_redirect(dns_provider, letsencrypt_cloudflare_email):
+    if dns_provider == 'cloudflare' and letsencrypt_cloudflare_email:
+        return True
+    elif dns_provider == 'route53':
+        return True
+    elif dns_provider == 'azure':
+        return True
+    else:
+        return False
+
+
+def _get_route_hash(route, backend_url, enable_ssl_redirect, external_domains, wildcard_ssl_domain):
+    return hashlib.sha256(json.dumps({
+        'name': routes_manager.get_name(route),
+        'spec': route['spec'],
+        'backend-url': backend_url,
+        'enable-ssl-redirect': enable_ssl_redirect,
+        'external-domains': external_domains,
+        'wildcard-ssl-domain': wildcard_ssl_domain,
+    }, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def _copy_route(previous_dynamic_config, dynamic_config, route_hash, previous_route_hash):
+    """Copy the route routers and services from the previous dynamic config if the route did not change"""
+    if not previous_route_hash or previous_route_hash.get('hash') != route_hash:
+        return False
+    configs = {}
+    for key in ['routers', 'services']:
+        previous = previous_dynamic_config['http'].get(key) or {}
+        if any(name not in previous for name in previous_route_hash.get(key, [])):
+            return False
+        configs[key] = {name: previous[name] for name in previous_route_hash.get(key, [])}
+    for key, config in configs.items():
+        dynamic_config['http'][key].update(config)
+    return True
@@ -0,0 +1,282 @@
+"""Traefik kubernetes CRD provider mode
+
+Instead of generating the dynamic config file, each CkanCloudRoute is written as traefik IngressRoute objects
+(labeled with the router name) which traefik watches natively. A route change is a write of the route's
+IngressRoute objects, the configmap and deployment are not modified so traefik is not restarted.
+
+Each IngressRoute has a hash annotation of the route it was generated from, so an update lists the router
+IngressRoutes once and applies only the changed routes, and deletes IngressRoutes of removed routes.
+"""
+import json
+import hashlib
+from urllib.parse import urlparse
+
+from ruamel import yaml
+
+from ckan_cloud_operator import kubectl
+from ckan_cloud_operator import logs
+from ckan_cloud_operator.drivers.kubectl import rbac as kubectl_rbac_driver
+from ckan_cloud_operator.routers.routes import manager as routes_manager
+
+
+API_VERSION = 'traefik.containo.us/v1alpha1'
+
+# the custom resources which are watched by the traefik kubernetes CRD provider: (plural, singular, kind)
+CRDS = [
+    ('ingressroutes', 'ingressroute', 'IngressRoute'),
+    ('ingressroutetcps', 'ingressroutetcp', 'IngressRouteTCP'),
+    ('ingressrouteudps', 'ingressrouteudp', 'IngressRouteUDP'),
+    ('middlewares', 'middleware', 'Middleware'),
+    ('tlsoptions', 'tlsoption', 'TLSOption'),
+    ('tlsstores', 'tlsstore', 'TLSStore'),
+    ('traefikservices', 'traefikservice', 'TraefikService'),
+]
+
+ROUTE_HASH_ANNOTATION = 'ckan-cloud/route-hash'
+
+CLUSTER_ROLE_NAME = 'ckan-cloud-router-traefik-crd'
+
+
+def install_crds():
+    """Ensures installation of the traefik custom resource definitions on the cluster"""
+    for plural, singular, kind in CRDS:
+        if kubectl.get(f'crd {plural}.traefik.containo.us', required=False):
+            print(f'{kind} custom resource definitions are up-to-date')
+            continue
+        print(f'Creating traefik {kind} custom resource definition')
+        kubectl.apply({
+            'apiVersion': 'apiextensions.k8s.io/v1beta1',
+            'kind': 'CustomResourceDefinition',
+            'metadata': {'name': f'{plural}.traefik.containo.us'},
+            'spec': {
+                'group': 'traefik.containo.us',
+                'version': 'v1alpha1',
+                'scope': 'Namespaced',
+                'names': {'plural': plural, 'singular': singular, 'kind': kind}
+            }
+        })
+
+
+def update_service_account(service_account_name, labels):
+    """Service account which allows traefik to watch the IngressRoutes and the services they point to"""
+    kubectl_rbac_driver.update_service_account(service_account_name, labels)
+    kubectl_rbac_driver.update_cluster_role(CLUSTER_ROLE_NAME, [
+        {'apiGroups': [''], 'resources': ['services', 'endpoints', 'secrets'], 'verbs': ['get', 'list', 'watch']},
+        {'apiGroups': ['traefik.containo.us'], 'resources': [plural for plural, _, _ in CRDS],
+         'verbs': ['get', 'list', 'watch']},
+    ], {})
+    kubectl_rbac_driver.update_cluster_role_binding(
+        service_account_name,
+        {'kind': 'ServiceAccount', 'name': service_account_name, 'namespace': 'ckan-cloud'},
+        CLUSTER_ROLE_NAME, labels
+    )
+
+
+def get_route_names(router_name):
+    """Returns the names of the routes which have IngressRoutes for the router"""
+    return sorted({
+        resource['metadata'].get('labels', {}).get('ckan-cloud/route-name')
+        for resource in _list('IngressRoute', router_name)
+    } - {None})
+
+
+def get_label_selector(router_name):
+    return f'ckan-cloud/router-name={router_name}'
+
+
+def get_route_resources(route, router_name, labels, enable_ssl_redirect, wildcard_ssl_domain, backend_url):
+    """Returns the IngressRoute objects and ExternalName service (if needed) for the route
+
+    Mirrors the routers and services generated for the file provider by traefik config _add_route
+    """
+    route_name = routes_manager.get_name(route)
+    if not backend_url:
+        return []
+    frontend_hostname = routes_manager.get_frontend_hostname(route)
+    root_domain, sub_domain = routes_manager.get_domain_parts(route)
+    assert not route['spec'].get('extra-no-dns-subdomains'), 'extra-no-dns-subdomains not supported for traefik v2'
+    assert not route['spec'].get('httpauth-secret'), 'httpauth-secret not supported for traefik v2'
+    resources = []
+    service = _get_service(route_name, labels, backend_url, resources)
+    if root_domain == wildcard_ssl_domain:
+        domain_confs = [{'main': f'*.{root_domain}'}]
+    else:
+        domain_confs = [{'main': root_domain, 'sans': [f'{sub_domain}.{root_domain}']}]
+    hosts = [(frontend_hostname, '', 'myresolver', domain_confs)] + [
+        (domain, f'-eed{i}', 'tlsresolver', [{'main': domain}])
+        for i, domain in enumerate(route['spec'].get('extra-external-domains', []))
+    ]
+    for host, suffix, cert_resolver, domains in hosts:
+        resources.append(_get_ingress_route(
+            f'{route_name}-http{suffix}', labels, host, 'http', service,
+            middlewares=[{'name': get_ssl_redirect_middleware_name(router_name)}] if enable_ssl_redirect else []
+        ))
+        resources.append(_get_ingress_route(
+            f'{route_name}-https{suffix}', labels, host, 'https', service,
+            tls={'certResolver': cert_resolver, 'domains': domains}
+        ))
+    route_hash = hashlib.sha256(json.dumps(resources, sort_keys=True).encode()).hexdigest()[:16]
+    for resource in resources:
+        resource['metadata']['annotations'][ROUTE_HASH_ANNOTATION] = route_hash
+        resource['metadata']['labels']['ckan-cloud/route-name'] = route_name
+    return resources
+
+
+def get_ssl_redirect_middleware_name(router_name):
+    return f'{router_name}-ssl-redirect'
+
+
+def get_ssl_redirect_middleware(router_name, labels):
+    middleware = _get_resource('Middleware', get_ssl_redirect_middleware_name(router_name), labels)
+    middleware['spec'] = {'redirectScheme': {'scheme': 'https', 'permanent': True}}
+    return middleware
+
+
+def sync(router_name, labels, routes, enable_ssl_redirect, wildcard_ssl_domain, force=False, dry_run=False):
+    """Apply the IngressRoutes of changed routes and delete the IngressRoutes of removed routes
+
+    Returns a summary dict of added, changed and removed route names
+    """
+    index = routes_manager.get_index()
+    existing_hashes = {}
+    for kind in ['IngressRoute', 'Service']:
+        for resource in _list(kind, router_name):
+            route_name = resource['metadata'].get('labels', {}).get('ckan-cloud/route-name')
+            route_hash = resource['metadata'].get('annotations', {}).get(ROUTE_HASH_ANNOTATION)
+            existing_hashes.setdefault(route_name, {})[(kind, resource['metadata']['name'])] = route_hash
+    summary = {'added': [], 'changed': [], 'removed': [], 'unchanged': 0}
+    resources = [get_ssl_redirect_middleware(router_name, labels)] if enable_ssl_redirect else []
+    route_names = set()
+    for route in routes:
+        route_name = routes_manager.get_name(route)
+        # failed routes are kept as-is when forced, so they are added before generating the resources
+        route_names.add(route_name)
+        try:
+            route_resources = get_route_resources(route, router_name, labels, enable_ssl_redirect, wildcard_ssl_domain,
+                                                  routes_manager.get_backend_url(route, index=index))
+        except Exception:
+            if not force:
+                raise
+            logs.warning(f'failed to generate route resources: {route_name}')
+            continue
+        existing = existing_hashes.get(route_name, {})
+        if existing and existing == {
+            (resource['kind'], resource['metadata']['name']): resource['metadata']['annotations'][ROUTE_HASH_ANNOTATION]
+            for resource in route_resources
+        }:
+            summary['unchanged'] += 1
+            continue
+        summary['changed' if existing else 'added'].append(route_name)
+        resources += route_resources
+    summary['removed'] = sorted(name for name in existing_hashes if name and name not in route_names)
+    logs.info('traefik ingress routes', added=summary['added'], changed=summary['changed'],
+              removed=summary['removed'], unchanged=summary['unchanged'])
+    if dry_run:
+        print(yaml.safe_dump_all(resources, default_flow_style=False))
+        return summary
+    if resources:
+        kubectl.apply_many(resources)
+    for route_name in summary['removed']:
+        for kind, name in existing_hashes[route_name]:
+            kubectl.check_call(f'delete --ignore-not-found {kind} {name}')
+    # stale resources of changed routes, e.g. when extra external domains were removed
+    for route_name in summary['changed']:
+        new_names = {(r['kind'], r['metadata']['name']) for r in resources
+                     if r['metadata']['labels'].get('ckan-cloud/route-name') == route_name}
+        for kind, name in existing_hashes[route_name]:
+            if (kind, name) not in new_names:
+                kubectl.check_call(f'delete --ignore-not-found {kind} {name}')
+    return summary
+
+
+def migrate(router_name, dry_run=False):
+    """Switch a file provider traefik router to the kubernetes CRD provider
+
+    The IngressRoutes are created before traefik is reconfigured (they are ignored by the file provider),
+    so the routes are available as soon as the new traefik pods start.
+    """
+    from ckan_cloud_operator.routers import manager as routers_manager
+    router = kubectl.get(f'CkanCloudRouter {router_name}')
+    assert router['spec']['type'] in ['traefik', 'sharded-traefik'], f'unsupported router type: {router["spec"]["type"]}'
+    if router['spec'].get('provider') == 'kubernetes-crd':
+        print(f'router {router_name} is already using the kubernetes crd provider')
+        return
+    if dry_run:
+        from ckan_cloud_operator.routers.traefik import deployment as traefik_deployment
+        from ckan_cloud_operator.routers.sharded_traefik import manager as sharded_traefik_manager
+        spec = router['spec']
+        routes = routes_manager.list({'ckan-cloud/router-name': router_name})
+        if spec['type'] == 'sharded-traefik':
+            routers_routes = sharded_traefik_manager.get_routes_shards(router_name, spec, routes)
+        else:
+            routers_routes = {router_name: routes}
+        for name, name_routes in routers_routes.items():
+            sync(name, traefik_deployment.get_labels(name, spec['type']), name_routes, True,
+                 spec.get('wildcard-ssl-domain'), dry_run=True)
+        return
+    install_crds()
+    router['spec']['provider'] = 'kubernetes-crd'
+    kubectl.apply(router)
+    routers_manager.update(router_name)
+    if not router['spec'].get('hot-reload'):
+        return
+    # the dynamic config of hot reload routers is not used anymore, sharded routers have one per shard
+    for deployment_router_name in routers_manager.get_deployment_router_names(router_name):
+        kubectl.check_call(f'delete --ignore-not-found configmap router-traefik-{deployment_router_name}-dynamic')
+
+
+def delete(router_name):
+    """Delete the router IngressRoutes and Middlewares, if the traefik crds are installed"""
+    if not kubectl.get('crd ingressroutes.traefik.containo.us', required=False):
+        return
+    for kind in ['IngressRoute', 'Middleware']:
+        kubectl.check_call(f'delete --ignore-not-found -l {get_label_selector(router_name)} {kind}')
+
+
+def _get_service(route_name, labels, backend_url, resources):
+    """Returns the IngressRoute service spec, backend urls to an external host get an ExternalName service
+
+    The operator generates in-cluster backend urls as http://<service>.<namespace>:<port>, these services are
+    referenced in their namespace, which is why the traefik kubernetes CRD provider watches all namespaces
+    """
+    url = urlparse(backend_url)
+    port = url.port or (443 if url.scheme == 'https' else 80)
+    host_parts = url.hostname.split('.')
+    if (len(host_parts) == 2 and url.port) or url.hostname.endswith(('.svc', '.svc.cluster.local')):
+        service = {'name': host_parts[0], 'namespace': host_parts[1], 'port': port}
+    else:
+        external_name_service = _get_resource('Service', route_name, labels, api_version='v1')
+        external_name_service['spec'] = {'type': 'ExternalName', 'externalName': url.hostname,
+                                         'ports': [{'name': str(port), 'port': port}]}
+        resources.append(external_name_service)
+        service = {'name': route_name, 'port': port}
+    if url.scheme == 'https':
+        service['scheme'] = 'https'
+    return service
+
+
+def _get_ingress_route(name, labels, host, entrypoint, service, middlewares=None, tls=None):
+    ingress_route = _get_resource('IngressRoute', name, labels)
+    ingress_route['spec'] = {
+        'entryPoints': [entrypoint],
+        'routes': [{
+            'match': f'Host(`{host}`)',
+            'kind': 'Rule',
+            'services': [service],
+            **({'middlewares': middlewares} if middlewares else {}),
+        }],
+        **({'tls': tls} if tls else {}),
+    }
+    return ingress_route
+
+
+def _get_resource(kind, name, labels, api_version=API_VERSION):
+    resource = kubectl.get_resource(api_version, kind, name, dict(labels))
+    # the operator timestamp annotation would change the route hash on every update
+    resource['metadata']['annotations'] = {}
+    return resource
+
+
+def _list(kind, router_name):
+    res = kubectl.get(f'{kind} -l {get_label_selector(router_name)}', required=False)
+    return res.get('items', []) if res else []
@@ -1,10 +1,11 @@
-import time
 import json
+import hashlib
 from ruamel import yaml
 
 from ckan_cloud_operator import kubectl
 from ckan_cloud_operator import logs
 from ckan_cloud_operator.routers.traefik import config as traefik_router_config
+from ckan_cloud_operator.routers.traefik import crd as traefik_crd
 from ckan_cloud_operator.routers.routes import manager as routes_manager
 from ckan_cloud_operator import cloudflare
 from ckan_cloud_operator.providers.cluster import manager as cluster_manager
@@ -12,7 +13,29 @@ from ckan_cloud_operator.labels import manager as labels_manager
 from ckan_cloud_operator.config import manager as config_manager
 
 
-def _get_deployment_spec(router_name, router_type, annotations, image=None, httpauth_secrets=None, dns_provider=None):
+# number of traefik replicas for routers with hot reload enabled, unless set in the router spec
+HOT_RELOAD_DEFAULT_REPLICAS = 2
+
+# deployment annotation with a hash of the full traefik config, the update is skipped if it didn't change
+CONFIG_HASH_ANNOTATION = 'ckan-cloud/traefik-config-hash'
+
+# configmap key which stores the per-route hashes of the dynamic config
+ROUTES_HASHES_KEY = 'routes-hashes.json'
+
+# returned by _update for routers without a DNS provider, the ingress is not managed by the operator
+NO_INGRESS = 'no-ingress'
+
+# max seconds to wait for the load balancer service to get an ip / hostname
+LOAD_BALANCER_TIMEOUT_SECONDS = 600
+
+# max seconds to wait for the deployment generation to change after restarting and for the rollout to complete
+GENERATION_TIMEOUT_SECONDS = 60
+ROLLOUT_TIMEOUT_SECONDS = 600
+
+
+def _get_deployment_spec(router_name, router_type, annotations, image=None, httpauth_secrets=None, dns_provider=None,
+                         hot_reload=False, replicas=None, static_config_hash=None, crd_provider=False,
+                         acme_enabled=False):
     volume_spec = cluster_manager.get_or_create_multi_user_volume_claim(get_label_suffixes(router_name, router_type))
     httpauth_secrets_volume_mounts, httpauth_secrets_volumes = [], []
     if httpauth_secrets:
@@ -65,6 +88,17 @@ def _get_deployment_spec(router_name, router_type, annotations, image=None, http
             }
         }
     }
+    if hot_reload:
+        _add_hot_reload_deployment_spec(router_name, router_type, deployment_spec, replicas, static_config_hash,
+                                        dynamic_volume=not crd_provider)
+    if acme_enabled:
+        # a rolling update would run the old and new pods together, both writing the shared ACME storage
+        deployment_spec['strategy'] = {'type': 'Recreate'}
+    if crd_provider:
+        logs.info('Traefik deployment: using the kubernetes crd provider')
+        template = deployment_spec['template']
+        template['spec']['serviceAccountName'] = _get_resource_name(router_name)
+        template['metadata']['annotations'] = {'ckan-cloud/traefik-static-config-hash': static_config_hash}
     if dns_provider == 'route53':
         logs.info('Traefik deployment: adding SSL support using AWS Route53')
         container = deployment_spec['template']['spec']['containers'][0]
@@ -112,15 +146,74 @@ def _get_deployment_spec(router_name, router_type, annotations, image=None, http
     return deployment_spec
 
 
+def _add_hot_reload_deployment_spec(router_name, router_type, deployment_spec, replicas, static_config_hash,
+                                    dynamic_volume=True):
+    """Run multiple replicas which watch the dynamic config, only static config changes cause a rolling restart"""
+    logs.info('Traefik deployment: enabling dynamic config hot reload', replicas=replicas)
+    labels = get_labels(router_name, router_type, for_deployment=True)
+    deployment_spec['replicas'] = replicas or HOT_RELOAD_DEFAULT_REPLICAS
+    deployment_spec['strategy'] = {'type': 'RollingUpdate', 'rollingUpdate': {'maxSurge': 1, 'maxUnavailable': 0}}
+    template = deployment_spec['template']
+    template['metadata']['annotations'] = {'ckan-cloud/traefik-static-config-hash': static_config_hash}
+    template['spec']['affinity'] = {
+        'podAntiAffinity': {
+            'preferredDuringSchedulingIgnoredDuringExecution': [{
+                'weight': 100,
+                'podAffinityTerm': {
+                    'labelSelector': {'matchLabels': {'app': labels['app']}},
+                    'topologyKey': 'kubernetes.io/hostname'
+                }
+            }]
+        }
+    }
+    container = template['spec']['containers'][0]
+    container.setdefault('readinessProbe', {
+        'httpGet': {'path': '/ping', 'port': 80},
+        'periodSeconds': 5,
+        'failureThreshold': 2,
+    })
+    if dynamic_volume:
+        container['volumeMounts'].append({'name': 'etc-traefik-dynamic', 'mountPath': '/etc-traefik-dynamic'})
+        template['spec']['volumes'].append(
+            {'name': 'etc-traefik-dynamic', 'configMap': {'name': f'{_get_resource_name(router_name)}-dynamic'}}
+        )
+
+
+def get_replicas(spec, acme_enabled):
+    """Returns the number of replicas of a hot reload / crd provider deployment
+
+    Traefik doesn't support concurrent access to the ACME storage, which is shared by all the replicas,
+    so routers with let's encrypt certificates run a single replica (a single ACME writer),
+    which is recreated on rollout, see _get_deployment_spec.
+    """
+    replicas = spec.get('replicas')
+    if acme_enabled:
+        assert not replicas or replicas <= 1, (
+            f'router has {replicas} replicas with let\'s encrypt certificates, '
+            'traefik supports a single replica writing the shared ACME storage'
+        )
+        return 1
+    return replicas or HOT_RELOAD_DEFAULT_REPLICAS
+
+
 def _get_resource_name(router_name):
     return f'router-traefik-{router_name}'
 
 
+def is_hot_reload(spec):
+    return bool(spec.get('hot-reload'))
+
+
+def is_crd_provider(spec):
+    """Routes are written as IngressRoute objects which traefik watches, see traefik/crd.py"""
+    return spec.get('provider') == 'kubernetes-crd'
+
+
 def _update(router_name, spec, annotations, routes):
     dns_provider = spec.get('dns-provider', 'cloudflare')
     if dns_provider == 'none':
         logs.info('No DNS provider, not setting up ingress')
-        return
+        return NO_INGRESS
     resource_name = _get_resource_name(router_name)
     router_type = spec['type']
     cloudflare_email, cloudflare_auth_key = get_cloudflare_credentials()
@@ -128,26 +221,35 @@ def _update(router_name, spec, annotations, routes):
     logs.info('updating traefik deployment', resource_name=resource_name, router_type=router_type,
               cloudflare_email=cloudflare_email, cloudflare_auth_key_len=len(cloudflare_auth_key) if cloudflare_auth_key else 0,
               external_domains=external_domains, dns_provider=dns_provider)
-    kubectl.apply(kubectl.get_configmap(
-        resource_name, get_labels(router_name, router_type),
-        {
-            'static.yaml': yaml.safe_dump(traefik_router_config.get_static(
-                routes, cloudflare_email,
-                enable_access_log=bool(spec.get('enable-access-log')),
-                wildcard_ssl_domain=spec.get('wildcard-ssl-domain'),
-                external_domains=external_domains,
-                dns_provider=dns_provider,
-                acme_email=spec.get('acme-email'),
-                dynamic_config_file='/etc-traefik/dynamic.yaml'
-            ), default_flow_style=False),
-            'dynamic.yaml': yaml.safe_dump(traefik_router_config.get_dynamic(
-                routes, cloudflare_email,
-                wildcard_ssl_domain=spec.get('wildcard-ssl-domain'),
-                external_domains=external_domains,
-                dns_provider=dns_provider,
-            ), default_flow_style=False)
-        }
-    ))
+    hot_reload = is_hot_reload(spec)
+    crd_provider = is_crd_provider(spec)
+    if crd_provider:
+        provider_kwargs = {'kubernetes_crd_label_selector': traefik_crd.get_label_selector(router_name)}
+    elif hot_reload:
+        provider_kwargs = {'dynamic_config_dir': '/etc-traefik-dynamic'}
+    else:
+        provider_kwargs = {'dynamic_config_file': '/etc-traefik/dynamic.yaml'}
+    static_config = traefik_router_config.get_static(
+        routes, cloudflare_email,
+        enable_access_log=bool(spec.get('enable-access-log')),
+        wildcard_ssl_domain=spec.get('wildcard-ssl-domain'),
+        external_domains=external_domains,
+        dns_provider=dns_provider,
+        acme_email=spec.get('acme-email'),
+        **provider_kwargs
+    )
+    acme_enabled = bool(static_config.get('certificatesResolvers'))
+    replicas = get_replicas(spec, acme_enabled=acme_enabled)
+    static_config = yaml.safe_dump(static_config, default_flow_style=False)
+    if crd_provider:
+        configmaps = [
+            kubectl.get_configmap(resource_name, get_labels(router_name, router_type), {'static.yaml': static_config})
+        ]
+        dynamic_config = None
+    else:
+        configmaps, dynamic_config = _get_dynamic_configmaps(
+            router_name, router_type, spec, routes, cloudflare_email, static_config
+        )
     domains = {}
     httpauth_secrets = []
     for route in routes:
@@ -156,6 +258,13 @@ def _update(router_name, spec, annotations, routes):
         routes_manager.pre_deployment_hook(route, get_labels(router_name, router_type))
         if route['spec'].get('httpauth-secret') and route['spec']['httpauth-secret'] not in httpauth_secrets:
             httpauth_secrets.append(route['spec']['httpauth-secret'])
+    if crd_provider:
+        traefik_crd.update_service_account(resource_name, get_labels(router_name, router_type))
+        traefik_crd.sync(
+            router_name, get_labels(router_name, router_type), routes,
+            traefik_router_config.get_enable_ssl_redirect(dns_provider, cloudflare_email),
+            spec.get('wildcard-ssl-domain')
+        )
     load_balancer = kubectl.get_resource(
         'v1', 'Service', f'loadbalancer-{resource_name}',
         get_labels(router_name, router_type)
@@ -170,7 +279,35 @@ def _update(router_name, spec, annotations, routes):
         },
         'type': 'LoadBalancer'
     }
-    kubectl.apply(load_balancer)
+    deployment_spec = _get_deployment_spec(
+        router_name, router_type, annotations,
+        httpauth_secrets=httpauth_secrets,
+        dns_provider=dns_provider,
+        hot_reload=hot_reload,
+        replicas=replicas,
+        static_config_hash=hashlib.sha256(static_config.encode()).hexdigest()[:16],
+        crd_provider=crd_provider,
+        acme_enabled=acme_enabled
+    )
+    # hashed before the deployment operator timestamp is added
+    config_hash = hashlib.sha256(json.dumps(
+        [static_config, dynamic_config, deployment_spec], sort_keys=True
+    ).encode()).hexdigest()
+    deployment = kubectl.get_deployment(
+        resource_name, get_labels(router_name, router_type, for_deployment=True), deployment_spec,
+        # with hot reload or the crd provider the pods are restarted only when the static config changes
+        with_timestamp=not (hot_reload or crd_provider)
+    )
+    deployment['metadata']['annotations'][CONFIG_HASH_ANNOTATION] = config_hash
+    old_deployment = kubectl.get(f'deployment {resource_name}', required=False)
+    changed = not old_deployment or (
+        old_deployment['metadata'].get('annotations', {}).get(CONFIG_HASH_ANNOTATION) != config_hash
+    )
+    if changed:
+        kubectl.apply_many([*configmaps, load_balancer])
+    else:
+        logs.info('traefik config is unchanged, skipping configmaps and deployment update')
+        kubectl.apply(load_balancer)
     load_balancer_ip = get_load_balancer_ip(router_name)
     logs.info(f'load balancer ip: {load_balancer_ip}')
     from ckan_cloud_operator.providers.routers import manager as routers_manager
@@ -185,47 +322,99 @@ def _update(router_name, spec, annotations, routes):
             load_balancer_ip, cloudflare_email, cloudflare_auth_key
         )
     else:
-        for root_domain, sub_domains in domains.items():
-            for sub_domain in sub_domains:
-                routers_manager.update_dns_record(
-                    dns_provider, sub_domain, root_domain,
-                    load_balancer_ip, cloudflare_email, cloudflare_auth_key
-                )
-    kubectl.apply(kubectl.get_deployment(
-        resource_name, get_labels(router_name, router_type, for_deployment=True),
-        _get_deployment_spec(
-            router_name, router_type, annotations,
-            httpauth_secrets=httpauth_secrets,
-            dns_provider=dns_provider
+        routers_manager.update_dns_records(
+            dns_provider, domains, load_balancer_ip, cloudflare_email, cloudflare_auth_key
         )
-    ))
+    if changed:
+        kubectl.apply(deployment)
+    return changed
 
 
-def get_load_balancer_ip(router_name, failfast=False):
+def _get_dynamic_configmaps(router_name, router_type, spec, routes, cloudflare_email, static_config):
+    """Returns the configmaps with the static and file provider dynamic config, and the dynamic config yaml"""
     resource_name = _get_resource_name(router_name)
-    RETRIES = 10
-    for retries in range(RETRIES):
-        load_balancer = kubectl.get(f'service loadbalancer-{resource_name}', required=False)
-
-        if load_balancer:
-            ingresses = load_balancer.get('status', {}).get('loadBalancer', {}).get('ingress', [])
-            if len(ingresses) > 0:
-                assert len(ingresses) == 1
-                if cluster_manager.get_provider_id() == 'aws':
-                    load_balancer_hostname = ingresses[0].get('hostname')
-                    if load_balancer_hostname:
-                        return load_balancer_hostname
-                    logs.warning('Failed to get hostname, retrying %r' % ingresses[0])
-                else:
-                    load_balancer_ip = ingresses[0].get('ip')
-                    if load_balancer_ip:
-                        return load_balancer_ip
-                    logs.warning('Failed to get ip, retrying %r' % ingresses[0])
-        if failfast:
-            return None
-        else:
-            time.sleep(60)
-        assert retries < RETRIES - 1, "Gave up on waiting for load balancer IP"
+    hot_reload = is_hot_reload(spec)
+    dynamic_configmap_name = f'{resource_name}-dynamic' if hot_reload else resource_name
+    previous_dynamic_config, previous_routes_hashes = _get_previous_dynamic_config(dynamic_configmap_name)
+    dynamic_config, routes_hashes, summary = traefik_router_config.get_dynamic_incremental(
+        routes, cloudflare_email,
+        wildcard_ssl_domain=spec.get('wildcard-ssl-domain'),
+        external_domains=spec.get('external-domains'),
+        dns_provider=spec.get('dns-provider', 'cloudflare'),
+        previous_dynamic_config=previous_dynamic_config,
+        previous_routes_hashes=previous_routes_hashes,
+    )
+    logs.info('traefik dynamic config routes', added=summary['added'], changed=summary['changed'],
+              removed=summary['removed'], unchanged=summary['unchanged'])
+    dynamic_config = yaml.safe_dump(dynamic_config, default_flow_style=False)
+    dynamic_data = {
+        'dynamic.yaml': dynamic_config,
+        # traefik file provider only loads .yaml / .toml files, so this is ignored when watching the directory
+        ROUTES_HASHES_KEY: json.dumps(routes_hashes, sort_keys=True),
+    }
+    if hot_reload:
+        # the dynamic config is in a separate configmap, so that the watched directory contains only dynamic config
+        configmaps = [
+            kubectl.get_configmap(resource_name, get_labels(router_name, router_type), {'static.yaml': static_config}),
+            kubectl.get_configmap(dynamic_configmap_name, get_labels(router_name, router_type), dynamic_data),
+        ]
+    else:
+        configmaps = [kubectl.get_configmap(
+            resource_name, get_labels(router_name, router_type),
+            {'static.yaml': static_config, **dynamic_data}
+        )]
+    return configmaps, dynamic_config
+
+
+def _get_previous_dynamic_config(configmap_name):
+    """Returns the dynamic config and routes hashes from the last update, used to regenerate only changed routes"""
+    configmap = kubectl.get(f'configmap {configmap_name}', required=False)
+    data = (configmap or {}).get('data') or {}
+    if not data.get('dynamic.yaml') or not data.get(ROUTES_HASHES_KEY):
+        return None, None
+    try:
+        return yaml.safe_load(data['dynamic.yaml']), json.loads(data[ROUTES_HASHES_KEY])
+    except Exception:
+        logs.warning(f'failed to parse previous dynamic config from configmap {configmap_name}, regenerating all routes')
+        return None, None
+
+
+def get_route_names(router_name, spec):
+    """Returns the names of the routes in the current dynamic config of the router"""
+    if is_crd_provider(spec):
+        return traefik_crd.get_route_names(router_name)
+    resource_name = _get_resource_name(router_name)
+    configmap_name = f'{resource_name}-dynamic' if is_hot_reload(spec) else resource_name
+    configmap = kubectl.get(f'configmap {configmap_name}', required=False)
+    routes_hashes = ((configmap or {}).get('data') or {}).get(ROUTES_HASHES_KEY)
+    return sorted(json.loads(routes_hashes)) if routes_hashes else []
+
+
+def get_load_balancer_ip(router_name, failfast=False, timeout=LOAD_BALANCER_TIMEOUT_SECONDS):
+    resource_name = _get_resource_name(router_name)
+    address_key = 'hostname' if cluster_manager.get_provider_id() == 'aws' else 'ip'
+
+    def get_address(load_balancer):
+        ingresses = (load_balancer or {}).get('status', {}).get('loadBalancer', {}).get('ingress', [])
+        if len(ingresses) > 0:
+            assert len(ingresses) == 1
+            address = ingresses[0].get(address_key)
+            if not address:
+                logs.warning(f'Failed to get {address_key}, waiting {ingresses[0]!r}')
+            return address
+        return None
+
+    if failfast:
+        return get_address(kubectl.get(f'service loadbalancer-{resource_name}', required=False))
+    address = kubectl.wait_for(
+        'service', f'loadbalancer-{resource_name}', get_address, timeout,
+        on_progress=lambda load_balancer: logs.info(
+            f'Waiting for load balancer {address_key}', service=f'loadbalancer-{resource_name}',
+            exists=bool(load_balancer)
+        )
+    )
+    assert address, "Gave up on waiting for load balancer IP"
+    return address
 
 
 def get_cloudflare_credentials():
@@ -243,29 +432,62 @@ def update(router_name, wait_ready, spec, annotations, routes, dry_run=False):
     else:
         print('Creating new deployment')
     if not dry_run:
+        updated = {}
         annotations.update_status(
             'router', 'created',
-            lambda: _update(router_name, spec, annotations, routes),
+            lambda: updated.update(changed=_update(router_name, spec, annotations, routes)),
             force_update=True
         )
-        if expected_new_generation:
+        if updated.get('changed') is False:
+            print('Traefik config is unchanged, not reloading')
+        elif is_crd_provider(spec):
+            print('Traefik loads the updated ingress routes from the kubernetes crd provider without restarting')
+        elif is_hot_reload(spec):
+            print('Hot reload is enabled, traefik will load the updated dynamic config without restarting')
+        elif expected_new_generation:
             _scale_down_scale_up(f'router-traefik-{router_name}')
-            while True:
-                time.sleep(.2)
-                new_deployment = kubectl.get(f'deployment router-traefik-{router_name}', required=False)
-                if not new_deployment: continue
-                new_generation = new_deployment.get('metadata', {}).get('generation')
-                if not new_generation: continue
-                if new_generation == old_generation: continue
-                if new_generation != expected_new_generation:
-                    raise Exception(f'Invalid generation: {new_generation} (expected: {expected_new_generation})')
-                print(f'new deployment generation: {new_generation}')
-                break
+            new_generation = kubectl.wait_for(
+                'deployment', f'router-traefik-{router_name}',
+                lambda deployment: _get_new_generation(deployment, old_generation),
+                GENERATION_TIMEOUT_SECONDS
+            )
+            assert new_generation, f'Gave up on waiting for new deployment generation (old: {old_generation})'
+            if new_generation != expected_new_generation:
+                raise Exception(f'Invalid generation: {new_generation} (expected: {expected_new_generation})')
+            print(f'new deployment generation: {new_generation}')
         if wait_ready:
             print('Waiting for instance to be ready...')
-            while time.sleep(2):
-                if get(router_name)['ready']: break
-                print('.')
+            assert kubectl.wait_for(
+                'deployment', f'router-traefik-{router_name}', _is_rollout_complete, ROLLOUT_TIMEOUT_SECONDS,
+                on_progress=_print_rollout_progress
+            ), 'Gave up on waiting for the router deployment rollout'
+            print('Router deployment is ready')
+
+
+def _get_new_generation(deployment, old_generation):
+    generation = (deployment or {}).get('metadata', {}).get('generation')
+    return generation if generation and generation != old_generation else None
+
+
+def _is_rollout_complete(deployment):
+    """Same check as kubectl rollout status, all replicas are updated and available for the latest generation"""
+    if not deployment:
+        return False
+    status = deployment.get('status', {})
+    replicas = deployment['spec'].get('replicas', 1)
+    return (
+        status.get('observedGeneration', 0) >= deployment['metadata'].get('generation', 0)
+        and status.get('updatedReplicas', 0) >= replicas
+        and status.get('availableReplicas', 0) >= replicas
+        and status.get('replicas', 0) <= replicas
+    )
+
+
+def _print_rollout_progress(deployment):
+    if deployment:
+        status = deployment.get('status', {})
+        print(f'{status.get("updatedReplicas", 0)} updated, {status.get("availableReplicas", 0)} available '
+              f'of {deployment["spec"].get("replicas", 1)} replicas')
 
 
 def get(router_name):
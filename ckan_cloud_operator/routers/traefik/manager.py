@@ -3,6 +3,7 @@ from ckan_cloud_operator import logs
 from ckan_cloud_operator.routers.annotations import CkanRoutersAnnotations
 from ckan_cloud_operator.infra import CkanInfra
 from ckan_cloud_operator.routers.traefik import deployment as traefik_deployment
+from ckan_cloud_operator.routers.traefik import crd as traefik_crd
 
 
 def create(router):
@@ -45,6 +46,7 @@ def delete(router_name):
         kubectl.call(f'delete --ignore-not-found -l ckan-cloud/router-name={router_name} CkanCloudRoute') == 0,
         kubectl.call(f'delete --ignore-not-found CkanCloudRouter {router_name}') == 0,
     ]):
+        traefik_crd.delete(router_name)
         print('Removing finalizers')
         success = True
         routes = kubectl.get_items_by_labels('CkanCloudRoute', {'ckan-cloud/router-name': router_name}, required=False)
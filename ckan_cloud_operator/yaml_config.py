@@ -26,3 +26,15 @@ def datetime_constructor(loader, node):
 
 yaml.add_representer(datetime.datetime, datetime_representer)
 yaml.add_constructor(u'!datetime', datetime_constructor)
+
+
+### use the libyaml C loader / dumper when PyYAML was built with it
+
+
+Loader = getattr(yaml, 'CLoader', yaml.Loader)
+Dumper = getattr(yaml, 'CDumper', yaml.Dumper)
+
+if Dumper is not yaml.Dumper:
+    yaml.add_representer(datetime.datetime, datetime_representer, Dumper=Dumper)
+if Loader is not yaml.Loader:
+    yaml.add_constructor(u'!datetime', datetime_constructor, Loader=Loader)
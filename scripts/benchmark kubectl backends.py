@@ -0,0 +1,39 @@
+import os
+import time
+
+from ckan_cloud_operator import kubectl
+from ckan_cloud_operator.drivers.kubectl import api as kubectl_api
+
+
+# number of times to run each get command
+BENCHMARK_ITERATIONS = int(os.environ.get('BENCHMARK_ITERATIONS', '20'))
+
+# namespace to run the get commands in
+BENCHMARK_NAMESPACE = os.environ.get('BENCHMARK_NAMESPACE', 'ckan-cloud')
+
+# get commands to benchmark, separated by ;
+BENCHMARK_GET_COMMANDS = os.environ.get('BENCHMARK_GET_COMMANDS', 'configmap;secret;CkanCloudRoute;pods')
+
+
+def benchmark(backend, what):
+    kubectl.KUBECTL_BACKEND = backend
+    kubectl_api.reset()
+    start_time = time.time()
+    kubectl.get(what, namespace=BENCHMARK_NAMESPACE, required=False)
+    first_call_seconds = time.time() - start_time
+    start_time = time.time()
+    for _ in range(BENCHMARK_ITERATIONS):
+        kubectl.get(what, namespace=BENCHMARK_NAMESPACE, required=False)
+    return first_call_seconds, (time.time() - start_time) / BENCHMARK_ITERATIONS
+
+
+def main():
+    print(f'{"get":30} {"backend":12} {"first call (s)":>15} {"avg call (s)":>15}')
+    for what in BENCHMARK_GET_COMMANDS.split(';'):
+        for backend in ['subprocess', 'api']:
+            first_call_seconds, avg_call_seconds = benchmark(backend, what)
+            print(f'{what:30} {backend:12} {first_call_seconds:15.4f} {avg_call_seconds:15.4f}')
+
+
+if __name__ == '__main__':
+    main()
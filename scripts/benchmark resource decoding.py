@@ -0,0 +1,89 @@
+import os
+import json
+import time
+import yaml
+
+from ckan_cloud_operator import yaml_config
+from ckan_cloud_operator.drivers.kubectl import api as kubectl_api
+
+
+# path to a cluster dump created using `kubectl get <kind> -o json`, if not set a synthetic dump is generated
+BENCHMARK_DUMP_FILE = os.environ.get('BENCHMARK_DUMP_FILE')
+
+# number of synthetic CkanCloudCkanInstance objects to generate
+BENCHMARK_NUM_ITEMS = int(os.environ.get('BENCHMARK_NUM_ITEMS', '400'))
+
+BENCHMARK_ITERATIONS = int(os.environ.get('BENCHMARK_ITERATIONS', '5'))
+
+
+def get_synthetic_dump(num_items):
+    return {
+        'apiVersion': 'v1',
+        'kind': 'List',
+        'metadata': {'resourceVersion': ''},
+        'items': [
+            {
+                'apiVersion': 'stable.viderum.com/v1',
+                'kind': 'CkanCloudCkanInstance',
+                'metadata': {
+                    'name': f'instance-{i}',
+                    'namespace': 'ckan-cloud',
+                    'creationTimestamp': '2020-01-01T00:00:00Z',
+                    'resourceVersion': str(100000 + i),
+                    'uid': f'00000000-0000-0000-0000-{i:012d}',
+                    'labels': {
+                        'ckan-cloud/crd-ckaninstance-name': f'instance-{i}',
+                        'ckan-cloud/crd-singular': 'ckaninstance',
+                        'ckan-cloud/crd-name': f'instance-{i}',
+                    },
+                    'annotations': {
+                        'ckan-cloud/operator-timestamp': '2020-01-01T00:00:00Z',
+                        'ckan-cloud/status': json.dumps({'created': True, 'db-initialized': True}),
+                    },
+                },
+                'spec': {
+                    'id': f'instance-{i}',
+                    'siteUrl': f'https://instance-{i}.example.com',
+                    'siteTitle': f'Instance {i}',
+                    'ckanHelmChartRepo': 'https://raw.githubusercontent.com/ViderumGlobal/ckan-cloud-helm/master/charts_repository',
+                    'ckanHelmChartVersion': '0.0.1',
+                    'useCentralizedInfra': True,
+                    'replicas': 1,
+                    'ckanJobsDbImage': 'viderum/ckan-cloud-docker:ckan-latest',
+                    'ckan': {'image': 'viderum/ckan-cloud-docker:ckan-latest', 'resources': {'limits': {'memory': '2Gi'}}},
+                    'envvars': {f'CKAN__VAR_{j}': f'value-{j}' for j in range(20)},
+                },
+            } for i in range(num_items)
+        ]
+    }
+
+
+def benchmark(name, func, data):
+    start_cpu = time.process_time()
+    for _ in range(BENCHMARK_ITERATIONS):
+        func(data)
+    cpu_seconds = (time.process_time() - start_cpu) / BENCHMARK_ITERATIONS
+    print(f'{name:40} {cpu_seconds:10.4f}')
+    return cpu_seconds
+
+
+def main():
+    if BENCHMARK_DUMP_FILE:
+        with open(BENCHMARK_DUMP_FILE) as f:
+            dump = json.load(f)
+    else:
+        dump = get_synthetic_dump(BENCHMARK_NUM_ITEMS)
+    json_data = json.dumps(dump).encode()
+    yaml_data = yaml.safe_dump(dump, default_flow_style=False)
+    print(f'{len(dump["items"])} items, json {len(json_data)} bytes, yaml {len(yaml_data)} bytes')
+    print(f'{"decoder":40} {"cpu seconds":>10}')
+    baseline = benchmark('yaml.load (pure python)', lambda data: yaml.load(data, Loader=yaml.Loader), yaml_data)
+    if yaml_config.Loader is not yaml.Loader:
+        benchmark('yaml.load (libyaml CLoader)', lambda data: yaml.load(data, Loader=yaml_config.Loader), yaml_data)
+    benchmark('json.loads', json.loads, json_data)
+    fastest = benchmark('kubectl_api.loads' + (' (orjson)' if kubectl_api.orjson else ''), kubectl_api.loads, json_data)
+    print(f'kubectl_api.loads uses {fastest / baseline * 100:.1f}% of the pure python yaml.load cpu time')
+
+
+if __name__ == '__main__':
+    main()
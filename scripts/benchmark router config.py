@@ -0,0 +1,240 @@
+import os
+import sys
+import json
+import time
+import contextlib
+import tracemalloc
+from unittest.mock import patch
+
+from ruamel import yaml
+
+from ckan_cloud_operator.routers.routes import manager as routes_manager
+from ckan_cloud_operator.routers.traefik import config as traefik_config
+
+
+# comma-separated numbers of synthetic routes to benchmark
+BENCHMARK_ROUTE_COUNTS = [int(i) for i in os.environ.get('BENCHMARK_ROUTE_COUNTS', '100,1000,10000').split(',')]
+
+# wall time of a step is the fastest of BENCHMARK_ITERATIONS runs
+BENCHMARK_ITERATIONS = int(os.environ.get('BENCHMARK_ITERATIONS', '3'))
+
+# results of a previous run (see BENCHMARK_SAVE_BASELINE_FILE), if set the benchmark fails on regressions
+BENCHMARK_BASELINE_FILE = os.environ.get('BENCHMARK_BASELINE_FILE')
+
+# save the results to this file, to be used as BENCHMARK_BASELINE_FILE
+BENCHMARK_SAVE_BASELINE_FILE = os.environ.get('BENCHMARK_SAVE_BASELINE_FILE')
+
+# comma-separated metrics which are compared to the baseline, wall time depends on the machine so CI checks only
+# the deterministic peak_memory and size metrics
+BENCHMARK_CHECK_METRICS = os.environ.get('BENCHMARK_CHECK_METRICS', 'seconds,peak_memory,size').split(',')
+
+# allowed relative increase of peak memory and rendered config size compared to the baseline
+BENCHMARK_MAX_REGRESSION = float(os.environ.get('BENCHMARK_MAX_REGRESSION', '0.2'))
+
+# allowed relative increase of wall time, higher than BENCHMARK_MAX_REGRESSION because the baseline
+# is usually recorded on a different machine, it should still catch changes in complexity (e.g. quadratic loops)
+BENCHMARK_MAX_SECONDS_REGRESSION = float(os.environ.get('BENCHMARK_MAX_SECONDS_REGRESSION', '1.0'))
+
+# steps which complete faster / allocate less than this are not checked for wall time / peak memory regressions
+BENCHMARK_MIN_SECONDS = float(os.environ.get('BENCHMARK_MIN_SECONDS', '0.05'))
+BENCHMARK_MIN_PEAK_MEMORY = int(os.environ.get('BENCHMARK_MIN_PEAK_MEMORY', str(1024 * 1024)))
+
+ROUTER_LABELS = {'ckan-cloud/router-name': 'benchmark'}
+
+ROUTE_TYPES = ['backend-url-subdomain', 'ckan-instance-subdomain', 'app-instance-subdomain',
+               'datapusher-subdomain', 'deis-instance-subdomain']
+
+ROOT_DOMAINS = ['default', 'example.com', 'example.org']
+
+WILDCARD_SSL_DOMAIN = 'example.com'
+
+CONFIG = {
+    'label-prefix': 'ckan-cloud',
+    'crd-prefix': 'CkanCloud',
+    'installed-crd-ckaninstance': 'ckaninstances,CkanInstance,n',
+    'installed-crd-ckaninstancename': 'ckaninstancenames,CkanInstanceName,n',
+    'installed-crd-app': 'apps,App,n',
+    'installed-crd-appname': 'appnames,AppName,n',
+    'default-root-domain': 'example.net',
+}
+
+
+def get_synthetic_route(i):
+    route_type = ROUTE_TYPES[i % len(ROUTE_TYPES)]
+    spec = {
+        'backend-url-subdomain': {'backend-url': f'http://backend-{i}.ckan-cloud:8080'},
+        'ckan-instance-subdomain': {'ckan-instance-id': f'ckan-{i}'},
+        'app-instance-subdomain': {'app-instance-id': f'app-{i}'},
+        'datapusher-subdomain': {'datapusher-name': f'datapusher-{i}'},
+        'deis-instance-subdomain': {'deis-instance-id': f'deis-{i}'},
+    }[route_type]
+    spec.update({'type': route_type, 'root-domain': ROOT_DOMAINS[i % len(ROOT_DOMAINS)], 'sub-domain': f'route-{i}'})
+    if i % 10 == 0:
+        spec['extra-external-domains'] = [f'www.external-{i}.com', f'data.external-{i}.com']
+    return {
+        'apiVersion': 'stable.viderum.com/v1',
+        'kind': 'CkanCloudRoute',
+        'metadata': {
+            'name': f'route-{i}',
+            'namespace': 'ckan-cloud',
+            'labels': {**ROUTER_LABELS, 'ckan-cloud/route-type': route_type},
+        },
+        'spec': spec,
+    }
+
+
+def get_synthetic_instances(routes):
+    """Returns the ckan instance and app custom resources which the routes backend urls are resolved from"""
+    ckan_instances, apps = [], []
+    for route in routes:
+        spec = route['spec']
+        if spec['type'] == 'ckan-instance-subdomain':
+            ckan_instances.append({
+                'kind': 'CkanCloudCkanInstance',
+                'metadata': {
+                    'name': f'ckan-cloud-ckaninstance-{spec["ckan-instance-id"]}',
+                    'labels': {'ckan-cloud/instance-type': 'helm'},
+                },
+                'spec': {'id': spec['ckan-instance-id']},
+            })
+        elif spec['type'] == 'deis-instance-subdomain':
+            ckan_instances.append({
+                'kind': 'CkanCloudCkanInstance',
+                'metadata': {'name': spec['deis-instance-id']},
+                'spec': {'routes': {'target-port': 8080}},
+            })
+        elif spec['type'] == 'app-instance-subdomain':
+            apps.append({
+                'kind': 'CkanCloudApp',
+                'metadata': {
+                    'name': f'ckan-cloud-app-{spec["app-instance-id"]}',
+                    'annotations': {'ckan-cloud/deployment-provider': 'helm'},
+                },
+                'spec': {'backend-url': 'http://app.{instance_id}:8080'},
+            })
+    return {
+        'ckancloudroute': routes,
+        'ckancloudckaninstance': ckan_instances,
+        'ckancloudapp': apps,
+    }
+
+
+class StubKubectl(object):
+    """Serves kubectl.get from in-memory lists, items are returned json encoded and decoded on each get,
+    the same as the kubectl api backend"""
+
+    def __init__(self, items):
+        self.items = {kind: json.dumps({'items': kind_items}) for kind, kind_items in items.items()}
+
+    def get(self, what, *args, required=True, **kwargs):
+        kind = what.split(' ')[0].lower()
+        assert not args, f'unsupported kubectl get args: {what} {args}'
+        return json.loads(self.items.get(kind, '{"items": []}'))
+
+    def get_items_by_labels(self, resource_kind, labels, required=True, **kwargs):
+        return self.get(resource_kind)['items']
+
+    @staticmethod
+    def get_config(key=None, default=None, **kwargs):
+        return CONFIG.get(key, default) if key else dict(CONFIG)
+
+    @contextlib.contextmanager
+    def patch(self):
+        with patch('ckan_cloud_operator.kubectl.get', self.get), \
+                patch('ckan_cloud_operator.kubectl.get_items_by_labels', self.get_items_by_labels), \
+                patch('ckan_cloud_operator.config.manager.get', self.get_config):
+            yield
+
+
+def render(config):
+    return yaml.safe_dump(config, default_flow_style=False)
+
+
+def measure(func):
+    """Returns (result, wall seconds, peak memory bytes), stdout / stderr of func are discarded"""
+    seconds = None
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull), contextlib.redirect_stderr(devnull):
+        for _ in range(BENCHMARK_ITERATIONS):
+            start_time = time.perf_counter()
+            func()
+            iteration_seconds = time.perf_counter() - start_time
+            seconds = iteration_seconds if seconds is None else min(seconds, iteration_seconds)
+        tracemalloc.start()
+        try:
+            result = func()
+            _, peak_memory = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    return result, seconds, peak_memory
+
+
+def benchmark(num_routes):
+    """Yields (step, seconds, peak memory bytes, rendered config bytes) for each step"""
+    stub = StubKubectl(get_synthetic_instances([get_synthetic_route(i) for i in range(num_routes)]))
+    with stub.patch():
+        routes, seconds, peak_memory = measure(lambda: routes_manager.list(ROUTER_LABELS))
+        assert len(routes) == num_routes
+        yield 'routes_manager.list', seconds, peak_memory, len(stub.items['ckancloudroute'])
+        static_config, seconds, peak_memory = measure(lambda: render(traefik_config.get_static(
+            routes, None, enable_access_log=True, wildcard_ssl_domain=WILDCARD_SSL_DOMAIN, dns_provider='route53',
+            acme_email='admin@example.com', dynamic_config_dir='/etc-traefik-dynamic'
+        )))
+        yield 'get_static', seconds, peak_memory, len(static_config)
+        get_dynamic_incremental = lambda **kwargs: traefik_config.get_dynamic_incremental(
+            routes, None, wildcard_ssl_domain=WILDCARD_SSL_DOMAIN, dns_provider='route53', **kwargs
+        )
+        (dynamic_config, routes_hashes, summary), seconds, peak_memory = measure(get_dynamic_incremental)
+        assert len(summary['added']) == num_routes, f'failed to add routes: {summary}'
+        yield 'get_dynamic', seconds, peak_memory, None
+        (_, _, summary), seconds, peak_memory = measure(lambda: get_dynamic_incremental(
+            previous_dynamic_config=dynamic_config, previous_routes_hashes=routes_hashes
+        ))
+        assert summary['unchanged'] == num_routes, f'unexpected changed routes: {summary}'
+        yield 'get_dynamic (unchanged)', seconds, peak_memory, None
+        rendered_dynamic_config, seconds, peak_memory = measure(lambda: render(dynamic_config))
+        yield 'render dynamic', seconds, peak_memory, len(rendered_dynamic_config)
+
+
+def get_regressions(results, baseline):
+    for key, result in results.items():
+        for metric, value in result.items():
+            baseline_value = baseline.get(key, {}).get(metric)
+            if not baseline_value or value is None or metric not in BENCHMARK_CHECK_METRICS:
+                continue
+            if metric == 'seconds':
+                if max(value, baseline_value) < BENCHMARK_MIN_SECONDS:
+                    continue
+                max_regression = BENCHMARK_MAX_SECONDS_REGRESSION
+            else:
+                if metric == 'peak_memory' and max(value, baseline_value) < BENCHMARK_MIN_PEAK_MEMORY:
+                    continue
+                max_regression = BENCHMARK_MAX_REGRESSION
+            if value > baseline_value * (1 + max_regression):
+                yield f'{key} {metric}: {value} > {baseline_value} (+{(value / baseline_value - 1) * 100:.0f}%)'
+
+
+def main():
+    results = {}
+    print(f'{"routes":>8} {"step":30} {"seconds":>10} {"peak MiB":>10} {"size KiB":>10}')
+    for num_routes in BENCHMARK_ROUTE_COUNTS:
+        for step, seconds, peak_memory, size in benchmark(num_routes):
+            results[f'{num_routes}/{step}'] = {'seconds': seconds, 'peak_memory': peak_memory, 'size': size}
+            size = '' if size is None else f'{size / 1024:.1f}'
+            print(f'{num_routes:8} {step:30} {seconds:10.4f} {peak_memory / 1024 / 1024:10.2f} {size:>10}', flush=True)
+    if BENCHMARK_SAVE_BASELINE_FILE:
+        with open(BENCHMARK_SAVE_BASELINE_FILE, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if BENCHMARK_BASELINE_FILE:
+        with open(BENCHMARK_BASELINE_FILE) as f:
+            regressions = list(get_regressions(results, json.load(f)))
+        if regressions:
+            print('Regressions compared to the baseline:')
+            for regression in regressions:
+                print(regression)
+            sys.exit(1)
+        else:
+            print('No regressions compared to the baseline')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+import os
+import time
+import threading
+import subprocess
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+
+# url served by the router, requests to this url are sent continuously during the benchmark
+BENCHMARK_URL = os.environ['BENCHMARK_URL']
+
+# the router to update in the middle of the benchmark
+BENCHMARK_ROUTER_NAME = os.environ.get('BENCHMARK_ROUTER_NAME', 'instances-default')
+
+# command which updates the router, {router} is replaced with the router name
+BENCHMARK_UPDATE_COMMAND = os.environ.get('BENCHMARK_UPDATE_COMMAND', 'ckan-cloud-operator routers update {router}')
+
+# number of concurrent requests
+BENCHMARK_CONCURRENCY = int(os.environ.get('BENCHMARK_CONCURRENCY', '10'))
+
+# total benchmark duration, the update command starts after BENCHMARK_UPDATE_AT_SECONDS
+BENCHMARK_SECONDS = float(os.environ.get('BENCHMARK_SECONDS', '120'))
+BENCHMARK_UPDATE_AT_SECONDS = float(os.environ.get('BENCHMARK_UPDATE_AT_SECONDS', '20'))
+
+# timeout of a single request
+BENCHMARK_TIMEOUT = float(os.environ.get('BENCHMARK_TIMEOUT', '10'))
+
+
+def request():
+    start_time = time.time()
+    try:
+        with urllib.request.urlopen(BENCHMARK_URL, timeout=BENCHMARK_TIMEOUT) as res:
+            res.read()
+            error = res.status >= 500
+    except urllib.error.HTTPError as e:
+        error = e.code >= 500
+    except Exception:
+        error = True
+    return start_time, time.time() - start_time, error
+
+
+def run_requests(end_time, results):
+    while time.time() < end_time:
+        results.append(request())
+
+
+def run_update(update_times):
+    time.sleep(BENCHMARK_UPDATE_AT_SECONDS)
+    update_times.append(time.time())
+    subprocess.check_call(BENCHMARK_UPDATE_COMMAND.format(router=BENCHMARK_ROUTER_NAME), shell=True)
+    update_times.append(time.time())
+    print(f'update completed in {update_times[1] - update_times[0]:.2f} seconds')
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p / 100))]
+
+
+def print_phase(phase, results):
+    seconds = sorted(s for _, s, _ in results)
+    errors = sum(1 for _, _, error in results if error)
+    print(f'{phase:10} {len(results):10} {errors:10} {percentile(seconds, 50):10.4f} {percentile(seconds, 99):10.4f}')
+
+
+def main():
+    start_time = time.time()
+    results, update_times = [], []
+    update_thread = threading.Thread(target=run_update, args=(update_times,))
+    update_thread.start()
+    with ThreadPoolExecutor(BENCHMARK_CONCURRENCY) as executor:
+        for _ in range(BENCHMARK_CONCURRENCY):
+            executor.submit(run_requests, start_time + BENCHMARK_SECONDS, results)
+    update_thread.join()
+    update_start, update_end = update_times if len(update_times) == 2 else (update_times[0], time.time())
+    print(f'{"phase":10} {"requests":>10} {"errors":>10} {"p50 (s)":>10} {"p99 (s)":>10}')
+    print_phase('before', [r for r in results if r[0] < update_start])
+    print_phase('during', [r for r in results if update_start <= r[0] < update_end])
+    print_phase('after', [r for r in results if r[0] >= update_end])
+
+
+if __name__ == '__main__':
+    main()
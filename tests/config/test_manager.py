@@ -0,0 +1,48 @@
+import unittest
+from unittest.mock import patch
+
+from ckan_cloud_operator.config import manager
+
+
+@patch('ckan_cloud_operator.providers.cluster.manager.get_operator_configmap_namespace_defaults',
+       lambda configmap_name, namespace: (configmap_name or 'operator-conf', namespace or 'ckan-cloud'))
+class ConfigManagerCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        manager.clear_cache()
+
+    @patch('ckan_cloud_operator.kubectl.get')
+    def test_get_cached_until_ttl_expires(self, get):
+        get.return_value = {'data': {'foo': 'bar'}}
+        self.assertEqual(manager.get('foo'), 'bar')
+        self.assertEqual(manager.get('foo'), 'bar')
+        self.assertEqual(get.call_count, 1)
+        get.return_value = {'data': {'foo': 'baz'}}
+        with patch('time.time', return_value=manager.time.time() + manager.CONFIG_CACHE_TTL_SECONDS + 1):
+            self.assertEqual(manager.get('foo'), 'baz')
+        self.assertEqual(get.call_count, 2)
+
+    @patch('ckan_cloud_operator.kubectl.get')
+    @patch('ckan_cloud_operator.kubectl.check_call')
+    def test_delete_invalidates(self, check_call, get):
+        get.return_value = {'data': {'foo': 'bar'}}
+        manager.get('foo', configmap_name='test')
+        manager.delete(configmap_name='test')
+        get.return_value = None
+        self.assertIsNone(manager.get('foo', configmap_name='test'))
+        self.assertEqual(get.call_count, 2)
+
+    @patch('ckan_cloud_operator.config.manager.CONFIG_CACHE_PREFETCH', True)
+    @patch('ckan_cloud_operator.kubectl.get')
+    def test_prefetch(self, get):
+        get.side_effect = lambda what, *args, **kwargs: {
+            'configmap operator-conf': {'data': {'label-prefix': 'cco'}},
+            'configmaps,secrets': {'items': [
+                {'kind': 'ConfigMap', 'metadata': {'name': 'test'}, 'data': {'foo': 'bar'}},
+            ]},
+        }[what]
+        self.assertEqual(manager.get('foo', configmap_name='test'), 'bar')
+        self.assertEqual(manager.get('foo', configmap_name='test'), 'bar')
+        self.assertEqual(get.call_count, 2)
+        get.assert_any_call('configmaps,secrets', '-l', 'cco/operator-config-namespace=ckan-cloud',
+                            namespace='ckan-cloud', required=False)
@@ -0,0 +1,166 @@
+import unittest
+from unittest.mock import patch, MagicMock
+
+from ckan_cloud_operator.controller import manager as controller_manager
+from ckan_cloud_operator.controller import metrics
+from ckan_cloud_operator.controller.manager import Controller
+from ckan_cloud_operator.controller.queue import WorkQueue, RateLimiter
+
+
+def _resource(name, generation, labels=None):
+    return {'metadata': {'name': name, 'generation': generation, 'labels': labels or {}}}
+
+
+class WorkQueueTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.queue = WorkQueue(RateLimiter(base_delay=0.01, max_delay=0.05, qps=1000, burst=1000),
+                               name=self._testMethodName)
+
+    def tearDown(self):
+        self.queue.shut_down()
+
+    def test_deduplicate(self):
+        self.queue.add('a')
+        self.queue.add('b')
+        self.queue.add('a')
+        self.assertEqual(len(self.queue), 2)
+        self.assertEqual(self.queue.get(), 'a')
+        # added while processing - queued again only when done
+        self.queue.add('a')
+        self.assertEqual(self.queue.get(), 'b')
+        self.assertIsNone(self.queue.get(timeout=0.01))
+        self.queue.done('a')
+        self.assertEqual(self.queue.get(timeout=0.01), 'a')
+        self.assertEqual(metrics.WORKQUEUE_DEPTH.get(name='test_deduplicate'), 0)
+        self.assertEqual(metrics.WORKQUEUE_ADDS.get(name='test_deduplicate'), 3)
+
+    def test_rate_limited(self):
+        self.assertEqual(self.queue.rate_limiter.when('a'), 0.01)
+        self.assertEqual(self.queue.rate_limiter.when('a'), 0.02)
+        self.assertEqual(self.queue.rate_limiter.when('a'), 0.04)
+        self.assertEqual(self.queue.rate_limiter.when('a'), 0.05)
+        self.queue.forget('a')
+        self.queue.add_rate_limited('a')
+        self.assertIsNone(self.queue.get(timeout=0.001))
+        self.assertEqual(self.queue.get(timeout=1), 'a')
+        self.assertEqual(self.queue.num_requeues('a'), 1)
+
+    def test_metrics_render(self):
+        self.queue.add('a')
+        self.queue.done(self.queue.get())
+        rendered = metrics.render()
+        self.assertIn('ckan_cloud_operator_workqueue_depth{name="test_metrics_render"} 0', rendered)
+        self.assertIn('ckan_cloud_operator_workqueue_work_duration_seconds_count{name="test_metrics_render"} 1',
+                      rendered)
+        self.assertIn(
+            'ckan_cloud_operator_workqueue_queue_duration_seconds_bucket{name="test_metrics_render",le="+Inf"} 1',
+            rendered
+        )
+
+
+class ControllerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.controller = Controller(max_retries=1)
+        self.controller.queue.rate_limiter.base_delay = 0.01
+        self.reconcile_router = MagicMock()
+        self.controller.add_resource('router', 'CkanCloudRouter', self.reconcile_router)
+        self.controller.add_dependent(
+            'route', 'CkanCloudRoute',
+            lambda route: ('router', route['metadata']['labels']['ckan-cloud/router-name'])
+        )
+        self.routers = {}
+        self.controller._stores['router'] = MagicMock(get=lambda name: self.routers.get(name))
+        self.router_handler = self.controller._watches[0][2]
+        self.route_handler = self.controller._watches[1][2]
+
+    def tearDown(self):
+        self.controller.queue.shut_down()
+
+    def test_reconcile_changed_generations(self):
+        self.routers['r1'] = _resource('r1', 1)
+        self.router_handler('SYNC', self.routers['r1'])
+        self.router_handler('MODIFIED', self.routers['r1'])
+        self.assertEqual(len(self.controller.queue), 1)
+        self.controller.process_next()
+        self.reconcile_router.assert_called_once_with(self.routers['r1'])
+        # annotations changes don't change the generation
+        self.router_handler('MODIFIED', self.routers['r1'])
+        self.assertEqual(len(self.controller.queue), 0)
+        # route changes queue the router
+        self.route_handler('ADDED', _resource('route1', 1, {'ckan-cloud/router-name': 'r1'}))
+        self.route_handler('MODIFIED', _resource('route1', 1, {'ckan-cloud/router-name': 'r1'}))
+        self.assertEqual(len(self.controller.queue), 1)
+        self.controller.process_next()
+        self.assertEqual(self.reconcile_router.call_count, 2)
+
+    def test_skip_existing(self):
+        self.controller.skip_existing = True
+        self.routers['r1'] = _resource('r1', 1)
+        self.router_handler('SYNC', self.routers['r1'])
+        self.assertEqual(len(self.controller.queue), 0)
+        self.routers['r1'] = _resource('r1', 2)
+        self.router_handler('MODIFIED', self.routers['r1'])
+        self.assertEqual(len(self.controller.queue), 1)
+
+    @patch('ckan_cloud_operator.controller.manager.logs')
+    def test_retry(self, logs):
+        self.routers['r1'] = _resource('r1', 1)
+        self.reconcile_router.side_effect = Exception('failed')
+        self.router_handler('ADDED', self.routers['r1'])
+        self.controller.process_next()
+        self.assertEqual(self.controller.queue.num_requeues(('router', 'r1')), 1)
+        self.controller.process_next(timeout=1)
+        self.assertEqual(self.reconcile_router.call_count, 2)
+        # max retries reached, not retried until the router changes
+        self.assertEqual(self.controller.queue.num_requeues(('router', 'r1')), 0)
+        self.assertEqual(len(self.controller.queue), 0)
+        logs.error.assert_called()
+
+    @patch('ckan_cloud_operator.controller.manager.logs')
+    def test_no_retry(self, logs):
+        reconcile_migration = MagicMock(side_effect=Exception('failed'))
+        self.controller.add_resource('dbmigration', 'CkanCloudCkanInstanceMigration', reconcile_migration, retry=False)
+        self.controller._stores['dbmigration'] = MagicMock(get=lambda name: _resource(name, 1))
+        self.controller._watches[-1][2]('ADDED', _resource('m1', 1))
+        self.controller.process_next()
+        self.assertEqual(reconcile_migration.call_count, 1)
+        self.assertEqual(len(self.controller.queue), 0)
+        self.assertEqual(self.controller.queue.num_requeues(('dbmigration', 'm1')), 0)
+
+
+@patch('ckan_cloud_operator.crds.manager.get_resource_kind', return_value='CkanCloudCkanInstanceMigration')
+@patch('ckan_cloud_operator.kubectl.patch_annotations')
+@patch('ckan_cloud_operator.providers.ckan.db.migration.update')
+class ReconcileMigrationTestCase(unittest.TestCase):
+
+    def _migration(self, status=None, **spec):
+        migration = _resource('m1', 1)
+        migration['metadata'].update(resourceVersion='5', annotations={
+            **({controller_manager.MIGRATION_STATUS_ANNOTATION: status} if status else {})
+        })
+        migration['spec'] = {'name': 'm1', 'type': 'deis-ckan', **spec}
+        return migration
+
+    def test_not_marked(self, update, patch_annotations, _):
+        controller_manager._reconcile_migration(self._migration())
+        controller_manager._reconcile_migration(self._migration('in-progress', **{'controller-reconcile': True}))
+        controller_manager._reconcile_migration(self._migration('failed', **{'controller-reconcile': True}))
+        update.assert_not_called()
+        patch_annotations.assert_not_called()
+
+    def test_reconcile(self, update, patch_annotations, _):
+        update.return_value = iter([{'step': 'imported-data', 'msg': 'imported'}])
+        controller_manager._reconcile_migration(self._migration(**{'controller-reconcile': True}))
+        self.assertEqual([c[0][2] for c in patch_annotations.call_args_list], [
+            {controller_manager.MIGRATION_STATUS_ANNOTATION: 'in-progress'},
+            {controller_manager.MIGRATION_STATUS_ANNOTATION: 'done'},
+        ])
+        self.assertEqual(patch_annotations.call_args_list[0][1], {'resource_version': '5', 'max_conflict_retries': 0})
+
+    def test_failed(self, update, patch_annotations, _):
+        update.side_effect = Exception('import failed')
+        with self.assertRaises(Exception):
+            controller_manager._reconcile_migration(self._migration(**{'controller-reconcile': True}))
+        self.assertEqual(patch_annotations.call_args[0][2], {controller_manager.MIGRATION_STATUS_ANNOTATION: 'failed'})
@@ -0,0 +1,56 @@
+import unittest
+from unittest.mock import patch, MagicMock
+
+from ckan_cloud_operator.drivers.kubectl import api as kubectl_api
+
+
+class KubectlApiTestCase(unittest.TestCase):
+
+    def test_parse_get_args(self):
+        self.assertEqual(kubectl_api.parse_get_args('secret foo'), (['secret'], 'foo', None, False))
+        self.assertEqual(kubectl_api.parse_get_args('deployment/foo'), (['deployment'], 'foo', None, False))
+        self.assertEqual(kubectl_api.parse_get_args('pods -l app=ckan', '--all-namespaces'),
+                         (['pods'], None, 'app=ckan', True))
+        self.assertEqual(kubectl_api.parse_get_args('deployment,service --selector=a=b'),
+                         (['deployment', 'service'], None, 'a=b', False))
+
+    def test_parse_get_args_not_supported(self):
+        for what in ['all', 'pods -o json', 'secret foo bar', 'pods -l']:
+            with self.assertRaises(kubectl_api.NotSupported):
+                kubectl_api.parse_get_args(what)
+
+    def test_get_resource_path(self):
+        secret = {'path_prefix': '/api/v1', 'plural': 'secrets', 'namespaced': True}
+        namespace = {'path_prefix': '/api/v1', 'plural': 'namespaces', 'namespaced': False}
+        self.assertEqual(kubectl_api.get_resource_path(secret, 'ckan-cloud', 'foo'),
+                         '/api/v1/namespaces/ckan-cloud/secrets/foo')
+        self.assertEqual(kubectl_api.get_resource_path(secret), '/api/v1/secrets')
+        self.assertEqual(kubectl_api.get_resource_path(namespace, 'ckan-cloud', 'foo'), '/api/v1/namespaces/foo')
+
+    def test_request_refreshes_credentials(self):
+        tokens = iter(['Bearer old', 'Bearer new', 'Bearer new'])
+        configuration = MagicMock()
+        configuration.auth_settings.side_effect = lambda: {
+            'BearerToken': {'in': 'header', 'key': 'authorization', 'value': next(tokens)}
+        }
+        session = MagicMock()
+        session.request.side_effect = lambda method, url, headers, **kwargs: MagicMock(
+            status_code=401 if headers['authorization'] == 'Bearer old' else 200, content=b'{"kind": "Pod"}'
+        )
+        client = {'session': session, 'host': 'https://k8s', 'namespace': 'default', 'configuration': configuration}
+        with patch.object(kubectl_api, '_get_client', return_value=client), \
+                patch.object(kubectl_api, '_reload_client') as reload_client:
+            self.assertEqual(kubectl_api.request('GET', '/api/v1/pods/foo'), {'kind': 'Pod'})
+        reload_client.assert_called_once_with(client)
+        self.assertEqual(session.request.call_count, 2)
+
+    @patch('ckan_cloud_operator.kubectl._use_api_backend', return_value=True)
+    @patch('ckan_cloud_operator.drivers.kubectl.cache.get', return_value=None)
+    @patch('ckan_cloud_operator.drivers.kubectl.api.get')
+    def test_get_not_required_raises_non_404(self, api_get, *_):
+        from ckan_cloud_operator import kubectl
+        api_get.side_effect = kubectl_api.ApiError(404, 'not found')
+        self.assertIsNone(kubectl.get('secret foo', required=False))
+        api_get.side_effect = kubectl_api.ApiError(403, 'forbidden')
+        with self.assertRaises(kubectl_api.ApiError):
+            kubectl.get('secret foo', required=False)
@@ -0,0 +1,86 @@
+import json
+import subprocess
+import unittest
+from unittest.mock import patch
+
+from ckan_cloud_operator.drivers.kubectl import cache as kubectl_cache
+
+
+ROUTES = {
+    'items': [
+        {'metadata': {'name': 'route-1', 'labels': {'ckan-cloud/router-name': 'a'}}},
+        {'metadata': {'name': 'route-2', 'labels': {'ckan-cloud/router-name': 'b'}}},
+    ]
+}
+
+
+class KubectlCacheTestCase(unittest.TestCase):
+
+    def test_match_labels(self):
+        labels = {'app': 'ckan', 'tier': 'web'}
+        self.assertTrue(kubectl_cache.match_labels(labels, kubectl_cache.parse_label_selector('app=ckan,tier')))
+        self.assertTrue(kubectl_cache.match_labels(labels, kubectl_cache.parse_label_selector('app==ckan,!db')))
+        self.assertFalse(kubectl_cache.match_labels(labels, kubectl_cache.parse_label_selector('app!=ckan')))
+        with self.assertRaises(kubectl_cache.kubectl_api.NotSupported):
+            kubectl_cache.parse_label_selector('app in (ckan)')
+
+    @patch('ckan_cloud_operator.logs.subprocess_check_output')
+    def test_snapshot(self, subprocess_check_output):
+        from ckan_cloud_operator import kubectl
+        subprocess_check_output.return_value = json.dumps(ROUTES).encode()
+        with kubectl_cache.snapshot('CkanCloudRoute'):
+            self.assertEqual(kubectl.get('CkanCloudRoute -l ckan-cloud/router-name=b')['items'],
+                             [ROUTES['items'][1]])
+            self.assertEqual(kubectl.get('CkanCloudRoute route-1'), ROUTES['items'][0])
+            self.assertIsNone(kubectl.get('CkanCloudRoute route-3', required=False))
+            self.assertEqual(subprocess_check_output.call_count, 1)
+        kubectl.get('CkanCloudRoute')
+        self.assertEqual(subprocess_check_output.call_count, 2)
+
+    @patch('subprocess.call', return_value=0)
+    @patch('ckan_cloud_operator.logs.subprocess_check_output')
+    def test_snapshot_invalidated_on_delete(self, subprocess_check_output, subprocess_call):
+        from ckan_cloud_operator import kubectl
+        subprocess_check_output.return_value = json.dumps(ROUTES).encode()
+        with kubectl_cache.snapshot('CkanCloudRoute'):
+            self.assertEqual(kubectl.get('CkanCloudRoute route-1'), ROUTES['items'][0])
+            kubectl.call('get CkanCloudRoute route-1')
+            kubectl.get('CkanCloudRoute route-1')
+            self.assertEqual(subprocess_check_output.call_count, 1)
+            kubectl.call('delete CkanCloudRoute route-1')
+            # the deleted route is read from the cluster, not from the stale snapshot
+            subprocess_check_output.side_effect = subprocess.CalledProcessError(1, 'kubectl')
+            self.assertIsNone(kubectl.get('CkanCloudRoute route-1', required=False))
+            self.assertEqual(subprocess_check_output.call_count, 2)
+
+    @patch('ckan_cloud_operator.kubectl._use_api_backend', return_value=True)
+    @patch('ckan_cloud_operator.drivers.kubectl.api.merge_patch')
+    @patch('ckan_cloud_operator.logs.subprocess_check_output')
+    def test_snapshot_invalidated_on_patch(self, subprocess_check_output, merge_patch, _):
+        from ckan_cloud_operator import kubectl
+        subprocess_check_output.return_value = json.dumps(ROUTES).encode()
+        with patch('ckan_cloud_operator.drivers.kubectl.api.get', side_effect=kubectl_cache.kubectl_api.NotSupported):
+            with kubectl_cache.snapshot('CkanCloudRoute'):
+                kubectl.get('CkanCloudRoute route-1')
+                kubectl.patch_annotations('CkanCloudRoute', 'route-1', {'ckan-cloud/foo': 'bar'})
+                kubectl.get('CkanCloudRoute route-1')
+                self.assertEqual(subprocess_check_output.call_count, 2)
+
+    @patch('ckan_cloud_operator.drivers.kubectl.cache.Informer.start')
+    def test_informer_read_after_write(self, _):
+        informer = kubectl_cache.start('CkanCloudRoute', wait_synced=False)
+        try:
+            informer.replace(ROUTES['items'], '1')
+            self.assertEqual(kubectl_cache.get('CkanCloudRoute route-1'), ROUTES['items'][0])
+            kubectl_cache.invalidate('CkanCloudRoute', name='route-1', resource_version='3')
+            # modified resource and lists bypass the informer, other resources are still served
+            self.assertIsNone(kubectl_cache.get('CkanCloudRoute route-1'))
+            self.assertIsNone(kubectl_cache.get('CkanCloudRoute'))
+            self.assertEqual(kubectl_cache.get('CkanCloudRoute route-2'), ROUTES['items'][1])
+            informer.handle_event('MODIFIED', {'metadata': {'name': 'route-1', 'resourceVersion': '2'}})
+            self.assertIsNone(kubectl_cache.get('CkanCloudRoute route-1'))
+            informer.handle_event('MODIFIED', {'metadata': {'name': 'route-1', 'resourceVersion': '3'}})
+            self.assertEqual(kubectl_cache.get('CkanCloudRoute route-1'),
+                             {'metadata': {'name': 'route-1', 'resourceVersion': '3'}})
+        finally:
+            kubectl_cache.stop()
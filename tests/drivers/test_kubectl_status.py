@@ -0,0 +1,54 @@
+import subprocess
+import unittest
+from unittest.mock import patch
+
+from ckan_cloud_operator import kubectl
+
+
+def _pod(name):
+    return {
+        'kind': 'Pod',
+        'metadata': {'name': name, 'namespace': 'ckan-cloud', 'creationTimestamp': '2019-01-01T00:00:00Z'},
+        'spec': {'containers': [{'name': 'traefik', 'image': 'traefik:1.7'},
+                                {'name': 'sidecar', 'image': 'sidecar:1'}]},
+        'status': {}
+    }
+
+
+def _run(cmd, **kwargs):
+    pod_name, container_name = cmd[4], cmd[6]
+    if pod_name == 'pod-2' and container_name == 'sidecar':
+        raise subprocess.TimeoutExpired(cmd, kwargs['timeout'])
+    return subprocess.CompletedProcess(cmd, 0, f'{pod_name} {container_name} logs\n'.encode())
+
+
+class KubectlStatusTestCase(unittest.TestCase):
+
+    @patch('ckan_cloud_operator.kubectl.subprocess.run', side_effect=_run)
+    def test_get_pods_logs(self, run):
+        pods_logs = kubectl.get_pods_logs([('pod-1', 'traefik'), ('pod-2', 'traefik'), ('pod-2', 'sidecar')],
+                                          tail=5, timeout=3)
+        self.assertEqual(pods_logs[('pod-1', 'traefik')], (0, 'pod-1 traefik logs'))
+        self.assertEqual(pods_logs[('pod-2', 'traefik')], (0, 'pod-2 traefik logs'))
+        self.assertEqual(pods_logs[('pod-2', 'sidecar')][0], -1)
+        self.assertEqual(run.call_count, 3)
+        self.assertEqual(run.call_args[1]['timeout'], 3)
+        self.assertIn('--tail', run.call_args[0][0])
+
+    @patch('ckan_cloud_operator.kubectl.subprocess.run', side_effect=_run)
+    @patch('ckan_cloud_operator.kubectl.get')
+    def test_get_deployment_detailed_status(self, get, run):
+        get.return_value = {'items': [_pod('pod-1'), _pod('pod-2')]}
+        deployment = {'kind': 'Deployment', 'status': {}, 'metadata': {
+            'name': 'router', 'namespace': 'ckan-cloud', 'creationTimestamp': '2019-01-01T00:00:00Z', 'generation': 1
+        }}
+        status = kubectl.get_deployment_detailed_status(deployment, 'app=router', 'traefik')
+        self.assertTrue(status['ready'])
+        self.assertEqual(status['pods'][0]['main-container']['logs'], 'pod-1 traefik logs')
+        self.assertEqual(status['pods'][1]['other-containers'][0]['logs'], '')
+        self.assertEqual(run.call_count, 4)
+        run.reset_mock()
+        status = kubectl.get_deployment_detailed_status(deployment, 'app=router', 'traefik', with_logs=False)
+        self.assertTrue(status['ready'])
+        self.assertNotIn('logs', status['pods'][0]['main-container'])
+        run.assert_not_called()
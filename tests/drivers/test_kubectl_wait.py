@@ -0,0 +1,59 @@
+import unittest
+from unittest.mock import patch, MagicMock
+
+from ckan_cloud_operator import kubectl
+from ckan_cloud_operator.routers.traefik import deployment as traefik_deployment
+
+
+def _deployment(resource_version, generation=1, observed_generation=1, updated=1, available=1):
+    return {
+        'metadata': {'resourceVersion': resource_version, 'generation': generation},
+        'spec': {'replicas': 1},
+        'status': {'observedGeneration': observed_generation, 'replicas': 1,
+                   'updatedReplicas': updated, 'availableReplicas': available},
+    }
+
+
+class KubectlWaitForTestCase(unittest.TestCase):
+
+    @patch('ckan_cloud_operator.kubectl._use_api_backend', return_value=True)
+    @patch('ckan_cloud_operator.drivers.kubectl.api.watch')
+    @patch('ckan_cloud_operator.drivers.kubectl.api.list_items')
+    def test_wait_for_watch(self, list_items, watch, _):
+        list_items.return_value = {'metadata': {'resourceVersion': '1'},
+                                   'items': [_deployment('1', generation=2, available=0)]}
+        watch.return_value = iter([
+            {'type': 'BOOKMARK', 'object': {'metadata': {'resourceVersion': '2'}}},
+            {'type': 'MODIFIED', 'object': _deployment('3', generation=2, observed_generation=2, available=0)},
+            {'type': 'MODIFIED', 'object': _deployment('4', generation=2, observed_generation=2)},
+        ])
+        on_progress = MagicMock()
+        deployment = kubectl.wait_for('deployment', 'router-traefik-foo',
+                                      lambda d: d if traefik_deployment._is_rollout_complete(d) else None, 10,
+                                      on_progress=on_progress)
+        self.assertEqual(deployment['metadata']['resourceVersion'], '4')
+        self.assertEqual(on_progress.call_count, 3)
+        self.assertEqual(list_items.call_args[1]['field_selector'], 'metadata.name=router-traefik-foo')
+        self.assertEqual(watch.call_args[1]['resource_version'], '1')
+        self.assertEqual(watch.call_count, 1)
+
+    @patch('ckan_cloud_operator.kubectl._use_api_backend', return_value=False)
+    @patch('ckan_cloud_operator.kubectl.time.sleep')
+    @patch('ckan_cloud_operator.kubectl.get')
+    def test_wait_for_poll(self, get, sleep, _):
+        get.side_effect = [None, _deployment('1', available=0), _deployment('1', available=0), _deployment('2')]
+        on_progress = MagicMock()
+        deployment = kubectl.wait_for('deployment', 'router-traefik-foo', traefik_deployment._is_rollout_complete,
+                                      60, on_progress=on_progress)
+        self.assertTrue(deployment)
+        self.assertEqual(get.call_count, 4)
+        self.assertEqual(on_progress.call_count, 3)
+        self.assertEqual([c[0][0] for c in sleep.call_args_list], [1, 2, 4])
+
+    @patch('ckan_cloud_operator.kubectl._use_api_backend', return_value=False)
+    @patch('ckan_cloud_operator.kubectl.time.sleep')
+    @patch('ckan_cloud_operator.kubectl.get', return_value=None)
+    def test_wait_for_poll_timeout(self, get, sleep, _):
+        self.assertIsNone(kubectl.wait_for('service', 'loadbalancer-foo', lambda service: service, 0))
+        self.assertEqual(get.call_count, 1)
+        self.assertEqual(sleep.call_count, 0)
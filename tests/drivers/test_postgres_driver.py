@@ -0,0 +1,119 @@
+import unittest
+from unittest.mock import patch
+
+import psycopg2.extensions
+
+from ckan_cloud_operator.drivers.postgres import driver as postgres_driver
+
+
+class Cursor(object):
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def mogrify(self, sql, args=None):
+        return (sql % tuple(f"'{arg}'" for arg in args) if args else sql).encode()
+
+    def execute(self, sql, args=None):
+        self.conn.executed.append((sql.decode() if isinstance(sql, bytes) else sql, args))
+
+    def fetchall(self):
+        return self.conn.rows.pop(0)
+
+
+class Connection(object):
+
+    def __init__(self, *args, **kwargs):
+        self.closed = 0
+        self.autocommit = False
+        self.executed = []
+        self.rows = []
+        self.commits = 0
+
+    def get_transaction_status(self):
+        return psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    def cursor(self, cursor_factory=None):
+        return Cursor(self)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.closed = 1
+
+
+class PostgresDriverTestCase(unittest.TestCase):
+
+    def tearDown(self):
+        postgres_driver.close_pool()
+
+    @patch('psycopg2.connect', side_effect=Connection)
+    def test_pooled_connect(self, psycopg2_connect):
+        with postgres_driver.pooled_connect('postgresql://a', key=('', 'foo'), autocommit=True) as conn:
+            self.assertTrue(conn.autocommit)
+        with postgres_driver.pooled_connect('postgresql://a', key=('', 'foo')) as reused_conn:
+            self.assertIs(reused_conn, conn)
+            self.assertFalse(reused_conn.autocommit)
+        self.assertEqual(psycopg2_connect.call_count, 1)
+        self.assertEqual(conn.commits, 1)
+        # changed credentials of the same key open a new connection and close the old one
+        with postgres_driver.pooled_connect('postgresql://b', key=('', 'foo')) as new_conn:
+            self.assertIsNot(new_conn, conn)
+        self.assertTrue(conn.closed)
+        self.assertEqual(psycopg2_connect.call_count, 2)
+        # dead connections are not reused
+        new_conn.close()
+        with postgres_driver.pooled_connect('postgresql://b', key=('', 'foo')):
+            pass
+        self.assertEqual(psycopg2_connect.call_count, 3)
+
+    def test_create_base_dbs_and_roles(self):
+        conn = Connection()
+        conn.rows = [[('foo',)], [('foo',)]]
+        errors = postgres_driver.create_base_dbs_and_roles(conn, {'foo': 'p1', 'foo-ds': 'p2'}, {'foo-ds-ro': 'p3'},
+                                                           grant_to_user='admin')
+        self.assertEqual(errors, {'foo': ['role-exists', 'db-exists'], 'foo-ds': []})
+        self.assertFalse(conn.autocommit)
+        executed = [sql for sql, args in conn.executed]
+        self.assertEqual(executed[2], ';\n'.join([
+            """CREATE ROLE "foo-ds" WITH LOGIN PASSWORD 'p2' NOSUPERUSER NOCREATEDB NOCREATEROLE""",
+            'GRANT "foo-ds" TO postgres',
+            """CREATE ROLE "foo-ds-ro" WITH LOGIN PASSWORD 'p3' NOSUPERUSER NOCREATEDB NOCREATEROLE""",
+            'GRANT "foo-ds-ro" TO postgres',
+        ]))
+        self.assertEqual(executed[3:], [
+            'CREATE DATABASE "foo-ds";',
+            'GRANT "foo" to "admin";\nGRANT "foo-ds" to "admin"',
+        ])
+
+    def test_statement_stats(self):
+        postgres_driver.reset_statement_stats()
+        postgres_driver._record_statement('CREATE ROLE "foo" WITH LOGIN', 0.5)
+        postgres_driver._record_statement(b'CREATE ROLE "bar";\nGRANT "bar" TO postgres', 1.5)
+        self.assertEqual(postgres_driver.get_statement_stats(), {
+            'CREATE ROLE': {'count': 1, 'seconds': 0.5},
+            'CREATE ROLE (+1)': {'count': 1, 'seconds': 1.5},
+        })
+
+    @patch.object(postgres_driver, 'POOL_MAX_TOTAL_IDLE_CONNECTIONS', 2)
+    @patch('psycopg2.connect', side_effect=Connection)
+    def test_pooled_connect_max_total_idle(self, psycopg2_connect):
+        conns = {}
+        for db_name in ['foo', 'bar', 'foo', 'baz']:
+            with postgres_driver.pooled_connect('postgresql://a', key=('', db_name)) as conn:
+                conns.setdefault(db_name, conn)
+        # bar was the least recently used when baz was released
+        self.assertEqual(psycopg2_connect.call_count, 3)
+        self.assertEqual({db_name: conn.closed for db_name, conn in conns.items()}, {'foo': 0, 'bar': 1, 'baz': 0})
+        with postgres_driver.pooled_connect('postgresql://a', key=('', 'foo')) as conn:
+            self.assertIs(conn, conns['foo'])
@@ -0,0 +1,16 @@
+def get_route(name, route_type='backend-url-subdomain', sub_domain=None, root_domain='ckan.io', router_name=None,
+              backend_url=None, **spec):
+    """Returns a CkanCloudRoute, the sub domain defaults to the route name
+
+    Additional spec attributes are given as keyword arguments, e.g. **{'ckan-instance-id': 'foo'}
+    """
+    metadata = {'name': name}
+    if router_name:
+        metadata['labels'] = {'ckan-cloud/router-name': router_name}
+        spec['router_name'] = router_name
+    if backend_url:
+        spec['backend-url'] = backend_url
+    return {
+        'metadata': metadata,
+        'spec': {'type': route_type, 'sub-domain': sub_domain or name, 'root-domain': root_domain, **spec},
+    }
@@ -0,0 +1,48 @@
+import unittest
+from unittest.mock import patch
+
+from ckan_cloud_operator.providers.ckan.deployment.helm import manager as helm_manager
+
+
+def _deployment(namespace, conditions=()):
+    return {
+        'kind': 'Deployment',
+        'metadata': {'name': 'ckan', 'namespace': namespace, 'generation': 1,
+                     'creationTimestamp': '2019-01-01T00:00:00Z'},
+        'status': {'conditions': list(conditions)}
+    }
+
+
+def _pod(namespace, name, created, image='ckan:1'):
+    return {
+        'kind': 'Pod',
+        'metadata': {'name': name, 'namespace': namespace, 'labels': {'app': 'ckan'}, 'creationTimestamp': created},
+        'spec': {'containers': [{'name': 'ckan', 'image': image}]},
+        'status': {}
+    }
+
+
+class HelmDeploymentManagerTestCase(unittest.TestCase):
+
+    @patch('ckan_cloud_operator.kubectl.get')
+    def test_get_all_statuses(self, get):
+        deployments = {'items': [_deployment('instance-1'), _deployment('instance-2'), _deployment('instance-3')]}
+        pods = {'items': [
+            _pod('instance-1', 'ckan-a', '2019-01-01T00:00:00Z'),
+            _pod('instance-1', 'ckan-b', '2019-01-02T00:00:00Z'),
+            _pod('instance-2', 'ckan-a', '2019-01-01T00:00:00Z', image='ckan:1'),
+            _pod('instance-2', 'ckan-b', '2019-01-02T00:00:00Z', image='ckan:2'),
+        ]}
+        get.side_effect = lambda what, **kwargs: deployments if what.startswith('deployments') else pods
+
+        statuses = helm_manager.get_all_statuses()
+
+        self.assertEqual(get.call_count, 2)
+        self.assertEqual(statuses['instance-1'], {
+            'ready': True, 'image': 'ckan:1', 'latest_pod_name': 'ckan-b',
+            'latest_operator_timestamp': '2019-01-02T00:00:00Z'
+        })
+        self.assertFalse(statuses['instance-2']['ready'])
+        self.assertEqual(statuses['instance-2']['image'], 'ckan:2')
+        self.assertFalse(statuses['instance-3']['ready'])
+        self.assertIsNone(statuses['instance-3']['latest_pod_name'])
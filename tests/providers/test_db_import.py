@@ -0,0 +1,98 @@
+import gzip
+import os
+import subprocess
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+from ckan_cloud_operator.drivers.postgres import driver as postgres_driver
+from ckan_cloud_operator.providers.ckan.db import migration
+
+
+class MigrationImportTestCase(unittest.TestCase):
+
+    @patch('ckan_cloud_operator.providers.db.manager.import_db')
+    def test_run_imports_concurrently(self, import_db):
+        running, max_running, lock = set(), [0], threading.Lock()
+
+        def _import_db(import_url, db_name, import_user, db_prefix=None):
+            with lock:
+                running.add(db_name)
+                max_running[0] = max(max_running[0], len(running))
+            time.sleep(.05 if db_name == 'foo' else .2)
+            with lock:
+                running.remove(db_name)
+
+        import_db.side_effect = _import_db
+        events = list(migration._import_data(None, 'foo', 'foo-datastore', db_import_url='gs://a/foo.sql',
+                                             datastore_import_url='gs://a/foo-datastore.sql', db_prefix='prefix1'))
+        self.assertEqual(max_running[0], 2)
+        # an import finished before the progress interval, so no progress events
+        self.assertEqual([event['step'] for event in events],
+                         ['import-data-started', 'import-db-data', 'import-datastore-data'])
+        import_db.assert_any_call('gs://a/foo.sql', 'foo', 'foo', db_prefix='prefix1')
+        import_db.assert_any_call('gs://a/foo-datastore.sql', 'foo-datastore', 'foo-datastore', db_prefix='prefix1')
+
+    @patch.object(migration, 'IMPORT_PROGRESS_SECONDS', .05)
+    @patch('ckan_cloud_operator.providers.db.manager.import_db')
+    def test_run_imports_progress(self, import_db):
+        import_db.side_effect = lambda *args, **kwargs: time.sleep(.3)
+        events = list(migration._run_imports([('import-db-data', 'DB', 'gs://a/foo.sql', 'foo')], None, 'prefix2'))
+        self.assertEqual(events[0]['step'], 'import-data-started')
+        self.assertEqual(events[-1]['step'], 'import-db-data')
+        self.assertGreaterEqual(len(events), 3)
+        self.assertEqual({event['step'] for event in events[1:-1]}, {'import-data-progress'})
+        self.assertRegex(events[1]['msg'], r'^Importing: foo \(\d+ seconds\)$')
+
+    @patch('ckan_cloud_operator.providers.db.manager.import_db')
+    def test_skip_datastore_import(self, import_db):
+        events = list(migration._import_data(None, 'foo', 'foo-datastore', skip_datastore_import=True,
+                                             db_import_url='gs://a/foo.sql', datastore_import_url='gs://a/ds.sql'))
+        self.assertEqual([event['step'] for event in events],
+                         ['import-data-started', 'import-db-data', 'import-datastore-data'])
+        self.assertEqual(events[-1]['msg'], 'skipped')
+        self.assertEqual(import_db.call_count, 1)
+
+
+class PostgresRestoreTestCase(unittest.TestCase):
+
+    def test_get_download_command(self):
+        self.assertEqual(postgres_driver._get_download_command('gs://foo/bar baz.sql'), "gsutil cat 'gs://foo/bar baz.sql'")
+        self.assertEqual(postgres_driver._get_download_command('s3://foo/bar.sql.gz'),
+                         'aws s3 cp s3://foo/bar.sql.gz - | gunzip -c')
+
+    @patch('subprocess.check_call')
+    def test_restore_custom_format(self, check_call):
+        restored = []
+        check_call.side_effect = lambda args, env=None: restored.append((args, env, open(args[-1], 'rb').read()))
+        with tempfile.TemporaryDirectory() as tempdir:
+            dump_path = os.path.join(tempdir, 'foo.dump.gz')
+            with gzip.open(dump_path, 'wb') as f:
+                f.write(b'PGDMP' + b'x' * 100000)
+            postgres_driver.restore_from_url('postgresql://admin@db/foo', dump_path, role='foo', jobs=3)
+        (args, env, data), = restored
+        self.assertEqual(args[:-1], ['pg_restore', '--no-owner', '--no-acl', '--exit-on-error', '--jobs=3',
+                                     '--dbname=postgresql://admin@db/foo'])
+        self.assertEqual(env['PGOPTIONS'], '-c role=foo')
+        self.assertEqual(data, b'PGDMP' + b'x' * 100000)
+
+    def test_restore_plain_sql_psql_error(self):
+        popen = subprocess.Popen
+
+        def _popen(args, **kwargs):
+            if args[0] == 'psql':
+                # stops on an SQL error after reading the first statements
+                args = ['bash', '-c', 'head -c 1000 > /dev/null; exit 3']
+            return popen(args, **kwargs)
+
+        with tempfile.TemporaryDirectory() as tempdir:
+            dump_path = os.path.join(tempdir, 'foo.sql')
+            with open(dump_path, 'wb') as f:
+                f.write(b'INSERT INTO foo VALUES (1);\n' * 500000)
+            with patch('subprocess.Popen', side_effect=_popen):
+                with self.assertRaises(subprocess.CalledProcessError) as raised:
+                    postgres_driver.restore_from_url('postgresql://admin@db/foo', dump_path)
+        self.assertEqual(raised.exception.cmd, 'psql')
+        self.assertEqual(raised.exception.returncode, 3)
@@ -0,0 +1,175 @@
+import base64
+import unittest
+from unittest.mock import patch, MagicMock
+
+from ckan_cloud_operator.providers.ckan.db import registry as ckan_db_registry
+from ckan_cloud_operator.providers.db.proxy.pgbouncer import admin as pgbouncer_admin
+from ckan_cloud_operator.providers.db.proxy.pgbouncer import manager as pgbouncer_manager
+from ckan_cloud_operator.providers.db.proxy.pgbouncer import tuning as pgbouncer_tuning
+
+
+def _secret(namespace, name, **values):
+    return {
+        'metadata': {'namespace': namespace, 'name': name},
+        'data': {k: base64.b64encode(v.encode()).decode() for k, v in values.items()},
+    }
+
+
+class CkanDbRegistryTestCase(unittest.TestCase):
+
+    @patch('ckan_cloud_operator.providers.ckan.manager.instance_kind', return_value='CkanCloudCkanInstance')
+    @patch('ckan_cloud_operator.providers.db.manager.get_internal_unproxied_db_host_port', return_value=('db', 5432))
+    @patch('ckan_cloud_operator.providers.cluster.manager.get_operator_namespace_name', return_value='ckan-cloud')
+    @patch('ckan_cloud_operator.crds.manager.get_resource_name', side_effect=lambda singular, name: f'mig-{name}')
+    @patch('ckan_cloud_operator.crds.manager.get')
+    @patch('ckan_cloud_operator.kubectl.get')
+    def test_build(self, kubectl_get, crds_get, *_):
+        crds_get.return_value = {'items': [
+            {'spec': {'name': 'new-db-foo', 'type': 'new-db', 'db-name': 'foo'}},
+            {'spec': {'name': 'new-datastore-bar', 'type': 'new-datastore', 'datastore-name': 'bar-datastore'}},
+            {'spec': {'name': 'new-db-baz', 'type': 'new-db', 'db-name': 'baz'}},
+        ]}
+        kubectl_get.side_effect = lambda what, *args, **kwargs: {
+            'CkanCloudCkanInstance': {'items': [
+                {'metadata': {'name': 'foo'}, 'spec': {'db': {'name': 'foo'}, 'datastore': {'name': 'foo-ds'}}},
+            ]},
+            'secrets': {'items': [
+                _secret('foo', 'foo-annotations', databasePassword='1', datastorePassword='2',
+                        datastoreReadonlyUser='foo-ds-ro', datatastoreReadonlyPassword='3'),
+                _secret('ckan-cloud', 'mig-new-db-foo', **{'database-password': 'old'}),
+                _secret('ckan-cloud', 'mig-new-datastore-bar', **{'datastore-password': '4',
+                                                                   'datastore-readonly-password': '5',
+                                                                   'datastore-readonly-user-name': 'bar-ro'}),
+                _secret('ckan-cloud', 'mig-new-db-baz'),
+            ]},
+        }[what]
+        dbs, users = ckan_db_registry.get_all_dbs_users()
+        self.assertEqual(dbs, [('foo', 'db', 5432), ('foo-ds', 'db', 5432), ('bar-datastore', 'db', 5432)])
+        self.assertEqual(users, [('foo', '1'), ('foo-ds', '2'), ('foo-ds-ro', '3'),
+                                 ('bar-datastore', '4'), ('bar-ro', '5')])
+        self.assertEqual(kubectl_get.call_count, 2)
+
+
+class PgBouncerConfigTestCase(unittest.TestCase):
+
+    @patch('ckan_cloud_operator.providers.db.proxy.pgbouncer.manager._get_pool_sizes', return_value={'bar': 20})
+    @patch('ckan_cloud_operator.providers.db.proxy.pgbouncer.manager._config_set')
+    @patch('ckan_cloud_operator.providers.db.proxy.pgbouncer.manager._config_get')
+    def test_update_config_secret_entries(self, config_get, config_set, _):
+        config_get.return_value = pgbouncer_manager._get_config_secret_values(
+            {'foo': pgbouncer_manager._get_database_line('foo', 'db', 5432)},
+            ['[pgbouncer]', 'listen_port = 5432', 'pool_mode = transaction'],
+            {'foo': 'password1'}
+        )
+        self.assertFalse(pgbouncer_manager._update_config_secret_entries([('foo', 'db', 5432)], [('foo', 'password1')]))
+        config_set.assert_not_called()
+        self.assertTrue(pgbouncer_manager._update_config_secret_entries(
+            [('foo', 'db', 5432), ('bar', 'db', 5432)], [('bar', 'password2')]
+        ))
+        values = config_set.call_args[1]['values']
+        self.assertEqual(values['pgbouncer.ini'], '\n'.join([
+            '[databases]',
+            'foo = host=db port=5432 dbname=foo',
+            'bar = host=db port=5432 dbname=bar pool_size=20',
+            '',
+            '[pgbouncer]',
+            'listen_port = 5432',
+            'pool_mode = transaction',
+        ]))
+        self.assertEqual(values['users.txt'], '"foo" "password1"\n"bar" "password2"')
+
+    @patch('ckan_cloud_operator.providers.db.proxy.pgbouncer.admin.time.sleep')
+    @patch('ckan_cloud_operator.providers.db.manager.get_admin_db_credentials', return_value=('admin', 'pass', 'db'))
+    @patch('psycopg2.connect')
+    def test_admin_reload(self, connect, _, sleep):
+        executed = []
+        databases = {'10.0.0.1': [[('pgbouncer',)], [('pgbouncer',), ('foo',)]], '10.0.0.2': [[('foo',)]]}
+
+        class Cursor(object):
+            def __init__(self, host):
+                self.host, self.description = host, None
+
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *args):
+                pass
+
+            def execute(self, command):
+                executed.append((self.host, command))
+                self.description = [('name',)] if command == 'SHOW DATABASES' else None
+
+            def fetchall(self):
+                return databases[self.host].pop(0)
+
+        connect.side_effect = lambda host, **kwargs: MagicMock(closed=False, cursor=lambda: Cursor(host))
+        self.assertEqual(pgbouncer_admin.reload(['10.0.0.1', '10.0.0.2'], db_names=['foo']),
+                         {'10.0.0.1': set(), '10.0.0.2': set()})
+        self.assertEqual(connect.call_count, 2)
+        self.assertEqual(connect.call_args[1]['dbname'], 'pgbouncer')
+        self.assertEqual(sorted(executed), [('10.0.0.1', 'RELOAD')] * 2 + [('10.0.0.1', 'SHOW DATABASES')] * 2 +
+                         [('10.0.0.2', 'RELOAD'), ('10.0.0.2', 'SHOW DATABASES')])
+        sleep.assert_called_once_with(1)
+
+    @patch('ckan_cloud_operator.providers.db.proxy.pgbouncer.manager.time.sleep')
+    @patch('ckan_cloud_operator.kubectl.check_call')
+    @patch('ckan_cloud_operator.kubectl.check_output')
+    @patch('ckan_cloud_operator.providers.db.proxy.pgbouncer.manager._config_get')
+    def test_exec_reload(self, config_get, check_output, check_call, sleep):
+        config_get.return_value = {'pgbouncer.ini': '[databases]\nfoo = host=db', 'users.txt': '"foo" "pass"'}
+        mounted = {'pod-1': ['[databases]\n', '', '[databases]\nfoo = host=db\n', '"foo" "pass"\n'],
+                   'pod-2': ['[databases]\n', '']}
+        check_output.side_effect = lambda cmd: mounted[cmd.split()[1]].pop(0).encode()
+        self.assertEqual(pgbouncer_manager._exec_reload({'pod-1': '10.0.0.1'}), [])
+        check_call.assert_called_once_with('exec pod-1 -- pgbouncer -q -u pgbouncer -d -R /var/local/pgbouncer/pgbouncer.ini')
+        sleep.assert_called_once_with(1)
+        # not updated until the timeout, the pod is not reloaded
+        self.assertEqual(pgbouncer_manager._exec_reload({'pod-2': '10.0.0.2'}, timeout=0), ['pod-2'])
+        self.assertEqual(check_call.call_count, 1)
+
+
+class PgBouncerTuningTestCase(unittest.TestCase):
+
+    def test_get_demands(self):
+        demands = pgbouncer_tuning.get_demands({
+            'replica-1': [
+                {'database': 'pgbouncer', 'cl_active': 1},
+                {'database': 'busy', 'cl_active': 20, 'cl_waiting': 10, 'sv_active': 8},
+                {'database': 'idle', 'cl_active': 0, 'cl_waiting': 0, 'sv_active': 0, 'sv_idle': 0},
+            ],
+            'replica-2': [
+                {'database': 'busy', 'cl_active': 10, 'cl_waiting': 2, 'sv_active': 8},
+                {'database': 'quiet', 'cl_active': 0, 'sv_idle': 1},
+            ],
+        }, {
+            'replica-1': [{'database': 'busy', 'avg_xact_count': 100, 'avg_wait_time': 200000}],
+            'replica-2': [{'database': 'idle', 'avg_xact_count': 0, 'avg_wait_time': 0},
+                          {'database': 'slow', 'avg_xact_count': 1, 'avg_wait_time': 100000}],
+        })
+        self.assertEqual(demands, {'busy': 15, 'quiet': 0, 'slow': 0.5})
+
+    @patch.object(pgbouncer_tuning, 'MAX_POOL_SIZE', 30)
+    @patch.object(pgbouncer_tuning, 'MIN_POOL_SIZE', 2)
+    def test_get_pool_sizes(self):
+        self.assertEqual(pgbouncer_tuning.get_pool_sizes({'busy': 15, 'quiet': 0, 'slow': 5}, 46),
+                         {'busy': 30, 'quiet': 2, 'slow': 12})
+        pool_sizes = pgbouncer_tuning.get_pool_sizes({f'db-{i}': i for i in range(10)}, 15)
+        self.assertEqual(set(pool_sizes.values()), {1, 2})
+        self.assertLessEqual(sum(pool_sizes.values()), 15)
+        self.assertEqual(pgbouncer_tuning.get_pool_sizes({'db': 1}, 0), {})
+
+    @patch.object(pgbouncer_tuning, 'MAX_POOL_SIZE', 60)
+    @patch.object(pgbouncer_tuning, 'MIN_POOL_SIZE', 2)
+    @patch('ckan_cloud_operator.providers.db.proxy.pgbouncer.tuning.get_budget', return_value=100)
+    def test_tune(self, get_budget):
+        replicas_show = {
+            'POOLS': [{'database': 'busy', 'cl_active': 5, 'sv_active': 4}, {'database': 'slow', 'sv_active': 1}],
+            'STATS': [],
+            'CONFIG': [{'key': 'default_pool_size', 'value': '8'}, {'key': 'reserve_pool_size', 'value': '8'}],
+            'DATABASES': [{'name': name} for name in ['pgbouncer', 'busy', 'slow', 'idle-1', 'idle-2']],
+        }
+        pool_sizes = pgbouncer_tuning.tune(['10.0.0.1', '10.0.0.2'],
+                                           lambda hosts, what: {host: replicas_show[what] for host in hosts})
+        get_budget.assert_called_once_with(2)
+        # 100 - 2 active * 8 reserve - 2 idle * 8 default = 68
+        self.assertEqual(pool_sizes, {'busy': 53, 'slow': 14})
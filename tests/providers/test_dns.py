@@ -0,0 +1,46 @@
+import unittest
+from unittest.mock import patch
+
+from ckan_cloud_operator import cloudflare
+
+
+class CloudflareUpdateRecordsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        cloudflare._zone_ids.clear()
+        cloudflare._zone_records.clear()
+
+    @patch('ckan_cloud_operator.cloudflare.time.sleep')
+    @patch('ckan_cloud_operator.cloudflare.curl')
+    def test_update_records(self, curl, sleep):
+        rate_limited = []
+
+        def _curl(auth_email, auth_key, urlpart, data=None, method='GET'):
+            if urlpart.startswith('zones?name='):
+                return {'success': True, 'result': [{'id': 'z1', 'name': 'ckan.io'}]}
+            elif method == 'GET':
+                return {'success': True, 'result_info': {'total_pages': 1}, 'result': [
+                    {'id': 'r1', 'name': 'a.ckan.io', 'type': 'A', 'content': '1.2.3.4', 'proxied': False},
+                    {'id': 'r2', 'name': 'b.ckan.io', 'type': 'A', 'content': '4.3.2.1', 'proxied': False},
+                ]}
+            elif data['name'] == 'c.ckan.io' and not rate_limited:
+                rate_limited.append(urlpart)
+                return {'success': False, 'errors': [{'code': 971, 'message': 'Please wait'}]}
+            else:
+                return {'success': True, 'result': dict(data, id='new')}
+
+        curl.side_effect = _curl
+        records = {f'{sub_domain}.ckan.io': '1.2.3.4' for sub_domain in ['a', 'b', 'c']}
+
+        res = cloudflare.update_records('admin@localhost', 'key', 'ckan.io', records)
+
+        self.assertEqual(res, {'created': ['c.ckan.io'], 'updated': ['b.ckan.io'], 'unchanged': ['a.ckan.io']})
+        self.assertEqual(sleep.call_count, 1)
+        methods = sorted((c[0][2], c[0][4]) for c in curl.call_args_list if len(c[0]) > 4 and c[0][4] != 'GET')
+        self.assertEqual(methods, [('zones/z1/dns_records', 'POST'), ('zones/z1/dns_records', 'POST'),
+                                   ('zones/z1/dns_records/r2', 'PUT')])
+
+        curl.reset_mock()
+        res = cloudflare.update_records('admin@localhost', 'key', 'ckan.io', records)
+        self.assertEqual(res['unchanged'], ['a.ckan.io', 'b.ckan.io', 'c.ckan.io'])
+        curl.assert_not_called()
@@ -0,0 +1,43 @@
+import unittest
+from unittest.mock import patch
+
+from ckan_cloud_operator.routers.annotations import CkanRoutersAnnotations
+
+
+class RoutersAnnotationsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.router = {'metadata': {'name': 'datapushers', 'resourceVersion': '100', 'annotations': {}}}
+        self.annotations = CkanRoutersAnnotations('datapushers', self.router)
+
+    @patch('ckan_cloud_operator.kubectl._merge_patch')
+    def test_batch(self, merge_patch):
+        merge_patch.return_value = {'metadata': {'resourceVersion': '101'}}
+        with self.annotations.batch():
+            self.annotations.set_flag('letsencryptCloudflareEnabled')
+            self.annotations.set_status('router', 'created')
+            self.annotations.json_annotate('default-root-domain', 'test.local')
+            self.assertTrue(self.annotations.get_flag('letsencryptCloudflareEnabled'))
+            self.assertTrue(self.annotations.get_status('router', 'created'))
+            merge_patch.assert_not_called()
+        merge_patch.assert_called_once_with('ckancloudrouter', 'datapushers', {'metadata': {
+            'annotations': {
+                'ckan-cloud/letsencryptCloudflareEnabled': 'true',
+                'ckan-cloud/router-created': 'true',
+                'ckan-cloud/default-root-domain': '"test.local"',
+            },
+            'resourceVersion': '100'
+        }}, 'ckan-cloud')
+        self.assertEqual(self.router['metadata']['resourceVersion'], '101')
+        self.assertEqual(self.annotations.get_json_annotation('default-root-domain'), 'test.local')
+
+    @patch('ckan_cloud_operator.kubectl.get')
+    @patch('ckan_cloud_operator.kubectl._merge_patch')
+    def test_conflict_retry(self, merge_patch, get):
+        from ckan_cloud_operator.drivers.kubectl import api as kubectl_api
+        merge_patch.side_effect = [kubectl_api.ApiError(409, 'conflict'), {'metadata': {'resourceVersion': '102'}}]
+        get.return_value = {'metadata': {'resourceVersion': '101'}}
+        self.annotations.set_flag('letsencryptCloudflareEnabled')
+        self.assertEqual(merge_patch.call_count, 2)
+        self.assertEqual(merge_patch.call_args[0][2]['metadata']['resourceVersion'], '101')
+        self.assertEqual(self.router['metadata']['resourceVersion'], '102')
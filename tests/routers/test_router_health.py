@@ -0,0 +1,57 @@
+import http.server
+import socket
+import threading
+import unittest
+
+from ckan_cloud_operator.routers import health
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+
+    def do_HEAD(self):
+        self.send_response(200 if self.headers['Host'] == 'ok.example.com' else 503)
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class RouterHealthTestCase(unittest.TestCase):
+
+    def test_probe(self):
+        server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        with socket.socket() as s:
+            s.bind(('127.0.0.1', 0))
+            closed_port = s.getsockname()[1]
+        try:
+            results = health.probe([
+                ('ok.example.com', 'route-1', '127.0.0.1'),
+                ('down.example.com', 'route-2', '127.0.0.1'),
+            ], https=False, concurrency=1, timeout=5, port=server.server_address[1])
+            refused, = health.probe([('ok.example.com', 'route-1', '127.0.0.1')], https=False, timeout=5,
+                                    port=closed_port)
+        finally:
+            server.shutdown()
+            server.server_close()
+        self.assertEqual([(r['hostname'], r['route'], r['status']) for r in results],
+                         [('ok.example.com', 'route-1', 200), ('down.example.com', 'route-2', 503)])
+        self.assertTrue(all(r['latency_ms'] >= 0 for r in results))
+        self.assertEqual(refused['hostname'], 'ok.example.com')
+        self.assertTrue(refused['error'])
+        self.assertNotIn('status', refused)
+
+    def test_get_summary(self):
+        summary = health.get_summary([
+            {'hostname': 'a.example.com', 'status': 200, 'latency_ms': 10, 'tls_expiry_days': 60},
+            {'hostname': 'b.example.com', 'status': 302, 'latency_ms': 30, 'tls_expiry_days': 3},
+            {'hostname': 'c.example.com', 'status': 502, 'latency_ms': 20, 'tls_expiry_days': 60},
+            {'hostname': 'd.example.com', 'error': 'timeout'},
+        ])
+        self.assertEqual(summary['hostnames'], 4)
+        self.assertEqual(summary['ok'], 2)
+        self.assertEqual(summary['statuses'], {'2xx': 1, '3xx': 1, '5xx': 1, 'error': 1})
+        self.assertEqual(summary['latency-ms'], {'p50': 20, 'p95': 30, 'max': 30})
+        self.assertEqual(summary['failing'], {'c.example.com': 502, 'd.example.com': 'timeout'})
+        self.assertEqual(summary['min-tls-expiry-days'], 3)
+        self.assertEqual(summary['tls-expiring'], {'b.example.com': 3})
@@ -0,0 +1,44 @@
+import unittest
+from unittest.mock import patch
+
+from ckan_cloud_operator.routers.routes import manager as routes_manager
+
+from tests.fixtures import get_route
+
+
+def _instance(name, instance_type='helm'):
+    return {'apiVersion': 'stable.viderum.com/v1', 'kind': 'CkanCloudCkanInstance',
+            'metadata': {'name': f'cc-ckaninstance-{name}', 'labels': {'cc/instance-type': instance_type}},
+            'spec': {'id': name}}
+
+
+
+def _get_instance_route(instance_id):
+    return get_route('route', 'ckan-instance-subdomain', **{'ckan-instance-id': instance_id})
+
+class RoutesIndexTestCase(unittest.TestCase):
+
+    @patch('ckan_cloud_operator.labels.manager.get_label_prefix', return_value='cc')
+    @patch('ckan_cloud_operator.crds.manager.get_resource_name', side_effect=lambda singular, name: f'cc-{singular}-{name}')
+    @patch('ckan_cloud_operator.crds.manager.get')
+    def test_get_backend_url(self, crds_get, get_resource_name, get_label_prefix):
+        crds_get.side_effect = lambda singular, required: {
+            'ckaninstance': {'items': [_instance('instance1'), _instance('instance2')]},
+            'ckaninstancename': {'items': [{'metadata': {'name': 'cc-ckaninstancename-site'},
+                                            'spec': {'latest-instance-id': 'instance2'}}]},
+        }[singular]
+        index = routes_manager.get_index()
+        backend_urls = [
+            routes_manager.get_backend_url(_get_instance_route(instance_id), index=index)
+            for instance_id in ['instance1', 'instance2', 'site', 'instance1']
+        ]
+        self.assertEqual(backend_urls, ['http://nginx.instance1:8080', 'http://nginx.instance2:8080',
+                                        'http://nginx.instance2:8080', 'http://nginx.instance1:8080'])
+        self.assertEqual(crds_get.call_count, 2)
+        with self.assertRaisesRegex(AssertionError, 'Failed to find instance'):
+            routes_manager.get_backend_url(_get_instance_route('missing'), index=index)
+        self.assertEqual(crds_get.call_count, 2)
+        self.assertEqual(
+            routes_manager.get_backend_url(get_route('route', backend_url='http://foo'), index=index),
+            'http://foo'
+        )
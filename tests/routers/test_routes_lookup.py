@@ -0,0 +1,91 @@
+import unittest
+from unittest.mock import patch
+
+from ckan_cloud_operator.drivers.kubectl import api as kubectl_api
+from ckan_cloud_operator.routers.routes import lookup as routes_lookup
+
+from tests.fixtures import get_route
+
+
+def _route(name, sub_domain, root_domain='example.com', router_name='router-1', instance_id='instance-1', **spec):
+    return get_route(name, 'ckan-instance-subdomain', sub_domain, root_domain, router_name,
+                     **{'ckan-instance-id': instance_id}, **spec)
+
+
+class RoutesLookupTestCase(unittest.TestCase):
+
+    def test_lookup(self):
+        lookup = routes_lookup.RoutesLookup()
+        lookup.add('route-1', ['foo.example.com', 'www.foo.com'], 'router-1', 'ckan-instance/foo')
+        lookup.add('route-2', ['bar.example.com'], 'router-1', 'ckan-instance/bar')
+        lookup.add('route-3', ['www.foo.com'], 'router-2', 'ckan-instance/foo')
+        self.assertEqual(lookup.get_hostname_routes('WWW.foo.com'), ['route-1', 'route-3'])
+        self.assertEqual(lookup.get_target_routes('ckan-instance/foo'), ['route-1', 'route-3'])
+        self.assertEqual(lookup.get_router_routes('router-1'), ['route-1', 'route-2'])
+        self.assertEqual(lookup.get_conflicts('www.foo.com', 'route-1'), ['route-3'])
+        self.assertEqual(lookup.get_all_conflicts(), {'www.foo.com': ['route-1', 'route-3']})
+        lookup.sync_router('router-1', {
+            'route-2': {'hostnames': ['baz.example.com'], 'router': 'router-1', 'target': 'ckan-instance/bar'}
+        })
+        self.assertEqual(lookup.get_hostname_routes('www.foo.com'), ['route-3'])
+        self.assertEqual(lookup.get_hostname_routes('bar.example.com'), [])
+        self.assertEqual(lookup.get_hostname_routes('baz.example.com'), ['route-2'])
+        self.assertEqual(lookup.get_all_conflicts(), {})
+        lookup.remove('route-3')
+        self.assertEqual(set(lookup.hostnames), {'baz.example.com'})
+        self.assertEqual(set(lookup.targets), {'ckan-instance/bar'})
+        self.assertEqual(set(lookup.routers), {'router-1'})
+
+    @patch('ckan_cloud_operator.providers.routers.manager.get_default_root_domain', return_value='default.com')
+    @patch('ckan_cloud_operator.kubectl.apply')
+    @patch('ckan_cloud_operator.kubectl.get_resource')
+    @patch('ckan_cloud_operator.kubectl.get')
+    def test_add_route_and_reload(self, get, get_resource, apply, _):
+        get.return_value = None
+        get_resource.side_effect = lambda api_version, kind, name, labels: {'metadata': {'name': name}}
+        lookup = routes_lookup.get(reload=True)
+        self.assertEqual(lookup.routes, {})
+        conflicts = routes_lookup.add_route(_route('route-1', 'foo', root_domain='default',
+                                                   **{'extra-external-domains': ['www.Foo.com']}))
+        self.assertEqual(conflicts, {})
+        self.assertEqual(lookup.routes['route-1'], {'hostnames': ['foo.default.com', 'www.foo.com'],
+                                                    'router': 'router-1', 'target': 'ckan-instance/instance-1'})
+        conflicts = routes_lookup.add_route(_route('route-2', 'bar', instance_id='instance-2',
+                                                   **{'extra-external-domains': ['www.foo.com']}), dry_run=True)
+        self.assertEqual(conflicts, {'www.foo.com': ['route-1']})
+        self.assertNotIn('route-2', lookup.routes)
+        self.assertEqual(apply.call_count, 1)
+        get.return_value = apply.call_args[0][0]
+        self.assertEqual(routes_lookup.get(reload=True).routes, lookup.routes)
+        routes_lookup.sync_router('router-1', [])
+        self.assertEqual(routes_lookup.get().routes, {})
+        self.assertEqual(apply.call_count, 2)
+
+    @patch('ckan_cloud_operator.providers.routers.manager.get_default_root_domain', return_value='default.com')
+    @patch('ckan_cloud_operator.kubectl.apply')
+    @patch('ckan_cloud_operator.kubectl.get_resource')
+    @patch('ckan_cloud_operator.kubectl.get')
+    def test_save_conflict(self, get, get_resource, apply, _):
+        get_resource.side_effect = lambda api_version, kind, name, labels: {'metadata': {'name': name}}
+        saved = {'metadata': {'name': 'routes-lookup', 'resourceVersion': '1'}}
+        get.side_effect = lambda *args, **kwargs: saved
+        lookup = routes_lookup.get(reload=True)
+
+        def _apply(configmap):
+            if configmap['metadata'].get('resourceVersion') != saved['metadata']['resourceVersion']:
+                raise kubectl_api.ApiError(409, 'Conflict')
+            saved.update(configmap, metadata={**configmap['metadata'],
+                                              'resourceVersion': str(int(saved['metadata']['resourceVersion']) + 1)})
+            return saved
+
+        apply.side_effect = _apply
+        # another process added a route after the lookup was loaded
+        other_lookup = routes_lookup.RoutesLookup(resource_version='1')
+        other_lookup.add('route-1', ['foo.example.com'], 'router-1', 'ckan-instance/instance-1')
+        routes_lookup.save(other_lookup)
+        getattr(routes_lookup, '__LOOKUP')['lookup'] = lookup
+        conflicts = routes_lookup.add_route(_route('route-2', 'foo', router_name='router-2', instance_id='instance-2'))
+        self.assertEqual(conflicts, {'foo.example.com': ['route-1']})
+        self.assertEqual(apply.call_count, 3)
+        self.assertEqual(saved['metadata']['resourceVersion'], '3')
+        self.assertEqual(sorted(routes_lookup.get(reload=True).routes), ['route-1', 'route-2'])
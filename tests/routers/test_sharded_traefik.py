@@ -0,0 +1,54 @@
+import unittest
+from unittest.mock import patch, MagicMock
+
+from ckan_cloud_operator.routers.sharded_traefik import manager
+from ckan_cloud_operator.routers.sharded_traefik.ring import HashRing
+
+from tests.fixtures import get_route
+
+
+class HashRingTestCase(unittest.TestCase):
+
+    def test_adding_shard_moves_only_its_share(self):
+        hostnames = [f'host-{i}.ckan.io' for i in range(2000)]
+        ring = HashRing(['a', 'b', 'c'])
+        new_ring = HashRing(['a', 'b', 'c', 'd'])
+        moved = [h for h in hostnames if ring.get_shard(h) != new_ring.get_shard(h)]
+        self.assertTrue(all(new_ring.get_shard(h) == 'd' for h in moved))
+        self.assertLess(abs(len(moved) / len(hostnames) - 0.25), 0.1)
+
+
+class ShardedTraefikManagerTestCase(unittest.TestCase):
+
+    @patch('ckan_cloud_operator.routers.sharded_traefik.manager._delete_shard')
+    @patch('ckan_cloud_operator.routers.sharded_traefik.manager._get_existing_shard_names')
+    @patch('ckan_cloud_operator.routers.sharded_traefik.manager.traefik_deployment')
+    def test_update_receiving_shards_first(self, traefik_deployment, get_existing_shard_names, delete_shard):
+        routes = [get_route(f'route{i}', backend_url=f'http://route{i}') for i in range(50)]
+        old_shards = manager.get_routes_shards('r', {'shards': 3}, routes)
+        get_existing_shard_names.return_value = ['r-shard-0', 'r-shard-1', 'r-shard-2']
+        traefik_deployment.get_route_names.side_effect = lambda shard_name, spec: [
+            route['metadata']['name'] for route in old_shards.get(shard_name, [])
+        ]
+        annotations = MagicMock()
+
+        manager.update('r', False, {'shards': 4}, annotations, routes)
+
+        updated = [c[0][0] for c in traefik_deployment.update.call_args_list]
+        self.assertEqual(updated[0], 'r-shard-3')
+        self.assertEqual(sorted(updated), ['r-shard-0', 'r-shard-1', 'r-shard-2', 'r-shard-3'])
+        updated_routes = sum(len(c[0][4]) for c in traefik_deployment.update.call_args_list)
+        self.assertEqual(updated_routes, 50)
+        delete_shard.assert_not_called()
+
+    @patch('ckan_cloud_operator.routers.sharded_traefik.manager._delete_shard')
+    @patch('ckan_cloud_operator.routers.sharded_traefik.manager._get_existing_shard_names')
+    @patch('ckan_cloud_operator.routers.sharded_traefik.manager.traefik_deployment')
+    def test_update_deletes_removed_shards(self, traefik_deployment, get_existing_shard_names, delete_shard):
+        get_existing_shard_names.return_value = ['r-shard-0', 'r-shard-1', 'r-shard-2']
+        traefik_deployment.get_route_names.return_value = []
+
+        manager.update('r', False, {'shards': 2}, MagicMock(), [get_route('route1', backend_url='http://route1')])
+
+        self.assertEqual(traefik_deployment.update.call_count, 2)
+        delete_shard.assert_called_once_with('r-shard-2')
@@ -148,3 +148,59 @@ class RoutersManagerTestCase(unittest.TestCase):
             manager.update('datapushers', False, {'router-type': 'traefik'}, annotations, {'root-domain': 'ckan.io'})
         self.assertEqual(get.call_count, 2)
         self.assertEqual(annotations.update_status.call_count, 1)
+
+    @patch('ckan_cloud_operator.routers.traefik.deployment._scale_down_scale_up')
+    @patch('ckan_cloud_operator.kubectl.get')
+    def test_update_old_deployment_hot_reload(self, get, scale_down_scale_up):
+        get.return_value = {'metadata': {'generation': 1}}
+        annotations = MagicMock()
+
+        manager.update('datapushers', False, {'router-type': 'traefik', 'hot-reload': True}, annotations, {})
+        self.assertEqual(get.call_count, 1)
+        self.assertEqual(annotations.update_status.call_count, 1)
+        scale_down_scale_up.assert_not_called()
+
+    @patch('ckan_cloud_operator.config.manager.get')
+    @patch('ckan_cloud_operator.providers.cluster.manager.get_or_create_multi_user_volume_claim')
+    def test_hot_reload_deployment_spec(self, get_or_create_multi_user_volume_claim, config_get):
+        get_or_create_multi_user_volume_claim.return_value = {'persistentVolumeClaim': {'claimName': 'traefik'}}
+        config_get.return_value = None
+        annotations = MagicMock()
+        annotations.get_flag.return_value = False
+        from ckan_cloud_operator.routers.traefik import deployment
+
+        spec = deployment._get_deployment_spec('datapushers', 'traefik', annotations, hot_reload=True,
+                                               static_config_hash='abc')
+        self.assertEqual(spec['replicas'], deployment.HOT_RELOAD_DEFAULT_REPLICAS)
+        self.assertEqual(spec['strategy']['rollingUpdate']['maxUnavailable'], 0)
+        self.assertEqual(spec['template']['metadata']['annotations'], {'ckan-cloud/traefik-static-config-hash': 'abc'})
+        container = spec['template']['spec']['containers'][0]
+        self.assertEqual(container['readinessProbe']['httpGet'], {'path': '/ping', 'port': 80})
+        self.assertIn({'name': 'etc-traefik-dynamic', 'mountPath': '/etc-traefik-dynamic'}, container['volumeMounts'])
+        self.assertIn({'name': 'etc-traefik-dynamic', 'configMap': {'name': 'router-traefik-datapushers-dynamic'}},
+                      spec['template']['spec']['volumes'])
+        # a single ACME writer, the old pod is stopped before the new one starts
+        spec = deployment._get_deployment_spec('datapushers', 'traefik', annotations, hot_reload=True,
+                                               static_config_hash='abc', replicas=1, acme_enabled=True)
+        self.assertEqual(spec['replicas'], 1)
+        self.assertEqual(spec['strategy'], {'type': 'Recreate'})
+
+    def test_get_replicas(self):
+        from ckan_cloud_operator.routers.traefik import deployment
+        self.assertEqual(deployment.get_replicas({'replicas': 3}, acme_enabled=False), 3)
+        self.assertEqual(deployment.get_replicas({}, acme_enabled=False), deployment.HOT_RELOAD_DEFAULT_REPLICAS)
+        # a single ACME writer
+        self.assertEqual(deployment.get_replicas({}, acme_enabled=True), 1)
+        with self.assertRaises(AssertionError):
+            deployment.get_replicas({'replicas': 2}, acme_enabled=True)
+
+    @patch('ckan_cloud_operator.routers.traefik.deployment._update', return_value='no-ingress')
+    @patch('ckan_cloud_operator.kubectl.wait_for', return_value=4)
+    @patch('ckan_cloud_operator.routers.traefik.deployment._scale_down_scale_up')
+    @patch('ckan_cloud_operator.kubectl.get')
+    def test_update_no_ingress_is_not_unchanged(self, get, scale_down_scale_up, wait_for, _update):
+        get.return_value = {'metadata': {'generation': 1}}
+        annotations = MagicMock()
+        annotations.update_status.side_effect = lambda key, status, update_func, force_update: update_func()
+        manager.update('datapushers', False, {'router-type': 'traefik', 'dns-provider': 'none'}, annotations, {})
+        scale_down_scale_up.assert_called_once_with('router-traefik-datapushers')
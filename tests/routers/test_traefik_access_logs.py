@@ -0,0 +1,62 @@
+import gzip
+import json
+import os
+import tempfile
+import unittest
+
+from ckan_cloud_operator.routers.traefik import access_logs
+
+
+def _line(service_name, status=200, duration_ms=20, host='foo.example.com', user_agent=None):
+    return json.dumps({
+        'ServiceName': service_name,
+        'RequestHost': host,
+        'DownstreamStatus': status,
+        'DownstreamContentSize': 100,
+        'Duration': duration_ms * 1000000,
+        **({'request_User-Agent': user_agent} if user_agent else {}),
+    }).encode() + b'\n'
+
+
+class TraefikAccessLogsTestCase(unittest.TestCase):
+
+    def test_aggregate(self):
+        aggregator = access_logs.Aggregator()
+        for line in [
+            _line('route-1@file', user_agent='Mozilla/5.0 (X11; Linux x86_64) Chrome/80.0.3987.132 Safari/537.36'),
+            _line('route-1@file', status=502, duration_ms=12000),
+            _line('route-2@kubernetescrd', host='bar.example.com', status=404, duration_ms=3),
+            b'time="2020-01-01T00:00:00Z" level=info msg="Configuration loaded"\n',
+            b'{"level": "info"}\n',
+        ]:
+            aggregator.add_line(line)
+        self.assertEqual(list(aggregator.routes), ['route-1', 'bar.example.com'])
+        self.assertEqual(aggregator.skipped_lines, 2)
+        columns = aggregator.get_columns()
+        self.assertEqual(columns['requests'], [2, 1])
+        self.assertEqual(columns['status_2xx'], [1, 0])
+        self.assertEqual(columns['status_5xx'], [1, 0])
+        self.assertEqual(columns['status_4xx'], [0, 1])
+        self.assertEqual(columns['duration_us'], [12020000, 3000])
+        self.assertEqual(columns['latency_le_25ms'], [1, 0])
+        self.assertEqual(columns['latency_gt_10000ms'], [1, 0])
+        self.assertEqual(columns['latency_le_5ms'], [0, 1])
+        self.assertEqual(dict(aggregator.user_agents), {'Linux/Chrome': 1})
+
+    def test_flush_and_get_top_routes(self):
+        with tempfile.TemporaryDirectory() as output_dir:
+            access_logs.aggregate([_line('route-1@file')] * 3 + [_line('route-2@file', duration_ms=300)],
+                                  output_dir)
+            access_logs.aggregate([_line('route-2@file', duration_ms=300)] * 5, output_dir)
+            file_names = sorted(os.listdir(output_dir))
+            self.assertEqual(len(file_names), 2)
+            with gzip.open(os.path.join(output_dir, file_names[0]), 'rt') as f:
+                data = json.load(f)
+            self.assertEqual(data['routes'], ['route-1', 'route-2'])
+            self.assertEqual(set(data['columns']), set(access_logs.COLUMNS))
+            top_routes = access_logs.get_top_routes(output_dir, limit=1)
+            self.assertEqual(len(top_routes), 1)
+            self.assertEqual(top_routes[0]['route'], 'route-2')
+            self.assertEqual(top_routes[0]['requests'], 6)
+            self.assertEqual(top_routes[0]['p95_ms'], 500)
+            self.assertAlmostEqual(top_routes[0]['avg_ms'], 300)
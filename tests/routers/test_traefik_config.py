@@ -0,0 +1,34 @@
+import unittest
+from unittest.mock import patch
+
+from ckan_cloud_operator.routers.traefik import config
+
+from tests.fixtures import get_route
+
+
+class TraefikDynamicConfigTestCase(unittest.TestCase):
+
+    @patch('ckan_cloud_operator.routers.traefik.config.routes_manager')
+    def test_get_dynamic_incremental(self, routes_manager):
+        routes_manager.get_name.side_effect = lambda route: route['metadata']['name']
+        routes_manager.get_backend_url.side_effect = lambda route, index=None: route['spec']['backend-url']
+        routes_manager.get_frontend_hostname.side_effect = lambda route: f'{route["spec"]["sub-domain"]}.ckan.io'
+        routes_manager.get_domain_parts.side_effect = lambda route: ('ckan.io', route['spec']['sub-domain'])
+        routes = [get_route(name, backend_url=f'http://{name}') for name in ['a', 'b', 'c']]
+
+        dynamic_config, routes_hashes, summary = config.get_dynamic_incremental(routes, 'admin@localhost')
+        self.assertEqual(summary, {'added': ['a', 'b', 'c'], 'changed': [], 'removed': [], 'unchanged': 0})
+        self.assertEqual(sorted(dynamic_config['http']['services']), ['a', 'b', 'c'])
+        self.assertEqual(routes_hashes['a']['routers'], ['http-a', 'https-a'])
+
+        routes_manager.get_frontend_hostname.reset_mock()
+        routes = [get_route(name, backend_url=f'http://{host}') for name, host in [('a', 'a'), ('b', 'b2'), ('d', 'd')]]
+        new_dynamic_config, new_routes_hashes, summary = config.get_dynamic_incremental(
+            routes, 'admin@localhost', previous_dynamic_config=dynamic_config, previous_routes_hashes=routes_hashes
+        )
+        self.assertEqual(summary, {'added': ['d'], 'changed': ['b'], 'removed': ['c'], 'unchanged': 1})
+        self.assertEqual(routes_manager.get_frontend_hostname.call_count, 2)
+        self.assertEqual(sorted(new_dynamic_config['http']['services']), ['a', 'b', 'd'])
+        self.assertEqual(new_dynamic_config['http']['services']['b']['loadBalancer']['servers'], [{'url': 'http://b2'}])
+        self.assertEqual(new_dynamic_config['http']['routers']['https-a'], dynamic_config['http']['routers']['https-a'])
+        self.assertEqual(new_routes_hashes['a'], routes_hashes['a'])
@@ -0,0 +1,106 @@
+import unittest
+from unittest.mock import patch
+
+from ckan_cloud_operator.routers.traefik import config, crd
+
+from tests.fixtures import get_route
+
+
+LABELS = {'ckan-cloud/router-name': 'r', 'ckan-cloud/router-type': 'traefik'}
+
+
+def _get_route_resources(route_name, backend_url, enable_ssl_redirect=True):
+    return crd.get_route_resources(get_route(route_name, backend_url=backend_url), 'r', LABELS, enable_ssl_redirect,
+                                   None, backend_url)
+
+
+class TraefikCrdTestCase(unittest.TestCase):
+
+    def test_get_route_resources(self):
+        resources = _get_route_resources('a', 'http://nginx.instance-a:8080')
+        self.assertEqual([r['metadata']['name'] for r in resources], ['a-http', 'a-https'])
+        http_route = resources[0]['spec']['routes'][0]
+        self.assertEqual(http_route['match'], 'Host(`a.ckan.io`)')
+        self.assertEqual(http_route['services'], [{'name': 'nginx', 'namespace': 'instance-a', 'port': 8080}])
+        self.assertEqual(http_route['middlewares'], [{'name': 'r-ssl-redirect'}])
+        self.assertEqual(resources[1]['spec']['tls']['certResolver'], 'myresolver')
+        self.assertEqual(len({r['metadata']['annotations'][crd.ROUTE_HASH_ANNOTATION] for r in resources}), 1)
+
+    def test_get_route_resources_external_name(self):
+        resources = _get_route_resources('b', 'https://example.com', enable_ssl_redirect=False)
+        self.assertEqual(resources[0]['kind'], 'Service')
+        self.assertEqual(resources[0]['spec']['externalName'], 'example.com')
+        self.assertEqual(resources[1]['spec']['routes'][0]['services'], [{'name': 'b', 'port': 443, 'scheme': 'https'}])
+
+    @patch('ckan_cloud_operator.kubectl.check_call')
+    @patch('ckan_cloud_operator.kubectl.apply_many')
+    @patch('ckan_cloud_operator.routers.traefik.crd._list')
+    def test_sync(self, _list, apply_many, check_call):
+        unchanged = _get_route_resources('a', 'http://a.ns:80')
+        changed = _get_route_resources('b', 'http://b.ns:80')
+        removed = _get_route_resources('c', 'http://c.ns:80')
+        _list.side_effect = lambda kind, router_name: [*unchanged, *changed, *removed] if kind == 'IngressRoute' else []
+        routes = [get_route(name, backend_url=f'http://{host}.ns:80')
+                  for name, host in [('a', 'a'), ('b', 'b2'), ('d', 'd')]]
+
+        summary = crd.sync('r', LABELS, routes, True, None)
+
+        self.assertEqual(summary, {'added': ['d'], 'changed': ['b'], 'removed': ['c'], 'unchanged': 1})
+        applied = [r['metadata']['name'] for r in apply_many.call_args[0][0]]
+        self.assertEqual(applied, ['r-ssl-redirect', 'b-http', 'b-https', 'd-http', 'd-https'])
+        self.assertEqual(sorted(c[0][0] for c in check_call.call_args_list),
+                         ['delete --ignore-not-found IngressRoute c-http', 'delete --ignore-not-found IngressRoute c-https'])
+
+    @patch('ckan_cloud_operator.kubectl.check_call')
+    @patch('ckan_cloud_operator.kubectl.apply_many')
+    @patch('ckan_cloud_operator.routers.traefik.crd._list')
+    def test_sync_external_to_in_cluster(self, _list, apply_many, check_call):
+        existing = _get_route_resources('a', 'https://example.com', enable_ssl_redirect=False)
+        _list.side_effect = lambda kind, router_name: [r for r in existing if r['kind'] == kind]
+
+        summary = crd.sync('r', LABELS, [get_route('a', backend_url='http://nginx.instance-a:8080')], False, None)
+
+        self.assertEqual(summary, {'added': [], 'changed': ['a'], 'removed': [], 'unchanged': 0})
+        self.assertEqual([r['metadata']['name'] for r in apply_many.call_args[0][0]], ['a-http', 'a-https'])
+        check_call.assert_called_once_with('delete --ignore-not-found Service a')
+
+    def test_get_service(self):
+        for backend_url, expected_service in [
+            ('http://nginx.instance-a:8080', {'name': 'nginx', 'namespace': 'instance-a', 'port': 8080}),
+            ('http://nginx.instance-a.svc.cluster.local', {'name': 'nginx', 'namespace': 'instance-a', 'port': 80}),
+            ('https://nginx.instance-a.svc', {'name': 'nginx', 'namespace': 'instance-a', 'port': 443,
+                                              'scheme': 'https'}),
+        ]:
+            resources = []
+            self.assertEqual(crd._get_service('a', LABELS, backend_url, resources), expected_service)
+            self.assertEqual(resources, [])
+
+    def test_get_service_external(self):
+        for backend_url, external_name, port in [
+            ('http://example.com', 'example.com', 80),
+            ('http://www.example.com:8080', 'www.example.com', 8080),
+        ]:
+            resources = []
+            self.assertEqual(crd._get_service('a', LABELS, backend_url, resources), {'name': 'a', 'port': port})
+            external_name_service, = resources
+            self.assertEqual(external_name_service['spec'], {'type': 'ExternalName', 'externalName': external_name,
+                                                             'ports': [{'name': str(port), 'port': port}]})
+
+    def test_static_config_watches_all_namespaces(self):
+        static_config = config.get_static([], None, kubernetes_crd_label_selector=crd.get_label_selector('r'))
+        self.assertEqual(static_config['providers'], {'kubernetesCRD': {'labelSelector': 'ckan-cloud/router-name=r'}})
+
+    @patch('ckan_cloud_operator.routers.manager.update')
+    @patch('ckan_cloud_operator.routers.manager.get_deployment_router_names', return_value=['r-shard-0', 'r-shard-1'])
+    @patch('ckan_cloud_operator.routers.traefik.crd.install_crds')
+    @patch('ckan_cloud_operator.kubectl.check_call')
+    @patch('ckan_cloud_operator.kubectl.apply')
+    @patch('ckan_cloud_operator.kubectl.get')
+    def test_migrate_sharded_hot_reload(self, get, apply, check_call, *_):
+        get.return_value = {'spec': {'type': 'sharded-traefik', 'hot-reload': True}}
+        crd.migrate('r')
+        self.assertEqual(apply.call_args[0][0]['spec']['provider'], 'kubernetes-crd')
+        self.assertEqual([c[0][0] for c in check_call.call_args_list], [
+            'delete --ignore-not-found configmap router-traefik-r-shard-0-dynamic',
+            'delete --ignore-not-found configmap router-traefik-r-shard-1-dynamic',
+        ])